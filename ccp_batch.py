@@ -0,0 +1,277 @@
+"""Headless batch runs of the optimization, driven by a YAML or JSON config file.
+
+Usage:
+    python ccp_batch.py config.yaml --workers 4 --output results/
+
+The config mirrors the 'params' dict and the 'optimization_periods' of ccp_project. Ex (YAML):
+
+    data:
+        path: /data/cross-cutting/           # folder of the Excel files (default: ccp_data.path)
+        first_date: 1969 01 31
+        last_date: 2018 01 01
+        indicators: [Monetary Policy, International Trade, Risk Sentiment, Growth, Inflation]
+        assets:                              # [name, file, sheet, column], RFR at the end (default: ccp_data.assets_files)
+            - [Equities, Asset classes.xlsx, S&P index, SPXT]
+            - [Bonds, Asset classes.xlsx, Barclays index, Barclays]
+            - [RFR, Asset classes.xlsx, Risk-free asset, RFA]
+    freq: M
+    optimization_periods:
+        - [1980 01 01, 1989 12 31]
+        - [1990 01 01, 1999 12 31]
+    params:
+        target_vol: {sharpe_ratio: null}
+        periods: 120
+        granularity: 2
+        method: quantile
+        thresholds: [-1.2, 1.2]
+        reduce_indic: {Growth: 0.5, Inflation: 0.5}
+        rescale_vol: true
+        momentum_weighting: false
+        directions: directions.csv           # or {Growth: {Equities: 1, Bonds: -1}, ...} (default: default_directions())
+        compact: false                       # float32 macro data and int8 intensities (also --compact)
+        high_frequency: false                # with freq B or W-FRI: incremental signals and moments
+    output: results/
+
+Every key is optional: the defaults are the ones of ccp_project.
+
+With --instrument, the time, calls, optimizer iterations and bytes allocated of each stage of the
+optimization are recorded per date (see ccp_instrument) and written to instrumentation.csv.
+With --memory, the peak and cumulative memory allocated by some stages are measured as well (with tracemalloc,
+which slows down the run): --memory all, or groups and stages of ccp_instrument.memory_groups, e.g.
+--memory data_slice,optimizer (implies --instrument).
+
+With --report, the charts of the results (see ccp_report) are saved as PNG files in the folder report/ of the
+output folder, with an index.html page. The charts whose data has not changed are not rendered again.
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+from ccp_functions import *
+from ccp_instrument import enable_instrumentation, take_records, merge_records, memory_tracing, instrumentation_table, instrumentation_summary
+import ccp_data
+import ccp_project
+
+
+#%%
+
+#==============================================================================
+# CONFIGURATION
+#==============================================================================
+
+# reads a YAML (.yaml / .yml) or JSON config file and returns a dict
+def load_config(filename):
+    with open(filename) as f:
+        if os.path.splitext(filename)[1].lower() in [".yaml", ".yml"]:
+            try:
+                import yaml
+            except ImportError:
+                raise ImportError('PyYAML is required to read "%s" (or use a JSON config)' % filename)
+
+            return yaml.safe_load(f) or {}
+
+        return json.load(f)
+
+
+# optimization periods of the config, as a list of tuples of strings (default: ccp_project.optimization_periods)
+def config_periods(config):
+    periods = config.get("optimization_periods", ccp_project.optimization_periods)
+
+    return [(str(start_date), str(end_date)) for start_date, end_date in periods]
+
+
+#%%
+
+#==============================================================================
+# DATA
+#==============================================================================
+
+# loads the data described in the "data" section of the config, and treats it for portfolio optimization
+# returns the params of the function 'optimization' (ccp_project.default_params updated with the "params" section)
+def config_params(config):
+    data = config.get("data", {})
+    freq = config.get("freq", ccp_project.freq)
+
+    # the files are read as path + filename: the folder may be given without its trailing separator
+    path = os.path.join(data.get("path", ccp_data.path), "")
+    first_date = str(data.get("first_date", ccp_data.first_date))
+    last_date = str(data.get("last_date", ccp_data.last_date))
+
+    dtindex = ccp_data.daily_index(first_date, last_date)
+    asset_classes = ccp_data.load_asset_classes(path, dtindex, data.get("assets", ccp_data.assets_files))
+    macro_data = ccp_data.load_macro_data(path, dtindex)
+
+    if "indicators" in data:
+        macro_data = macro_data[data["indicators"]]
+
+    # data treated for portfolio optimization
+    Y_assets = data_returns(asset_classes, first_date, last_date, freq, 1)
+    X_macro = data_lagged(macro_data, first_date, last_date, freq, 1)
+
+    params = ccp_project.default_params(X_macro, macro_data, Y_assets, first_date, last_date, freq)
+    params.update(config.get("params", {}))
+
+    # compact mode: the workers get the daily data in float32 with a validity bitmask (see compact_panel)
+    if params.get('compact') == True:
+        params['macro_data'] = compact_panel(macro_data)
+
+    return params
+
+
+#%%
+
+#==============================================================================
+# BATCH RUN
+#==============================================================================
+
+# params shared by all the periods, set once in each worker process
+worker_params = {}
+
+def init_worker(params, instrument=False, memory=None):
+    worker_params.clear()
+    worker_params.update(params)
+
+    if instrument:
+        enable_instrumentation(memory=memory)
+
+
+# optimization of one period in a worker process
+# returns the results, the time spent and the instrumentation records of the period (None if not instrumented)
+def run_period(period):
+    start = time.time()
+
+    params = dict(worker_params)
+    params['start_date'], params['end_date'] = period
+
+    results = ccp_project.optimization(**params)
+
+    return results, time.time() - start, take_records()
+
+
+# runs the optimization on each period, in parallel on "workers" processes (in this process if workers <= 1)
+# returns the list of results (one DataFrame per period) and the list of the time spent on each period
+# if the instrumentation is enabled in this process, the records of the workers are merged into its records
+def run_periods(params, optimization_periods, workers=1):
+    instrument = take_records()
+
+    if workers <= 1:
+        init_worker(params)
+        outputs = [run_period(period) for period in optimization_periods]
+    else:
+        from concurrent.futures import ProcessPoolExecutor
+
+        with ProcessPoolExecutor(max_workers=workers, initializer=init_worker,
+                                 initargs=(params, instrument is not None, memory_tracing())) as executor:
+            outputs = list(executor.map(run_period, optimization_periods))
+
+    merge_records(instrument)
+    for output in outputs:
+        merge_records(output[2])
+
+    return [output[0] for output in outputs], [output[1] for output in outputs]
+
+
+# writes the results of each period, the strategy_analysis table, the timings and the instrumentation table in the output folder
+def write_results(output, optimization_periods, strategy_results, analysis, timings, instrumentation=None):
+    if not os.path.isdir(output):
+        os.makedirs(output)
+
+    for period, period_results in zip(optimization_periods, strategy_results):
+        period_results.to_csv(os.path.join(output, "strategy %s.csv" % period_name(period)), index_label="Dates")
+
+    analysis.to_csv(os.path.join(output, "strategy_analysis.csv"))
+
+    with open(os.path.join(output, "timings.json"), "w") as f:
+        json.dump(timings, f, indent=4)
+
+    if instrumentation is not None:
+        instrumentation.to_csv(os.path.join(output, "instrumentation.csv"))
+
+
+# stages traced by tracemalloc from the --memory argument: None, True ('all'), or the list of groups / stages
+def memory_argument(memory):
+    if memory is None:
+        return None
+    if memory == "all":
+        return True
+
+    return [name.strip() for name in memory.split(",") if name.strip()]
+
+
+# formats the timings as a small table for the console
+def timings_table(timings):
+    lines = ["%-30s %10s" % ("Stage", "Seconds")]
+    lines += ["%-30s %10.3f" % (stage, seconds) for stage, seconds in timings["stages"].items()]
+    lines += ["%-30s %10.3f" % ("optimization " + period, seconds) for period, seconds in timings["periods"].items()]
+    lines += ["%-30s %10.3f" % ("total", timings["total"])]
+
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Runs the macro momentum optimization headless, from a YAML or JSON config file.")
+    parser.add_argument("config", help="YAML or JSON config file (see the module docstring)")
+    parser.add_argument("--workers", type=int, default=1, help="number of worker processes (default: 1, no parallelism)")
+    parser.add_argument("--output", default=None, help="output folder (default: 'output' of the config, or 'results')")
+    parser.add_argument("--instrument", action="store_true", help="records the time, calls, optimizer iterations and bytes of each stage per date")
+    parser.add_argument("--memory", default=None, help="measures the memory allocated by stages with tracemalloc: 'all', or groups / stages separated by commas")
+    parser.add_argument("--report", action="store_true", help="renders the charts of the results to PNG files and an HTML page (see ccp_report)")
+    parser.add_argument("--compact", action="store_true", help="compact mode: float32 macro data and int8 intensities, less memory per worker")
+    args = parser.parse_args(argv)
+
+    start = time.time()
+
+    if args.instrument or args.memory:
+        enable_instrumentation(memory=memory_argument(args.memory))
+    timings = {"stages": {}, "periods": {}}
+
+    config = load_config(args.config)
+    if args.compact:
+        config.setdefault("params", {})["compact"] = True
+    optimization_periods = config_periods(config)
+    output = args.output or config.get("output", "results")
+
+    stage_start = time.time()
+    params = config_params(config)
+    timings["stages"]["data"] = time.time() - stage_start
+
+    stage_start = time.time()
+    strategy_results, periods_timings = run_periods(params, optimization_periods, args.workers)
+    timings["stages"]["optimization"] = time.time() - stage_start
+    timings["periods"] = dict(zip(period_names_list(optimization_periods), periods_timings))
+
+    stage_start = time.time()
+    analysis = strategy_analysis(optimization_periods, strategy_results, params['Y_assets'], params['freq'])
+    timings["stages"]["analysis"] = time.time() - stage_start
+
+    if args.report:
+        import ccp_report
+
+        stage_start = time.time()
+        ccp_report.render_report(optimization_periods, strategy_results, params['Y_assets'], params['freq'],
+                                 os.path.join(output, "report"), args.workers)
+        timings["stages"]["report"] = time.time() - stage_start
+
+    timings["total"] = time.time() - start
+    timings["workers"] = args.workers
+
+    instrumentation = instrumentation_table() if args.instrument or args.memory else None
+
+    write_results(output, optimization_periods, strategy_results, analysis, timings, instrumentation)
+
+    print(analysis.sort_index(axis=1).loc(axis=1)[:, 'Sharpe Ratio'])
+    print("")
+    print(timings_table(timings))
+
+    if args.instrument or args.memory:
+        print("")
+        print(instrumentation_summary())
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,314 @@
+"""Benchmarks of each stage of the pipeline on synthetic data (the Bloomberg workbooks are not needed).
+
+Usage:
+    python ccp_benchmark.py --years 40 --indicators 5 --assets 2 --output benchmark.json
+    python ccp_benchmark.py --output new.json --baseline benchmark.json     # compares with a previous run
+
+The synthetic data is deterministic for a given scale and seed, so that two runs (e.g. before and after
+a change) time exactly the same computations. The results are written as JSON:
+
+    {"scale": {"years": 40, "indicators": 5, "assets": 2, "seed": 0, "freq": "M", ...},
+     "environment": {"python": ..., "numpy": ..., "pandas": ..., "scipy": ...},
+     "results": {"data_returns": {"min": 0.004, "median": 0.005, "repeat": 5}, ...}}
+
+A stage which cannot run (no Excel engine for import_time_series) has a "skipped" entry with the reason
+instead of timings.
+"""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+
+from ccp_functions import *
+import ccp_project
+
+
+#%%
+
+#==============================================================================
+# SYNTHETIC DATA
+#==============================================================================
+
+# names of the synthetic indicators and assets: the ones of ccp_data first, then numbered ones
+names_indicators = ["Monetary Policy", "International Trade", "Risk Sentiment", "Growth", "Inflation"]
+names_assets = ["Equities", "Bonds"]
+
+def synthetic_names(names, prefix, n):
+    return (names + ["%s %i" % (prefix, i + 1) for i in range(len(names), n)])[:n]
+
+
+# deterministic synthetic data, in the same format as ccp_data (daily index, forward filled):
+# - macro_data: daily one-year changes of random walks (the first year is NaN), one column per indicator
+# - asset_classes: index levels of monthly returns (forward filled on the days of the month), RFR at the end
+# returns asset_classes, macro_data
+def synthetic_data(years=40, nb_indicators=5, nb_assets=2, seed=0, first_date="1969 01 31"):
+    rng = np.random.RandomState(seed)
+
+    dtindex = pd.date_range(start=first_date, periods=int(round(365.25 * years)), freq='D')
+
+    # macro indicators
+    indicators = synthetic_names(names_indicators, "Indicator", nb_indicators)
+    levels = pd.DataFrame(rng.normal(0.0, 0.01, (len(dtindex), nb_indicators)).cumsum(axis=0), index=dtindex, columns=indicators)
+    macro_data = levels - levels.shift(365)
+
+    # monthly returns of the assets, with different volatilities, and a constant risk-free rate
+    assets = synthetic_names(names_assets, "Asset", nb_assets)
+    month_ends = pd.date_range(start=dtindex[0], end=dtindex[-1], freq='M')
+    volatilities = np.linspace(0.01, 0.06, nb_assets)
+    returns = rng.normal(0.005, 1.0, (len(month_ends), nb_assets)) * volatilities
+    returns = np.hstack([returns, np.full((len(month_ends), 1), 0.003)])
+
+    asset_classes = pd.DataFrame(100.0 * np.cumprod(1.0 + returns, axis=0), index=month_ends, columns=assets + ["RFR"])
+    asset_classes = asset_classes.reindex(index=dtindex).ffill().fillna(100.0)
+
+    return asset_classes, macro_data
+
+
+# deterministic signal directions (indicators x assets, RFR excluded) of the synthetic data
+def synthetic_directions(indicators, assets, seed=0):
+    rng = np.random.RandomState(seed)
+
+    return pd.DataFrame(rng.choice([-1, 1], (len(indicators), len(assets))), index=indicators, columns=assets)
+
+
+# writes the columns of data as sheets of an Excel file (one sheet per column, with a "Dates" column),
+# in the format read by import_time_series
+def synthetic_workbook(filename, data):
+    with pd.ExcelWriter(filename) as writer:
+        for column in data.columns:
+            data[[column]].to_excel(writer, sheet_name=column[:31], index_label="Dates")
+
+
+# synthetic results of a strategy on each period (format of the function 'optimization'):
+# equal weights on all the assets (RFR included)
+def synthetic_strategy_results(Y_assets, periods):
+    weights = np.full(len(Y_assets.columns), 1.0 / len(Y_assets.columns))
+
+    strategy_results = []
+
+    for start_date, end_date in periods:
+        period_returns = Y_assets.loc[start_date:end_date]
+
+        results = pd.DataFrame(np.tile(weights, (len(period_returns), 1)), index=period_returns.index, columns=Y_assets.columns)
+        results["Return"] = period_returns.values.dot(weights)
+
+        strategy_results.append(results)
+
+    return strategy_results
+
+
+#%%
+
+#==============================================================================
+# BENCHMARKS
+#==============================================================================
+
+# times "repeat" calls of func, returns the min and median time in seconds
+def time_function(func, args=(), kwargs=None, repeat=5):
+    kwargs = kwargs or {}
+    times = []
+
+    for i in range(repeat):
+        start = time.perf_counter()
+        func(*args, **kwargs)
+        times.append(time.perf_counter() - start)
+
+    return {"min": min(times), "median": float(np.median(times)), "repeat": repeat}
+
+
+# runs the benchmark of each stage of the pipeline on synthetic data at the given scale
+# optimization is timed on the last "optimization_years" of the data, "optimization_repeat" times (it is the slowest stage)
+# returns a dict stage -> {"min", "median", "repeat"} (or {"skipped": reason})
+def benchmark_suite(years=40, nb_indicators=5, nb_assets=2, seed=0, freq="M", repeat=5,
+                    optimization_years=2, optimization_repeat=1, periods=120, solver='SLSQP'):
+    asset_classes, macro_data = synthetic_data(years, nb_indicators, nb_assets, seed)
+    first_date, last_date = str(macro_data.index[0].date()), str(macro_data.index[-1].date())
+
+    results = {}
+
+    ################################
+    # import of the Excel files
+
+    folder = tempfile.mkdtemp()
+    try:
+        column = macro_data.columns[0]
+        synthetic_workbook(os.path.join(folder, "macro.xlsx"), macro_data[[column]].dropna())
+
+        results["import_time_series"] = time_function(import_time_series, (folder + os.sep, "macro.xlsx", column, macro_data.index), repeat=repeat)
+        results["import_time_series_chunked"] = time_function(import_time_series_chunked, (folder + os.sep, "macro.xlsx", column, macro_data.index), repeat=repeat)
+    except ImportError as e:
+        for stage in ["import_time_series", "import_time_series_chunked"]:
+            if stage not in results:
+                results[stage] = {"skipped": "no Excel engine (%s)" % e}
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+
+    ################################
+    # transforms of the daily data
+
+    results["shift_time_series"] = time_function(shift_time_series, (macro_data, 365), repeat=repeat)
+    results["diff_time_series"] = time_function(diff_time_series, (macro_data, 365), repeat=repeat)
+    results["returns_time_series"] = time_function(returns_time_series, (asset_classes, 365), repeat=repeat)
+    results["relative_time_series"] = time_function(relative_time_series, (asset_classes, 365), repeat=repeat)
+    results["ratio_relative_time_series"] = time_function(ratio_relative_time_series, (asset_classes, 180, 1080, True), repeat=repeat)
+    results["geometric_mean"] = time_function(geometric_mean, (asset_classes,), repeat=repeat)
+    results["moving_average"] = time_function(moving_average, (macro_data, 30), repeat=repeat)
+    results["weighted_moving_average"] = time_function(weighted_moving_average, (macro_data, [30, 365], [3, 1]), repeat=repeat)
+    results["decaying_moving_average"] = time_function(decaying_moving_average, (macro_data, [30, 30, 30], [3, 2, 1]), repeat=repeat)
+    results["data_lagged"] = time_function(data_lagged, (macro_data, first_date, last_date, freq, 1), repeat=repeat)
+    results["data_returns"] = time_function(data_returns, (asset_classes, first_date, last_date, freq, 1), repeat=repeat)
+    results["merge_time_series_list"] = time_function(merge_time_series_list, ([macro_data[column].dropna() for column in macro_data.columns] +
+                                                                               [asset_classes[column].dropna() for column in asset_classes.columns],
+                                                                               macro_data.index), repeat=repeat)
+
+    ################################
+    # signal and optimization at the last date of the data
+
+    Y_assets = data_returns(asset_classes, first_date, last_date, freq, 1)
+    X_macro = data_lagged(macro_data, first_date, last_date, freq, 1)
+
+    date = X_macro.index[-1]
+    date_shifted = X_macro.index[-2]
+    indicator = X_macro.columns[0]
+
+    results["signal_intensity"] = time_function(signal_intensity, (X_macro[indicator], macro_data[indicator], date, "quantile", 2), repeat=repeat)
+
+    directions = synthetic_directions(X_macro.columns, Y_assets.columns[:-1], seed)
+
+    si = signal_intensity(X_macro[indicator], macro_data[indicator], date, "quantile", 2)
+    sd = signal_directions(Y_assets.columns[:-1], indicator, directions)
+    bnds = signal_boundaries(si, sd, 2)
+
+    results["signal_boundaries"] = time_function(signal_boundaries, (si, sd, 2), repeat=repeat)
+    init_weights = list(0.5 * si * sd) + [0.0]
+
+    results["portfolio_optimize"] = time_function(portfolio_optimize, (init_weights, 'sharpe_ratio', bnds, Y_assets, date_shifted, freq, periods, solver), repeat=repeat)
+
+    ################################
+    # whole optimization, on the last optimization_years of the data
+
+    start_date = str((macro_data.index[-1] - pd.DateOffset(years=optimization_years)).date())
+
+    params = ccp_project.default_params(X_macro, macro_data, Y_assets, start_date, last_date, freq)
+    params['periods'] = periods
+    params['directions'] = directions
+    params['solver'] = solver
+    params['reduce_indic'] = {indicator: 0.5 for indicator in ["Growth", "Inflation"] if indicator in X_macro.columns} or False
+
+    results["optimization"] = time_function(ccp_project.optimization, kwargs=params, repeat=optimization_repeat)
+
+    ################################
+    # analysis of the results of a strategy on 4 periods
+
+    analysis_periods = [(str(dates[0].date()), str(dates[-1].date())) for dates in np.array_split(Y_assets.index[periods:], 4)]
+    strategy_results = synthetic_strategy_results(Y_assets, analysis_periods)
+
+    results["strategy_analysis"] = time_function(strategy_analysis, (analysis_periods, strategy_results, Y_assets, freq), repeat=repeat)
+
+    return results
+
+
+# versions of the environment, to interpret the differences between two benchmarks
+def environment():
+    import scipy
+
+    return {
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "pandas": pd.__version__,
+        "scipy": scipy.__version__,
+        "machine": platform.machine(),
+        "processor": platform.processor()
+        }
+
+
+#%%
+
+#==============================================================================
+# COMPARISON
+#==============================================================================
+
+# compares the min timings of two benchmarks (dicts loaded from the JSON files)
+# returns a DataFrame (one row per stage) with the baseline and current timings, their ratio,
+# and whether the stage is slower than the baseline by more than "tolerance" (e.g. 0.25 = 25%)
+def compare_benchmarks(baseline, current, tolerance=0.25):
+    stages = [stage for stage in current["results"] if stage in baseline["results"]]
+
+    comparison = pd.DataFrame(index=pd.Index(stages, name="Stage"), columns=["Baseline", "Current", "Ratio", "Regression"])
+
+    for stage in stages:
+        baseline_min = baseline["results"][stage].get("min", np.nan)
+        current_min = current["results"][stage].get("min", np.nan)
+
+        comparison.loc[stage] = [baseline_min, current_min, current_min / baseline_min, current_min > baseline_min * (1.0 + tolerance)]
+
+    return comparison
+
+
+# formats the results of a benchmark as a small table for the console
+def benchmark_table(benchmark):
+    lines = ["%-30s %12s %12s" % ("Stage", "Min (s)", "Median (s)")]
+
+    for stage, result in benchmark["results"].items():
+        if "skipped" in result:
+            lines.append("%-30s skipped: %s" % (stage, result["skipped"]))
+        else:
+            lines.append("%-30s %12.6f %12.6f" % (stage, result["min"], result["median"]))
+
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks each stage of the pipeline on deterministic synthetic data.")
+    parser.add_argument("--years", type=int, default=40, help="years of daily data (default: 40)")
+    parser.add_argument("--indicators", type=int, default=5, help="number of macro indicators (default: 5)")
+    parser.add_argument("--assets", type=int, default=2, help="number of risky assets, RFR excluded (default: 2)")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the synthetic data (default: 0)")
+    parser.add_argument("--repeat", type=int, default=5, help="number of timed calls of each function (default: 5)")
+    parser.add_argument("--optimization-years", type=int, default=2, help="years of the timed optimization (default: 2)")
+    parser.add_argument("--optimization-repeat", type=int, default=1, help="number of timed optimizations (default: 1)")
+    parser.add_argument("--solver", default="SLSQP", help="solver of portfolio_optimize: SLSQP (default) or L-BFGS-B")
+    parser.add_argument("--output", default=None, help="JSON file of the results")
+    parser.add_argument("--baseline", default=None, help="JSON file of a previous benchmark to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="slowdown flagged as a regression (default: 0.25 = 25%%)")
+    args = parser.parse_args(argv)
+
+    scale = {"years": args.years, "indicators": args.indicators, "assets": args.assets, "seed": args.seed, "freq": "M",
+             "optimization_years": args.optimization_years, "solver": args.solver}
+
+    results = benchmark_suite(args.years, args.indicators, args.assets, args.seed, "M", args.repeat,
+                              args.optimization_years, args.optimization_repeat, solver=args.solver)
+
+    benchmark = {"scale": scale, "environment": environment(), "date": time.strftime("%Y-%m-%d %H:%M:%S"), "results": results}
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(benchmark, f, indent=4)
+
+    print(benchmark_table(benchmark))
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+        if baseline["scale"] != scale:
+            print("\nWARNING: the baseline was run at a different scale: %s" % baseline["scale"])
+
+        comparison = compare_benchmarks(baseline, benchmark, args.tolerance)
+
+        print("")
+        print(comparison)
+
+        # non-zero exit code if a stage is slower than the baseline
+        return int(comparison["Regression"].any())
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,116 @@
+import numpy as np
+import pandas as pd
+
+from ccp_functions import *
+
+
+#%%
+
+#==============================================================================
+# BOOTSTRAP INDICES
+#==============================================================================
+
+# indices (resamples x nb_obs) of nb_resamples bootstrap resamples of a time series of nb_obs observations,
+# drawn by blocks to keep the autocorrelation of the returns:
+# - 'stationary': blocks of random (geometric) length of mean block_size, wrapping around the end (Politis & Romano)
+# - 'block': moving blocks of exactly block_size observations (the last one truncated), starting anywhere in the sample
+# rng is a np.random.Generator, a np.random.SeedSequence or a seed
+def bootstrap_indices(nb_obs, nb_resamples, block_size=6, method='stationary', rng=None):
+    rng = np.random.default_rng(rng)
+    positions = np.arange(nb_obs)
+
+    if method == 'stationary':
+        # a new block starts at each observation with probability 1 / block_size (always at the first one)
+        new_block = rng.random((nb_resamples, nb_obs)) < 1.0 / block_size
+        new_block[:, 0] = True
+        starts = rng.integers(0, nb_obs, (nb_resamples, nb_obs))
+
+        # position of the first observation of the current block, for each observation
+        block_start = np.maximum.accumulate(np.where(new_block, positions, 0), axis=1)
+
+        return (np.take_along_axis(starts, block_start, axis=1) + positions - block_start) % nb_obs
+
+    elif method == 'block':
+        block_size = min(int(block_size), nb_obs)
+        nb_blocks = -(-nb_obs // block_size)
+        starts = rng.integers(0, nb_obs - block_size + 1, (nb_resamples, nb_blocks))
+
+        return np.repeat(starts, block_size, axis=1)[:, :nb_obs] + np.tile(np.arange(block_size), nb_blocks)[:nb_obs]
+
+    else:
+        raise ValueError('Bootstrap method "%s" does not exist' % method)
+
+
+# sizes and seeds of the shards of resamples: the resamples are drawn by shards of shard_size, each with its own seed
+# spawned from seed, so that the results do not depend on the number of worker processes
+def bootstrap_shards(nb_resamples, shard_size, seed):
+    sizes = [shard_size] * (nb_resamples // shard_size)
+    if nb_resamples % shard_size > 0:
+        sizes.append(nb_resamples % shard_size)
+
+    return list(zip(sizes, np.random.SeedSequence(seed).spawn(len(sizes))))
+
+
+#%%
+
+#==============================================================================
+# BOOTSTRAP STATISTICS
+#==============================================================================
+
+# statistics (resamples x assets x statistics, see returns_statistics) of nb_resamples resamples of the returns (dates x assets)
+# all the resamples are evaluated at once: the resampled returns are one array (resamples x dates x assets)
+def bootstrap_statistics(returns, freq, rfr_index, strategy_index, nb_resamples, block_size=6, method='stationary', seed=None):
+    indices = bootstrap_indices(len(returns), nb_resamples, block_size, method, seed)
+
+    return returns_statistics(np.asarray(returns, dtype=np.float64)[indices], freq, rfr_index, strategy_index)
+
+
+# one shard of bootstrap_statistics, in a worker process
+# task = (returns, freq, rfr_index, strategy_index, nb_resamples, block_size, method, seed)
+def bootstrap_shard(task):
+    return bootstrap_statistics(*task)
+
+
+# percentile bands of the statistics of the strategy for different optimization periods, by block-bootstrap of the returns
+# of each period (the statistics of strategy_analysis, on resampled returns). Typically:
+#       bands = bootstrap_analysis(optimization_periods, strategy_results, Y_assets, freq, workers=4)
+#       bands.loc["Strategy"].unstack("Percentiles")
+# block_size is the (mean) size of the blocks in periods of the data (e.g. 6 months), method is 'stationary' or 'block'
+# the resamples are evaluated by shards of shard_size resamples, in parallel on "workers" processes (in this process if workers <= 1)
+# returns a DataFrame: rows are the assets (and "Strategy"), columns are (period, statistic, percentile)
+def bootstrap_analysis(periods, strategy_results, Y_assets, freq, nb_resamples=1000, block_size=6, method='stationary',
+                       percentiles=[5, 50, 95], statistics=["Sharpe Ratio", "Drawdown"], workers=1, seed=0, shard_size=250):
+    names_periods = period_names_list(periods)
+    names_assets = Y_assets.columns.tolist() + ["Strategy"]
+    statistics_index = [names_statistics.index(name) for name in statistics]
+
+    # returns of each period (periods x dates x (assets + "Strategy")), padded with NaN
+    panel = returns_panel([strategy_results], Y_assets)[0]
+    rfr_index = Y_assets.columns.get_loc("RFR")
+
+    tasks = []
+    tasks_periods = []
+    for j, period_results in enumerate(strategy_results):
+        for shard_resamples, shard_seed in bootstrap_shards(nb_resamples, shard_size, [seed, j]):
+            tasks.append((panel[j, :len(period_results)], freq, rfr_index, -1, shard_resamples, block_size, method, shard_seed))
+            tasks_periods.append(j)
+
+    if workers <= 1:
+        outputs = [bootstrap_shard(task) for task in tasks]
+    else:
+        from concurrent.futures import ProcessPoolExecutor
+
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            outputs = list(executor.map(bootstrap_shard, tasks))
+
+    # percentiles of the statistics over the resamples of each period: periods x percentiles x assets x statistics
+    bands = np.stack([np.nanpercentile(np.concatenate([output for output, k in zip(outputs, tasks_periods) if k == j])[..., statistics_index],
+                                       percentiles, axis=0)
+                      for j in range(len(strategy_results))])
+
+    # rows are the assets, columns are (period, statistic, percentile)
+    bands = bands.transpose(2, 0, 3, 1).reshape(len(names_assets), -1)
+
+    names_columns = pd.MultiIndex.from_product([names_periods, statistics, percentiles], names=['Periods', 'Indicators', 'Percentiles'])
+
+    return pd.DataFrame(bands, index=pd.Index(names_assets, name='Assets'), columns=names_columns)
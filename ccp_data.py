@@ -1,51 +1,48 @@
-import datetime as dt
-import scipy.optimize as sco
-import scipy.stats as scs
-import statsmodels.regression.linear_model as sm
+import os
 
 import pandas as pd
-import pandas.tseries.offsets as pdtso
 
-import numpy as np
+from ccp_functions import *
 
-import matplotlib.pyplot as plt
 
-path = "/Users/raphaelseksik/Documents/203/Cross-Cutting/Data/"
+# folder of the data files: $CCP_DATA_PATH, or the folder of this module
+path = os.path.join(os.environ.get("CCP_DATA_PATH", os.path.dirname(os.path.abspath(__file__))), "")
 
 
 ################################
 # Largest continuous time index
 first_date, last_date = "1969 01 31", "2018 01 01"
-dtindex = pd.date_range(start=first_date, end=last_date, freq='D')
 
 
-#%%
-
-#==============================================================================
-# ASSET CLASSES
-#==============================================================================
-
-asset_classes = pd.DataFrame(index=dtindex)
-asset_classes.sort_index(ascending=True, inplace=True)
-
-asset_classes["Equities"] = import_time_series(path, "Asset classes.xlsx", "S&P index", dtindex)["SPXT"]
-asset_classes["Bonds"] = import_time_series(path, "Asset classes.xlsx", "Barclays index", dtindex)["Barclays"]
-
-
-# ALWAYS PUT THE RISK-FREE RATE AT THE END
-asset_classes["RFR"] = import_time_series(path, "Asset classes.xlsx", "Risk-free asset", dtindex)["RFA"]
-
+# daily index on which all the data is aligned
+def daily_index(first_date=first_date, last_date=last_date):
+    return pd.date_range(start=first_date, end=last_date, freq='D')
 
 
 #%%
 
 #==============================================================================
-# RESET MACRO DATA
+# ASSET CLASSES
 #==============================================================================
 
-# here we will store our macro momentum indicators
-macro_data = pd.DataFrame(index=dtindex)
-macro_data.sort_index(ascending=True, inplace=True)
+# asset classes: (name, file, sheet, column of the sheet)
+# more asset classes (sectors, countries, credit, commodities...) can be added before the RFR, with their signal directions
+# (see load_directions in ccp_functions). ALWAYS PUT THE RISK-FREE RATE AT THE END
+assets_files = [
+        ("Equities", "Asset classes.xlsx", "S&P index", "SPXT"),
+        ("Bonds", "Asset classes.xlsx", "Barclays index", "Barclays"),
+        ("RFR", "Asset classes.xlsx", "Risk-free asset", "RFA")
+    ]
+
+def load_asset_classes(path, dtindex, assets=assets_files):
+    asset_classes = pd.DataFrame(index=dtindex)
+    asset_classes.sort_index(ascending=True, inplace=True)
+    
+    for name, filename, sheet, column in assets:
+        asset_classes[name] = import_time_series(path, filename, sheet, dtindex)[column]
+    
+    return asset_classes
+
 
 
 #%%
@@ -54,140 +51,168 @@ macro_data.sort_index(ascending=True, inplace=True)
 # MACRO DATA V1
 #==============================================================================
 
+# each indicator is computed from the sheets returned by read(filename, sheet) (the sheet aligned on dtindex, see sheet_reader)
+# so that an indicator can be recomputed alone when one of its files changes (see ccp_watcher)
 
-################################
-# Monetary policy
 
 # Monetary policy trends are captured using one-year changes in the front end of the yield curve.
 # From 1992 onwards, I use two-year yields, while prior to 1992 I use Libor and its international equivalents.
+def monetary_policy(read, dtindex):
+    policy = pd.DataFrame(index=dtindex)
+    
+    policy["USGG2YR"] = read("Policy.xlsx", "USGG2YR")
+    policy["FEDL01"] = read("Asset classes.xlsx", "Risk-free asset")["FEDL01"]
+    
+    # Computing YoY changes
+    policy["2Y YoY"] = policy["USGG2YR"] - policy["USGG2YR"].shift(365)
+    policy["2Y YoY"] = policy["2Y YoY"].loc["19920101":] # take only after 1992
+    policy["FF YoY"] = policy["FEDL01"] - policy["FEDL01"].shift(365)
+    policy["FF YoY"] = policy["FF YoY"].loc[:"19911231"] # take only before 1992
+    policy.fillna(0, inplace=True) # fill NAs with 0 to allow sum (next line)
+    
+    monetary_policy = policy["2Y YoY"] + policy["FF YoY"] # continuous YoY changes
+    
+    return monetary_policy[monetary_policy.index > "1970 01 30"]
 
-policy = pd.DataFrame(index=dtindex)
-
-policy["USGG2YR"] = import_time_series(path, "policy.xlsx", "USGG2YR", dtindex)
-policy["FEDL01"] = import_time_series(path, "Asset classes.xlsx", "Risk-free asset", dtindex)["FEDL01"]
-
-# Computing YoY changes
-policy["2Y YoY"] = policy["USGG2YR"] - policy["USGG2YR"].shift(365)
-policy["2Y YoY"] = policy["2Y YoY"].loc["19920101":] # take only after 1992
-policy["FF YoY"] = policy["FEDL01"] - policy["FEDL01"].shift(365)
-policy["FF YoY"] = policy["FF YoY"].loc[:"19911231"] # take only before 1992
-policy.fillna(0, inplace=True) # fill NAs with 0 to allow sum (next line)
-
-macro_data["Monetary Policy"] = policy["2Y YoY"] + policy["FF YoY"] # continuous YoY changes
-macro_data["Monetary Policy"] = macro_data[macro_data.index > "1970 01 30"]["Monetary Policy"]
-
-################################
-# International trade
 
 # International trade trends are captured using one-year changes in spot exchange rates against an export-weighted basket.
+def international_trade(read, dtindex):
+    international_trade = read("Currencies.xlsx", "DXY").iloc[:, 0]
+    
+    return international_trade.shift(365) / international_trade - 1
 
-macro_data["International Trade"] = import_time_series(path, "currencies.xlsx", "DXY", dtindex)
-macro_data["International Trade"] = (macro_data["International Trade"].shift(365) / macro_data["International Trade"] - 1)
-
-
-################################
-# Risk sentiment
 
 # Changes in risk sentiment are captured using one-year equity market excess returns.
+def risk_sentiment(read, dtindex):
+    sentiment = pd.DataFrame(index=dtindex)
+    
+    sentiment["SPXT"] = read("Asset classes.xlsx", "S&P index")["SPXT"]
+    sentiment["RFA"] = read("Asset classes.xlsx", "Risk-free asset")["RFA"]
+    
+    return (sentiment["SPXT"]/sentiment["SPXT"].shift(365) - 1) - (sentiment["RFA"]/sentiment["RFA"].shift(365) - 1)
 
-sentiment = pd.DataFrame(index=dtindex)
-
-sentiment["SPXT"] = import_time_series(path, "Asset classes.xlsx", "S&P index", dtindex)["SPXT"]
-sentiment["RFA"] = import_time_series(path, "Asset classes.xlsx", "Risk-free asset", dtindex)["RFA"]
-
-macro_data["Risk Sentiment"] = (sentiment["SPXT"]/sentiment["SPXT"].shift(365) - 1) - (sentiment["RFA"]/sentiment["RFA"].shift(365) - 1)
-
-
-################################
-# Business cycle
 
 # Business cycle trends are captured using one-year changes in forecasts of real GDP growth and CPI inflation.
 # From 1990 onward forecast data is from Consensus Economics.
 # Prior to 1990, I use one-year changes in realized year-on-year real GDP growth and CPI inflation, lagged one quarter
 
 # 1. GDP Growth
+def growth(read, dtindex):
+    growth = read("Cycle.xlsx", "GDPG").iloc[:, 0]
+    
+    return growth - growth.shift(365)
 
-macro_data["Growth"] = import_time_series(path, "cycle.xlsx", "GDPG", dtindex)
-macro_data["Growth"] = macro_data["Growth"] - macro_data["Growth"].shift(365)
 
 # 2. Inflation
+def inflation(read, dtindex):
+    inflation = read("Cycle.xlsx", "CPI_F").iloc[:, 0]
+    
+    return inflation - inflation.shift(365)
 
-macro_data["Inflation"] = import_time_series(path, "cycle.xlsx", "CPI_F", dtindex)
-macro_data["Inflation"] = macro_data["Inflation"] - macro_data["Inflation"].shift(365)
-
-
-
-
-#%%
-
-#==============================================================================
-# NEW INDICATORS
-#==============================================================================
-
-#==============================================================================
-# RESET MACRO DATA 2
-#==============================================================================
-
-# here we will store our macro momentum indicators
-macro_data2 = pd.DataFrame(index=dtindex)
-macro_data2.sort_index(ascending=True, inplace=True)
-
-################################
-# Monetary policy
-# 1. 3M T-Bill
-
-macro_data2["3M T-Bill"] = import_time_series(path, "policy.xlsx", "3M T-Bill", dtindex)
-macro_data2["3M T-Bill"] = macro_data2["3M T-Bill"] - macro_data2["3M T-Bill"].shift(365)
-
-# 2. Excpected Inflation
-
-macro_data2["US Expected Inflation"] = import_time_series(path, "policy.xlsx", "US Expected Inflation", dtindex)
-macro_data2["US Expected Inflation"] = macro_data2["US Expected Inflation"] - macro_data2["US Expected Inflation"].shift(365)
-
-
-################################
-# International trade
-
-# International trade trends are captured using one-year changes in spot exchange rates against an export-weighted basket.
-
-macro_data2["International Trade"] = import_time_series(path, "currencies.xlsx", "DTWEXM", dtindex)
-macro_data2["International Trade"] = (macro_data2["International Trade"].shift(365) / macro_data2["International Trade"] - 1)
-
-
-################################
-# Risk sentiment
-
-# Changes in risk sentiment are captured using one-year equity market excess returns.
-
-# 1. VIX
-
-macro_data2["VIX"] = import_time_series(path, "Sentiment.xlsx", "VIX", dtindex)
-macro_data2["VIX"] = macro_data2["VIX"] - macro_data2["VIX"].shift(365)
 
-# 2. TED Spread
+# indicators of load_macro_data, in the order of the columns
+macro_indicators = [
+        ("Monetary Policy", monetary_policy),
+        ("International Trade", international_trade),
+        ("Risk Sentiment", risk_sentiment),
+        ("Growth", growth),
+        ("Inflation", inflation)
+    ]
 
-macro_data2["TED Spread"] = import_time_series(path, "Sentiment.xlsx", "TED Spread", dtindex)
-macro_data2["TED Spread"] = macro_data2["TED Spread"] - macro_data2["TED Spread"].shift(365)
 
+# reads the sheets of the files of the folder "path" with import_time_series, on dtindex
+def sheet_reader(path, dtindex):
+    def read(filename, sheet):
+        return import_time_series(path, filename, sheet, dtindex)
+    
+    return read
 
 
-################################
-# Business cycle
+def load_macro_data(path, dtindex, read=None):
+    if read is None:
+        read = sheet_reader(path, dtindex)
+    
+    # here we will store our macro momentum indicators
+    macro_data = pd.DataFrame(index=dtindex)
+    macro_data.sort_index(ascending=True, inplace=True)
+    
+    for name, indicator in macro_indicators:
+        macro_data[name] = indicator(read, dtindex)
+    
+    return macro_data
 
-# 1. Industrial Production Growth
 
-macro_data2["US Industrial Production Growth"] = import_time_series(path, "cycle.xlsx", "US Industrial", dtindex)
-macro_data2["US Industrial Production Growth"] = (macro_data2["US Industrial Production Growth"] - macro_data2["US Industrial Production Growth"].shift(365)) / (macro_data2["US Industrial Production Growth"].shift(365)) 
 
-# 2. Consumer Confidence
 
-macro_data2["CCI"] = import_time_series(path, "cycle.xlsx", "US Consumer Confidence", dtindex)
-macro_data2["CCI"] = macro_data2["CCI"] - macro_data2["CCI"].shift(365)
+#%%
 
-# 3. PMI
+#==============================================================================
+# NEW INDICATORS
+#==============================================================================
 
-macro_data2["PMI"] = import_time_series(path, "cycle.xlsx", "NAPMPMI Index", dtindex)
-macro_data2["PMI"] = macro_data2["PMI"] - macro_data2["PMI"].shift(365)
+def load_macro_data2(path, dtindex):
+    # here we will store our macro momentum indicators
+    macro_data2 = pd.DataFrame(index=dtindex)
+    macro_data2.sort_index(ascending=True, inplace=True)
+    
+    ################################
+    # Monetary policy
+    # 1. 3M T-Bill
+    
+    macro_data2["3M T-Bill"] = import_time_series(path, "Policy.xlsx", "3M T-Bill", dtindex)
+    macro_data2["3M T-Bill"] = macro_data2["3M T-Bill"] - macro_data2["3M T-Bill"].shift(365)
+    
+    # 2. Excpected Inflation
+    
+    macro_data2["US Expected Inflation"] = import_time_series(path, "Policy.xlsx", "US Expected Inflation", dtindex)
+    macro_data2["US Expected Inflation"] = macro_data2["US Expected Inflation"] - macro_data2["US Expected Inflation"].shift(365)
+    
+    
+    ################################
+    # International trade
+    
+    # International trade trends are captured using one-year changes in spot exchange rates against an export-weighted basket.
+    
+    macro_data2["International Trade"] = import_time_series(path, "Currencies.xlsx", "DTWEXM", dtindex)
+    macro_data2["International Trade"] = (macro_data2["International Trade"].shift(365) / macro_data2["International Trade"] - 1)
+    
+    
+    ################################
+    # Risk sentiment
+    
+    # Changes in risk sentiment are captured using one-year equity market excess returns.
+    
+    # 1. VIX
+    
+    macro_data2["VIX"] = import_time_series(path, "Sentiment.xlsx", "VIX", dtindex)
+    macro_data2["VIX"] = macro_data2["VIX"] - macro_data2["VIX"].shift(365)
+    
+    # 2. TED Spread
+    
+    macro_data2["TED Spread"] = import_time_series(path, "Sentiment.xlsx", "TED Spread", dtindex)
+    macro_data2["TED Spread"] = macro_data2["TED Spread"] - macro_data2["TED Spread"].shift(365)
+    
+    
+    
+    ################################
+    # Business cycle
+    
+    # 1. Industrial Production Growth
+    
+    macro_data2["US Industrial Production Growth"] = import_time_series(path, "Cycle.xlsx", "US Industrial", dtindex)
+    macro_data2["US Industrial Production Growth"] = (macro_data2["US Industrial Production Growth"] - macro_data2["US Industrial Production Growth"].shift(365)) / (macro_data2["US Industrial Production Growth"].shift(365)) 
+    
+    # 2. Consumer Confidence
+    
+    macro_data2["CCI"] = import_time_series(path, "Cycle.xlsx", "US Consumer Confidence", dtindex)
+    macro_data2["CCI"] = macro_data2["CCI"] - macro_data2["CCI"].shift(365)
+    
+    # 3. PMI
+    
+    macro_data2["PMI"] = import_time_series(path, "Cycle.xlsx", "NAPMPMI Index", dtindex)
+    macro_data2["PMI"] = macro_data2["PMI"] - macro_data2["PMI"].shift(365)
+    
+    return macro_data2
 
 
 
@@ -257,7 +282,7 @@ paper side:
     3. try again to find some kind of GDP forecast, or build our own
 
 our side:
-    1. solve the pb of negative data when computing GMean (inflation...)
+    1. solve the pb of negative data when computing GMean (inflation...) => composite_indicator(..., negative='shifted_log' or 'signed_power')
     2. pb of centering-reducing => we use forward data...
     3.
 
@@ -292,25 +317,10 @@ our side:
 
 #%%
 #
-## argument = pd.Series
-#def cut_quantile(data, lbound, ubound):
-#    data_cut = data.copy()
-#    
-#    # select data only above lbound quantile and beyond ubound quantile
-#    data_cut = data_cut[(data_cut < data_cut.quantile(lbound)) | (data_cut > data_cut.quantile(ubound))]
-#    
-#    return data_cut
-#
-## for each indicator we cut the data at the required quantile, and apply a simple OLS regression of assets on the indicator
-#for indicator in X_macro.columns:
-#    
-#    X_macro_signal = cut_quantile(X_macro[indicator], 0.0, 0.75)
-#    Y_assets_signal = Y_assets.reindex(X_macro_signal.index)
-#    
-#    for asset in Y_assets.columns:
-#        
-#        res = sm.OLS(Y_assets_signal[asset], X_macro_signal).fit()
-#        print(res.summary())
+## for each indicator we cut the data at the required quantiles, and apply a simple OLS regression of assets on the indicator
+## (cut_quantile and quantile_regression_analysis are now in ccp_functions)
+#quantile_regressions = quantile_regression_analysis(Y_assets, X_macro, [(0.0, 0.75)])
+#print(quantile_regressions)
 #        
 #
 ##%%
@@ -330,92 +340,104 @@ our side:
 #    print(res.summary())
 
 #%%
-#FIRST DATASET REGRESSIONS
-
-#Regression by Asset Class on all Indicators
-start_date, end_date = "2000 01 01", "2008 01 01"
 
-Y_assets = data_returns(asset_classes, start_date, end_date, "M", 1)
-X_macro = data_lagged(macro_data[["Monetary Policy", "International Trade", "Risk Sentiment", 
-                                  "Growth", "Inflation"]], start_date, end_date, "M", 1)
-
-# regression on each asset class
-for asset in Y_assets.columns:
-    res = sm.OLS(Y_assets[asset], sm.add_constant(X_macro)).fit()
-    print(res.summary())
+#==============================================================================
+# REGRESSIONS
+#==============================================================================
 
-#%%
+# indicators of the first and second datasets used in the regressions
+indicators = ["Monetary Policy", "International Trade", "Risk Sentiment", "Growth", "Inflation"]
+indicators2 = ["3M T-Bill", "US Expected Inflation", "International Trade", 
+               "VIX", "TED Spread", "US Industrial Production Growth", "CCI", "PMI"]
 
-start_date, end_date = "1990 01 01", "2008 01 01"
 
-Y_assets = data_returns(asset_classes, start_date, end_date, "M", 1)
-X_macro = data_lagged(macro_data[["Monetary Policy", "International Trade", "Risk Sentiment", 
-                                  "Growth", "Inflation"]], start_date, end_date, "M", 1)
+#FIRST DATASET REGRESSIONS
+def regression_study(asset_classes, macro_data):
+    import matplotlib.pyplot as plt
+    
+    #Regression by Asset Class on all Indicators
+    start_date, end_date = "2000 01 01", "2008 01 01"
+    
+    Y_assets = data_returns(asset_classes, start_date, end_date, "M", 1)
+    X_macro = data_lagged(macro_data[indicators], start_date, end_date, "M", 1)
+    
+    # regression of each asset class on all the indicators
+    regressions = regression_analysis(Y_assets, X_macro, [X_macro.columns.tolist()])
+    print(regressions)
+    
+    
+    start_date, end_date = "1990 01 01", "2008 01 01"
+    
+    Y_assets = data_returns(asset_classes, start_date, end_date, "M", 1)
+    X_macro = data_lagged(macro_data[indicators], start_date, end_date, "M", 1)
+    
+    #Regression Per Indicator
+    regressions = regression_analysis(Y_assets, X_macro, indicator_subsets(X_macro.columns, [1]), constant=False)
+    print(regressions)
+    
+    
+    # stability of the coefficients: rolling 5-year and expanding regressions of each asset class on each indicator
+    start_date, end_date = "1980 01 01", "2018 01 01"
+    
+    Y_assets = data_returns(asset_classes, start_date, end_date, "M", 1)
+    X_macro = data_lagged(macro_data[indicators], start_date, end_date, "M", 1)
+    
+    rolling_regressions = recursive_regression(Y_assets, X_macro, window=60)
+    expanding_regressions = recursive_regression(Y_assets, X_macro)
+    
+    rolling_regressions["t-stat"].xs("Equities", axis=1, level="Asset").drop("const", axis=1, level="Variable").plot(figsize=(12,6))
+    plt.title("Rolling 5-year t-stats of the indicators for Equities")
+    plt.show()
+    
+    
+    # tail-conditioned regressions: each asset class on each indicator, keeping only the tails of the indicator
+    quantile_cuts = [(0.0, 0.5), (0.0, 0.75), (0.25, 0.75), (0.1, 0.9), (0.25, 1.0), (0.5, 1.0)]
+    
+    quantile_regressions = quantile_regression_analysis(Y_assets, X_macro, quantile_cuts)
+    print(quantile_regressions["t-stat"].unstack("Asset"))
+    
+    return rolling_regressions, expanding_regressions, quantile_regressions
 
-#Regression Per Indicator
-for asset in Y_assets.columns:
-    for indicator in X_macro.columns:
-        res = sm.OLS(Y_assets[asset], X_macro[indicator]).fit()
-        print(res.summary())
 
-#%%
 #SECOND DATASET REGRESSIONS
+def regression_study2(asset_classes, macro_data2):
+    
+    #Regression by Asset Class on all Indicators
+    start_date, end_date = "2000 01 01", "2008 01 01"
+    
+    Y_assets = data_returns(asset_classes, start_date, end_date, "M", 1)
+    X_macro2 = data_lagged(macro_data2[indicators2], start_date, end_date, "M", 1)
+    
+    # regression of each asset class on all the indicators
+    regressions = regression_analysis(Y_assets, X_macro2, [X_macro2.columns.tolist()])
+    print(regressions)
+    
+    
+    start_date, end_date = "1990 01 01", "2008 01 01"
+    
+    Y_assets = data_returns(asset_classes, start_date, end_date, "M", 1)
+    X_macro2 = data_lagged(macro_data2[indicators2], start_date, end_date, "M", 1)
+    
+    #Regression Per Indicator
+    regressions = regression_analysis(Y_assets, X_macro2, indicator_subsets(X_macro2.columns, [1]), constant=False)
+    print(regressions)
+    
+    
+    # regressions of each asset class on every subset of indicators, with a constant
+    regressions = regression_analysis(Y_assets, X_macro2)
+    print(regressions.xs("const", level="Variable")["R2"].unstack("Asset").sort_values("Equities", ascending=False))
+    
+    return regressions
 
-#Regression by Asset Class on all Indicators
-start_date, end_date = "2000 01 01", "2008 01 01"
-
-Y_assets = data_returns(asset_classes, start_date, end_date, "M", 1)
-X_macro2 = data_lagged(macro_data2[["3M T-Bill", "US Expected Inflation", "International Trade", 
-                                  "VIX", "TED Spread", "US Industrial Production Growth", "CCI", "PMI"]], 
-                                    start_date, end_date, "M", 1)
-
-# regression on each asset class
-for asset in Y_assets.columns:
-    res = sm.OLS(Y_assets[asset], sm.add_constant(X_macro2)).fit()
-    print(res.summary())
 
 #%%
 
-start_date, end_date = "1990 01 01", "2008 01 01"
-
-Y_assets = data_returns(asset_classes, start_date, end_date, "M", 1)
-X_macro2 = data_lagged(macro_data2[["3M T-Bill", "US Expected Inflation", "International Trade", 
-                                  "VIX", "TED Spread", "US Industrial Production Growth", "CCI", "PMI"]], 
-                                    start_date, end_date, "M", 1)
-
-#Regression Per Indicator
-for asset in Y_assets.columns:
-    for indicator in X_macro.columns:
-        res = sm.OLS(Y_assets[asset], X_macro[indicator]).fit()
-        print(res.summary())
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
+if __name__ == "__main__":
+    dtindex = daily_index()
+    
+    asset_classes = load_asset_classes(path, dtindex)
+    macro_data = load_macro_data(path, dtindex)
+    macro_data2 = load_macro_data2(path, dtindex)
+    
+    regression_study(asset_classes, macro_data)
+    regression_study2(asset_classes, macro_data2)
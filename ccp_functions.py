@@ -1,16 +1,13 @@
-import datetime as dt
-import scipy.optimize as sco
-import scipy.stats as scs
-import statsmodels.regression.linear_model as sm
+import itertools
 
 import pandas as pd
-import pandas.tseries.offsets as pdtso
 
 import numpy as np
 
-import matplotlib.pyplot as plt
-import matplotlib.dates as mdates
-#%matplotlib inline
+from ccp_instrument import instrumented, add_counters
+
+# scipy and statsmodels are slow to import: they are imported in the functions that use them,
+# so that importing this module (e.g. in a worker process) only loads numpy and pandas
 
 
 #%%
@@ -21,6 +18,7 @@ import matplotlib.dates as mdates
 
 
 # imports time series from a given excel sheet and sorts the date index on the new_index
+@instrumented()
 def import_time_series(path, filename, sheet, new_index):
     # open the file
     TS = pd.read_excel(path + filename, sheet)
@@ -37,7 +35,87 @@ def import_time_series(path, filename, sheet, new_index):
     # forward fill the missing values.
     # Ex 1: weekend days will have the thursday value (forward filled)
     # Ex 2: for monthly data, all the month will be filled with the last value observed.
-    TS.fillna(method="ffill", inplace=True)
+    TS.ffill(inplace=True)
+    
+    return TS
+
+# reads the rows of an Excel sheet (.xlsx) or of a CSV file by chunks of chunksize rows (DataFrames with the header of the file)
+# the Excel file is read in read-only mode (openpyxl), so that the whole sheet is never loaded in memory
+def read_chunks(path, filename, sheet=None, chunksize=100000):
+    if filename.lower().endswith(".csv"):
+        for chunk in pd.read_csv(path + filename, chunksize=chunksize):
+            yield chunk
+        return
+    
+    import openpyxl
+    
+    workbook = openpyxl.load_workbook(path + filename, read_only=True, data_only=True)
+    try:
+        rows = workbook[sheet].iter_rows(values_only=True)
+        header = list(next(rows))
+        
+        chunk = []
+        for row in rows:
+            chunk.append(row)
+            
+            if len(chunk) == chunksize:
+                yield pd.DataFrame(chunk, columns=header)
+                chunk = []
+        
+        if len(chunk) > 0:
+            yield pd.DataFrame(chunk, columns=header)
+    finally:
+        workbook.close()
+
+
+# streaming variant of import_time_series, for large (e.g. tick or intraday) histories: the file is read by chunks, each chunk
+# is reduced to one value per day on the fly (how = 'last', 'first' or 'mean' of the day) and written into the aligned array
+# (new_index x columns), so the memory used does not depend on the size of the file. Returns the same DataFrame as
+# import_time_series for daily data (forward filled on new_index). The rows are expected in chronological order for 'last'/'first'
+# with panel (a DataFrame on new_index), the columns are written directly into it, and panel is returned
+@instrumented()
+def import_time_series_chunked(path, filename, sheet, new_index, columns=None, how='last', chunksize=100000, panel=None):
+    assert how in ['last', 'first', 'mean'], 'Invalid daily value (%s)' % how
+    
+    new_index = pd.DatetimeIndex(new_index)
+    values, counts = None, None
+    
+    for chunk in read_chunks(path, filename, sheet, chunksize):
+        if values is None:
+            columns = [column for column in chunk.columns if column != "Dates"] if columns is None else list(columns)
+            # sums of the values of each day for 'mean'
+            values = np.full((len(new_index), len(columns)), 0.0 if how == 'mean' else np.nan)
+            counts = np.zeros((len(new_index), len(columns)))
+        
+        # one value per day of the chunk, at its position in new_index (days out of new_index are dropped)
+        days = pd.to_datetime(chunk["Dates"]).dt.normalize()
+        chunk = chunk[columns].apply(pd.to_numeric, errors='coerce').groupby(days.values)
+        
+        daily = {'last': chunk.last, 'first': chunk.first, 'mean': chunk.sum}[how]()
+        positions = new_index.get_indexer(daily.index)
+        in_index = positions >= 0
+        daily, positions = daily.values[in_index], positions[in_index]
+        
+        if how == 'last':
+            values[positions] = np.where(np.isnan(daily), values[positions], daily)
+        elif how == 'first':
+            values[positions] = np.where(np.isnan(values[positions]), daily, values[positions])
+        else:
+            values[positions] += daily
+            counts[positions] += chunk.count().values[in_index]
+    
+    if values is None:
+        values = np.full((len(new_index), len(columns or [])), np.nan)
+    elif how == 'mean':
+        values = np.where(counts > 0, values / np.maximum(counts, 1.0), np.nan)
+    
+    # forward fill the missing values (as import_time_series)
+    TS = pd.DataFrame(values, index=new_index, columns=columns).ffill()
+    
+    if panel is not None:
+        for column in TS.columns:
+            panel[column] = TS[column].values
+        return panel
     
     return TS
 
@@ -55,7 +133,7 @@ def merge_time_series(TS_1, TS_2, new_index):
     # forward fill the missing values.
     # Ex 1: weekend days will have the thursday value (forward filled)
     # Ex 2: for monthly data, all the month will be filled with the last value observed.
-    TS.fillna(method="ffill", inplace=True)
+    TS.ffill(inplace=True)
     
     # removes missing observations (e.g. if both TS_1 and TS_2 had no observation before a given date in new_index)
     TS.dropna(axis=0, how="all", inplace=True)
@@ -63,6 +141,49 @@ def merge_time_series(TS_1, TS_2, new_index):
     return TS
 
 
+# merges any number of time series (Series or DataFrames, at any frequencies) on new_index in one pass
+# same result as chaining merge_time_series on the list, without materializing the outer index of each pairwise merge:
+# each column is forward filled from its own observations into one preallocated array (dates x columns)
+# new_index is the union of the indexes of the time series if None
+# with asof=True, each date takes the last observation at or before it, even if the date of the observation is not in
+# new_index (e.g. monthly data observed on a week-end, merged on business days). Otherwise, as in merge_time_series,
+# only the observations on dates of new_index are kept
+@instrumented()
+def merge_time_series_list(TS_list, new_index=None, asof=False):
+    columns = []
+    for TS in TS_list:
+        columns += list(TS.items()) if isinstance(TS, pd.DataFrame) else [(TS.name, TS)]
+    
+    # union index, built once
+    if new_index is None:
+        new_index = pd.DatetimeIndex(np.unique(np.concatenate([TS.index.values.astype('datetime64[ns]') for name, TS in columns])))
+    new_index = pd.DatetimeIndex(new_index).sort_values()
+    new_dates = new_index.values.astype('datetime64[ns]')
+    
+    merged = np.full((len(new_index), len(columns)), np.nan)
+    
+    for j, (name, TS) in enumerate(columns):
+        TS = TS.dropna().sort_index()
+        dates = TS.index.values.astype('datetime64[ns]')
+        values = TS.values.astype(np.float64)
+        
+        if not asof:
+            in_index = np.isin(dates, new_dates)
+            dates, values = dates[in_index], values[in_index]
+        
+        if len(dates) == 0:
+            continue
+        
+        # position of the last observation at or before each date (-1 before the first observation)
+        positions = np.searchsorted(dates, new_dates, side='right') - 1
+        merged[:, j] = np.where(positions >= 0, values[np.maximum(positions, 0)], np.nan)
+    
+    TS = pd.DataFrame(merged, index=new_index, columns=[name for name, TS in columns])
+    
+    # removes the dates before the first observation of any time series
+    return TS[~np.isnan(merged).all(axis=1)]
+
+
 #%%
 
 #==============================================================================
@@ -70,6 +191,7 @@ def merge_time_series(TS_1, TS_2, new_index):
 #==============================================================================
 
 # returns the time series values shifted lag_days before
+@instrumented(copied_arg=0)
 def shift_time_series(data, lag_days):
     # creating a copy not to modify the initial dataset (Params are indeed passed by reference)
     data_shifted = data.copy()
@@ -78,7 +200,7 @@ def shift_time_series(data, lag_days):
     data_shifted = pd.DataFrame(data_shifted)
     
     # returns the shifted index
-    index_shifted = data_shifted.index.shift(n=-lag_days, freq='D')
+    index_shifted = data_shifted.index.shift(-lag_days, freq='D')
     
     # shifts the values
     data_shifted = data_shifted.reindex(index=index_shifted)
@@ -90,6 +212,7 @@ def shift_time_series(data, lag_days):
 
 
 # uses shift_time_series to compute the difference between the data and the data_shifted
+@instrumented(copied_arg=0)
 def diff_time_series(data, lag_days):
     # creating a copy not to modify the initial dataset (Params are indeed passed by reference)
     data_diff = data.copy()
@@ -107,6 +230,7 @@ def diff_time_series(data, lag_days):
 
 
 # uses shift_time_series to compute the returns between the data and the data_shifted
+@instrumented(copied_arg=0)
 def returns_time_series(data, lag_days):
     # creating a copy not to modify the initial dataset (Params are indeed passed by reference)
     data_returns = data.copy()
@@ -124,6 +248,7 @@ def returns_time_series(data, lag_days):
 
 
 # uses shift_time_series to compute the relative value of the time series compared to lag_days before
+@instrumented(copied_arg=0)
 def relative_time_series(data, lag_days):
     # creating a copy not to modify the initial dataset (Params are indeed passed by reference)
     data_relative = data.copy()
@@ -141,6 +266,7 @@ def relative_time_series(data, lag_days):
 
 
 # uses relative_time_series to compute the ratio of relative values
+@instrumented(copied_arg=0)
 def ratio_relative_time_series(data, lag_days_numerator, lag_days_denominator, standardize):
     # creating a copy not to modify the initial dataset (Params are indeed passed by reference)
     data_ratio_relative = data.copy()
@@ -157,7 +283,7 @@ def ratio_relative_time_series(data, lag_days_numerator, lag_days_denominator, s
     #       so we transform the denominator: denominator^(180/1080) <=> denominator^(0.5/3)
     #       and so both are expressed in terms of "6 months relative value"
     if standardize == True:
-        exponent = lag_days_numerator / np.float(lag_days_denominator)
+        exponent = lag_days_numerator / float(lag_days_denominator)
         data_relative_denominator = data_relative_denominator ** exponent
     
     # returns the difference
@@ -167,7 +293,10 @@ def ratio_relative_time_series(data, lag_days_numerator, lag_days_denominator, s
 
 
 # for a dataframe, returns a pd.Series of the row-wise geometric mean
+@instrumented()
 def geometric_mean(data):
+    import scipy.stats as scs
+    
     # compute the geometric mean for each row, which is returned in a np.array
     res = scs.gmean(data, axis=1)
     
@@ -178,6 +307,7 @@ def geometric_mean(data):
 
 
 # returns the time series of the moving average over lag_days 
+@instrumented()
 def moving_average(data, lag_days):
     return data.rolling(window=lag_days, center=False).mean()
 
@@ -185,6 +315,7 @@ def moving_average(data, lag_days):
 # returns a weighted moving average, here lag_days_array being an array of lag_days, each one being weighted by weights in the weights array.
 # Ex: lag_days_array=[30, 365], weights=[3, 1]
 # this will return: ( (30-days moving average) * 3 + (365-days moving average) * 1 ) / (3 + 1)
+@instrumented(copied_arg=0)
 def weighted_moving_average(data, lag_days_array, weights):
     # first we create the results dataframe (same dimensions and index as data)
     data_result = data.copy()
@@ -194,7 +325,7 @@ def weighted_moving_average(data, lag_days_array, weights):
     
     # loop over the lag_days_array to compute the weighted moving average
     for i, lag_days in enumerate(lag_days_array):
-        data_result += moving_average(data, lag_days) * np.float(weights[i]) / np.sum(weights)
+        data_result += moving_average(data, lag_days) * float(weights[i]) / np.sum(weights)
         
     return data_result
     
@@ -203,6 +334,7 @@ def weighted_moving_average(data, lag_days_array, weights):
 # (weighting from the earliest to the oldest period)
 # Ex: lag_days_array=[30, 30, 30], weights=[3, 2, 1]
 # will return a 90-days moving average, with the first third weighted by 3, the second third weighted by 2, and the last third weighted by 1
+@instrumented(copied_arg=0)
 def decaying_moving_average(data, lag_days_array, weights):
     # first we create the results dataframe (same dimensions and index as data)
     data_result = data.copy()
@@ -214,12 +346,128 @@ def decaying_moving_average(data, lag_days_array, weights):
     for i, lag_days in enumerate(lag_days_array):
         data_shifted = shift_time_series(data, 0 if i == 0 else np.sum(lag_days_array[:i]))
         
-        data_result += moving_average(data_shifted, lag_days) * np.float(weights[i]) / np.sum(weights)
+        data_result += moving_average(data_shifted, lag_days) * float(weights[i]) / np.sum(weights)
         
     return data_result
 
 
 
+#%%
+
+#==============================================================================
+# COMPOSITE INDICATORS
+#==============================================================================
+
+# values (np.array dates x columns) lag_days before each date of the index, as shift_time_series (NaN if there is no such date)
+def shift_values(values, index, lag_days):
+    positions = index.get_indexer(index.shift(-int(lag_days), freq='D'))
+    
+    shifted = values[np.maximum(positions, 0)]
+    shifted[positions < 0] = np.nan
+    
+    return shifted
+
+
+# moving average over "window" rows of values (np.array dates x columns), as moving_average: NaN if a value is missing in the window
+def moving_average_values(values, window):
+    window = int(window)
+    valid = ~np.isnan(values)
+    
+    sums = np.concatenate([np.zeros((1, values.shape[1])), np.cumsum(np.where(valid, values, 0.0), axis=0)])
+    counts = np.concatenate([np.zeros((1, values.shape[1]), dtype=int), np.cumsum(valid, axis=0)])
+    
+    result = np.full(values.shape, np.nan)
+    if window <= len(values):
+        complete = (counts[window:] - counts[:-window]) == window
+        result[window - 1:] = np.where(complete, (sums[window:] - sums[:-window]) / window, np.nan)
+    
+    return result
+
+
+# row-wise geometric mean of values (np.array dates x columns) which can be negative (e.g. changes of the indicators):
+# - 'shifted_log': the values are shifted to be positive, the geometric mean is computed on the shifted values and shifted back.
+#   the shift is 0 while all the values observed until the date are positive (same as the geometric mean), then 1 - the lowest
+#   value observed until the date (so there is no look-ahead), or a constant "shift". As the shift follows the lowest value,
+#   the result depends on the path of the data: it jumps at the first value <= 0 and at each new low after it
+# - 'signed_power': geometric mean of the absolute values, with the sign of their product
+# - None: geometric mean (NaN with negative values, as scs.gmean in geometric_mean)
+def signed_geometric_mean(values, negative='shifted_log', shift=None):
+    values = np.asarray(values, dtype=np.float64)
+    
+    with np.errstate(divide='ignore', invalid='ignore'):
+        if negative == 'shifted_log':
+            if shift is None:
+                lowest = np.fmin.accumulate(np.fmin.reduce(values, axis=1))
+                shift = np.where(lowest > 0.0, 0.0, 1.0 - lowest)[:, None]
+            
+            return np.exp(np.log(values + shift).mean(axis=1)) - np.ravel(shift)
+        
+        elif negative == 'signed_power':
+            return np.prod(np.sign(values), axis=1) * np.exp(np.log(np.abs(values)).mean(axis=1))
+        
+        elif negative is None:
+            return np.exp(np.log(values).mean(axis=1))
+        
+        else:
+            raise ValueError('Method "%s" for negative values does not exist' % negative)
+
+
+# builds a composite indicator from daily data by applying the steps in order, on the values of all the columns at once
+# (one np.array, no intermediate DataFrames). Ex: the indicators of MACRO DATA V2 (ccp_data)
+#       composite_indicator(risk_sentiment, [("geometric_mean",), ("decaying_moving_average", [30, 30, 30], [1.0, 0.5, 0.33])])
+#       composite_indicator(business_cycle, [("geometric_mean",), ("ratio_relative", 183, 1096, True), ("scale", 100.0)])
+# the steps are the transforms of the same names (same results, up to rounding for the moving averages):
+#       ("shift", lag_days), ("diff", lag_days), ("relative", lag_days), ("ratio_relative", lag_days_numerator, lag_days_denominator, standardize),
+#       ("moving_average", lag_days), ("weighted_moving_average", lag_days_array, weights), ("decaying_moving_average", lag_days_array, weights),
+#       ("geometric_mean",): reduces the columns to one ("GMean"), with signed values (see signed_geometric_mean for negative and shift),
+#       ("scale", factor)
+@instrumented()
+def composite_indicator(data, steps, negative='shifted_log', shift=None):
+    data = pd.DataFrame(data)
+    index = data.index
+    columns = data.columns.tolist()
+    values = data.values.astype(np.float64)
+    
+    for step in steps:
+        name, args = step[0], step[1:]
+        
+        if name == 'shift':
+            values = shift_values(values, index, args[0])
+        elif name == 'diff':
+            values = values - shift_values(values, index, args[0])
+        elif name == 'relative':
+            values = values / shift_values(values, index, args[0])
+        elif name == 'ratio_relative':
+            lag_days_numerator, lag_days_denominator, standardize = args
+            relative_denominator = values / shift_values(values, index, lag_days_denominator)
+            
+            if standardize == True:
+                relative_denominator = relative_denominator ** (lag_days_numerator / float(lag_days_denominator))
+            
+            values = (values / shift_values(values, index, lag_days_numerator)) / relative_denominator
+        elif name == 'moving_average':
+            values = moving_average_values(values, args[0])
+        elif name in ['weighted_moving_average', 'decaying_moving_average']:
+            lag_days_array, weights = args
+            result = np.zeros(values.shape)
+            
+            # the periods of the decaying moving average are one after the other
+            for i, lag_days in enumerate(lag_days_array):
+                lag_shift = int(np.sum(lag_days_array[:i])) if name == 'decaying_moving_average' else 0
+                result += moving_average_values(shift_values(values, index, lag_shift), lag_days) * float(weights[i]) / np.sum(weights)
+            
+            values = result
+        elif name == 'geometric_mean':
+            values = signed_geometric_mean(values, negative, shift)[:, None]
+            columns = ["GMean"]
+        elif name == 'scale':
+            values = values * args[0]
+        else:
+            raise ValueError('Step "%s" of composite indicator does not exist' % name)
+    
+    return pd.DataFrame(values, index=index, columns=columns)
+
+
 #%%
 
 #==============================================================================
@@ -234,18 +482,17 @@ def decaying_moving_average(data, lag_days_array, weights):
 # Returns on the period [start_date, end_date], the time series from lag*freq periods before, at the given frequency
 # Ex: if you want to do the regression on period [10,20], with a lag of 1 on the variable X,
 #       you can lag by 1 so to have values of the period [9,19] indexed by period [10,20]
+@instrumented()
 def data_lagged(data, start_date, end_date, freq, lag):
     # normal index = range for indexation
     index = pd.date_range(start=start_date, end=end_date, freq=freq)
     
     # shifted index = range for data
-    index_shifted = index.shift(n=-np.int(lag), freq=freq)
-    
-    # creating a copy not to modify the initial dataset (Params are indeed passed by reference)
-    data_lagged = data.copy()
+    index_shifted = index.shift(-int(lag), freq=freq)
     
     # reindexing the data to get values at the index_shifted
-    data_lagged = data_lagged.reindex(index=index_shifted)
+    # (reindex returns a new dataframe of the size of the index: the initial dataset is not modified, no need to copy it first)
+    data_lagged = data.reindex(index=index_shifted)
     
     # replacing the index with the non-lagged index
     data_lagged.set_index(index, inplace=True)
@@ -256,27 +503,346 @@ def data_lagged(data, start_date, end_date, freq, lag):
 # Ex: if you want to do the regression on period [10,20], with a lag of 2 on the returns of Y,
 #       you can lag by 2 so to have values of the period [8,20] to compute returns on period [10,20]
 #       e.g. [8,10] to compute returns on 10, [9,11] to compute returns on 11, etc.
+@instrumented()
 def data_returns(data, start_date, end_date, freq, lag):
     # we shift the start date because we compute returns, so we need "lag" more dates (before the period)
-    start_date_shifted = pd.date_range(start_date, start_date).shift(n=-np.int(lag), freq=freq)[0]
+    start_date_shifted = pd.date_range(start_date, start_date).shift(-int(lag), freq=freq)[0]
     
     # total index = including all the values used to compute returns for period [start_date, end_date] 
     index = pd.date_range(start=start_date_shifted, end=end_date, freq=freq)
     
-    # creating a copy not to modify the initial dataset (Params are indeed passed by reference)
-    data_returns = data.copy()
-    
-    # reindexing the data with the index previously defined
-    data_returns = data_returns.reindex(index=index)
+    # reindexing the data with the index previously defined (a new dataframe: the initial dataset is not modified)
+    data_returns = data.reindex(index=index)
     
     # computing Y returns for the given frequency, and over the period [start_date, end_date]
-    data_returns = (data_returns / data_returns.shift(np.int(lag)) - 1).iloc[np.int(lag):] 
+    data_returns = (data_returns / data_returns.shift(int(lag)) - 1).iloc[int(lag):] 
     
     return data_returns
 
 
 
 
+#%%
+
+#==============================================================================
+# REGRESSION ANALYSIS
+#==============================================================================
+
+# returns all the subsets of the indicators (as lists), from the smallest to the largest
+# sizes can restrict the number of indicators in the subsets. Ex: sizes=[1] returns each indicator alone
+def indicator_subsets(indicators, sizes=None):
+    indicators = list(indicators)
+    
+    if sizes is None:
+        sizes = range(1, len(indicators) + 1)
+    
+    return [list(subset) for size in sizes for subset in itertools.combinations(indicators, size)]
+
+
+# common sample of the assets and the indicators (dates where all of them are available)
+# returns the arrays of the assets returns Y, of the regressors Z (constant first, if any), and the names of the regressors
+def regression_data(Y_assets, X_macro, constant):
+    data = pd.concat([Y_assets, X_macro], axis=1).dropna(axis=0, how="any")
+    Y = data.iloc[:, :len(Y_assets.columns)].values.astype(np.float64)
+    X = data.iloc[:, len(Y_assets.columns):].values.astype(np.float64)
+    
+    names_variables = (["const"] if constant else []) + X_macro.columns.tolist()
+    Z = np.column_stack([np.ones(len(data.index)), X]) if constant else X
+    
+    return data.index, Y, Z, names_variables
+
+
+# positions of the regressors of each subset in Z, padded to the largest subset
+# returns the (subsets x regressors) array of positions, and the mask of the positions that are not padding
+def subsets_positions(X_macro, subsets, constant):
+    offset = 1 if constant else 0
+    positions = [([0] if constant else []) + [offset + X_macro.columns.get_loc(col) for col in subset] for subset in subsets]
+    
+    nb_regressors = np.array([len(pos) for pos in positions])
+    size = nb_regressors.max()
+    
+    mask = np.arange(size)[None, :] < nb_regressors[:, None]
+    index = np.array([pos + [0] * (size - len(pos)) for pos in positions])
+    
+    return index, mask
+
+
+# OLS statistics of every subset of regressors and every asset, from the cross-products of the sample:
+#       ZZ = Z'Z (..., regressors, regressors), ZY = Z'Y (..., regressors, assets), YY = sum(Y^2) and SY = sum(Y) (..., assets)
+#       nb_obs (...) number of observations
+# the leading dimensions can be anything (e.g. dates, for rolling regressions). The normal equations of all the subsets
+# are solved together (padded regressors have an identity block and no effect).
+# centers = (center_Z (..., regressors), center_Y (..., assets)) if the cross-products are those of the data centered on them
+# (with a constant only, its center being 0, see recursive_regression): the slopes are the same, the constant and its
+# standard error are converted back to the data
+# returns the coefficients, standard errors, t-stats (..., subsets, regressors, assets), R2 (..., subsets, assets) and the degrees of freedom
+def ols_statistics(ZZ, ZY, YY, SY, nb_obs, index, mask, constant, centers=None):
+    size = mask.shape[1]
+    nb_regressors = mask.sum(axis=1)
+    
+    # normal equations of each subset
+    ZZ_subsets = np.where(mask[:, :, None] & mask[:, None, :], ZZ[..., index[:, :, None], index[:, None, :]], 0.0)
+    ZZ_subsets += np.eye(size) * ~mask[:, :, None]
+    ZY_subsets = np.where(mask[:, :, None], ZY[..., index, :], 0.0)
+    
+    # one stacked solve (pseudo-inverse only if some of the systems are singular)
+    try:
+        ZZ_inverse = np.linalg.inv(ZZ_subsets)
+    except np.linalg.LinAlgError:
+        ZZ_inverse = np.linalg.pinv(ZZ_subsets)
+    coefficients = np.matmul(ZZ_inverse, ZY_subsets)
+    
+    nb_obs = np.asarray(nb_obs, dtype=np.float64)[..., None, None]
+    dof = nb_obs - nb_regressors[:, None]
+    
+    with np.errstate(invalid='ignore', divide='ignore'):
+        # residuals sum of squares, total sum of squares (uncentered if there is no constant, as in statsmodels)
+        RSS = YY[..., None, :] - (coefficients * ZY_subsets).sum(axis=-2)
+        TSS = YY - SY ** 2 / nb_obs[..., 0] if constant else YY
+        R2 = 1.0 - RSS / TSS[..., None, :]
+        
+        variances = np.diagonal(ZZ_inverse, axis1=-2, axis2=-1).copy()
+        
+        # constant of the data: constant - center_Z'slopes + center_Y, of variance v'(Z'Z)^-1 v with v = (1, -center_Z)
+        if centers is not None:
+            center_Z = np.where(mask, centers[0][..., index], 0.0)
+            coefficients[..., 0, :] += centers[1][..., None, :] - (center_Z[..., None] * coefficients).sum(axis=-2)
+            
+            v = -center_Z
+            v[..., 0] = 1.0
+            variances[..., 0] = np.matmul(np.matmul(v[..., None, :], ZZ_inverse), v[..., :, None])[..., 0, 0]
+        
+        std_errors = np.sqrt((RSS / dof)[..., None, :] * variances[..., None])
+        t_stats = coefficients / std_errors
+    
+    return coefficients, std_errors, t_stats, R2, dof
+
+
+# names of the (asset, subset, variable) of the results of ols_statistics, and their positions
+def ols_names(Y_assets, subsets, names_variables, index, mask):
+    assets, subsets_pos, variables_pos = np.nonzero(np.broadcast_to(mask[None, :, :], (len(Y_assets.columns),) + mask.shape))
+    names_subsets = [" + ".join(subset) for subset in subsets]
+    
+    names = pd.MultiIndex.from_arrays([np.array(Y_assets.columns.tolist(), dtype=object)[assets],
+                                       np.array(names_subsets, dtype=object)[subsets_pos],
+                                       np.array(names_variables, dtype=object)[index[subsets_pos, variables_pos]]],
+                                      names=["Asset", "Indicators", "Variable"])
+    
+    return names, (subsets_pos, variables_pos, assets)
+
+
+# OLS regressions of every asset of Y_assets on every subset of indicators of X_macro, with one stacked least-squares solve.
+# Typically, with the data from functions data_returns and data_lagged:
+#       regression_analysis(Y_assets, X_macro)                                         # all the subsets, with a constant
+#       regression_analysis(Y_assets, X_macro, [[col] for col in X_macro], False)      # each indicator alone, no constant
+# the cross-products of the whole sample are computed once, and the normal equations of all the subsets are solved together.
+# only the dates where all the assets and indicators are available are used.
+# returns a DataFrame indexed by (Asset, Indicators, Variable), with the coefficients, standard errors, t-stats, p-values,
+# R2 (uncentered if there is no constant, as in statsmodels) and number of observations
+def regression_analysis(Y_assets, X_macro, subsets=None, constant=True):
+    import scipy.stats as scs
+    
+    if subsets is None:
+        subsets = indicator_subsets(X_macro.columns)
+    
+    dates, Y, Z, names_variables = regression_data(Y_assets, X_macro, constant)
+    index, mask = subsets_positions(X_macro, subsets, constant)
+    
+    # cross-products of the whole sample, computed once
+    coefficients, std_errors, t_stats, R2, dof = ols_statistics(Z.T.dot(Z), Z.T.dot(Y), (Y ** 2).sum(axis=0), Y.sum(axis=0),
+                                                                len(dates), index, mask, constant)
+    p_values = 2.0 * scs.t.sf(np.abs(t_stats), dof[:, :, None])
+    
+    # one row per (asset, subset, variable)
+    names_index, positions = ols_names(Y_assets, subsets, names_variables, index, mask)
+    subsets_pos, variables_pos, assets = positions
+    
+    results = pd.DataFrame(index=names_index)
+    results["Coefficient"] = coefficients[positions]
+    results["Std Error"] = std_errors[positions]
+    results["t-stat"] = t_stats[positions]
+    results["P-value"] = p_values[positions]
+    results["R2"] = R2[subsets_pos, assets]
+    results["Observations"] = np.float64(len(dates))
+    
+    return results
+
+
+# number of dates between two re-accumulations of the sums of expanding regressions (see recursive_sums)
+expanding_block = 250
+
+
+# cross-products of the observations of each window (ending at each date) for recursive_regression, as in moments_update:
+# the dates are cut in blocks of "block" dates; in each block, the data is centered on the mean of the window at the start
+# of the block (with a constant only: centering without a constant would change the regression), and the cross-products
+# of the windows are differences of prefix sums which start at that window, so that the sums never run over more than
+# window + block observations (without cancellation between the levels of the data and their variations)
+# returns ZZ, ZY, YY, SY (dates x ...) of the centered data, and the centers (center_Z, center_Y) of each date
+def recursive_sums(Y, Z, window, block, constant):
+    nb_dates = len(Y)
+    starts = np.maximum(np.arange(nb_dates) - window + 1, 0) if window is not None else np.zeros(nb_dates, dtype=int)
+    
+    ZZ = np.zeros((nb_dates, Z.shape[1], Z.shape[1]))
+    ZY = np.zeros((nb_dates, Z.shape[1], Y.shape[1]))
+    YY, SY = np.zeros(Y.shape), np.zeros(Y.shape)
+    center_Z, center_Y = np.zeros(Z.shape), np.zeros(Y.shape)
+    
+    for block_start in range(0, nb_dates, block):
+        block_dates = np.arange(block_start, min(block_start + block, nb_dates))
+        first = starts[block_start]
+        
+        # the constant (first regressor) is not centered
+        if constant:
+            center_Z[block_dates] = np.concatenate([[0.0], Z[first:block_start + 1, 1:].mean(axis=0)])
+            center_Y[block_dates] = Y[first:block_start + 1].mean(axis=0)
+        
+        Zc = Z[first:block_dates[-1] + 1] - center_Z[block_start]
+        Yc = Y[first:block_dates[-1] + 1] - center_Y[block_start]
+        
+        # window sums = prefix sums at the end of the window - prefix sums before its start (prefix sums from "first")
+        for sums, products in [(ZZ, Zc[:, :, None] * Zc[:, None, :]), (ZY, Zc[:, :, None] * Yc[:, None, :]), (YY, Yc ** 2), (SY, Yc)]:
+            cumsum = np.concatenate([np.zeros((1,) + products.shape[1:]), np.cumsum(products, axis=0)])
+            sums[block_dates] = cumsum[block_dates - first + 1] - cumsum[starts[block_dates] - first]
+    
+    return ZZ, ZY, YY, SY, (center_Z, center_Y)
+
+
+# rolling (window = number of observations) or expanding (window = None) OLS regressions of every asset of Y_assets
+# on every subset of indicators of X_macro (by default each indicator alone, i.e. every asset/indicator pair).
+# the cross-products of the observations of each window are updated incrementally, centered and re-accumulated every
+# window dates (every expanding_block dates for expanding regressions) not to lose precision (see recursive_sums).
+# only the dates where all the assets and indicators are available are used, and a regression needs at least
+# min_periods observations (default: window, or the number of regressors + 1 for expanding regressions).
+# returns a DataFrame indexed by date, with columns (Statistic, Asset, Indicators, Variable), the statistics being
+# the coefficients, t-stats and R2 of the regression estimated with the data up to that date
+def recursive_regression(Y_assets, X_macro, window=None, subsets=None, constant=True, min_periods=None):
+    if subsets is None:
+        subsets = indicator_subsets(X_macro.columns, [1])
+    
+    dates, Y, Z, names_variables = regression_data(Y_assets, X_macro, constant)
+    index, mask = subsets_positions(X_macro, subsets, constant)
+    
+    # cross-products of the (centered) observations of each window
+    ZZ, ZY, YY, SY, centers = recursive_sums(Y, Z, window, window if window is not None else expanding_block, constant)
+    nb_obs = np.arange(1, len(dates) + 1, dtype=np.float64)
+    if window is not None:
+        nb_obs = np.minimum(nb_obs, window)
+    
+    if min_periods is None:
+        min_periods = window if window is not None else mask.shape[1] + 1
+    
+    coefficients, std_errors, t_stats, R2, dof = ols_statistics(ZZ, ZY, YY, SY, nb_obs, index, mask, constant,
+                                                                centers if constant else None)
+    
+    # one column per (statistic, asset, subset, variable)
+    names_columns, positions = ols_names(Y_assets, subsets, names_variables, index, mask)
+    subsets_pos, variables_pos, assets = positions
+    
+    statistics = [coefficients[:, subsets_pos, variables_pos, assets],
+                  t_stats[:, subsets_pos, variables_pos, assets],
+                  R2[:, subsets_pos, assets]]
+    
+    results = pd.DataFrame(np.concatenate(statistics, axis=1), index=dates,
+                           columns=pd.MultiIndex.from_tuples([(name,) + col for name in ["Coefficient", "t-stat", "R2"] for col in names_columns],
+                                                             names=["Statistic"] + names_columns.names))
+    
+    # not enough observations
+    results[nb_obs < min_periods] = np.nan
+    
+    return results
+
+
+# argument = pd.Series
+# keeps only the tails of the data: values below the lbound quantile and above the ubound quantile
+def cut_quantile(data, lbound, ubound):
+    data_cut = data.copy()
+    
+    # select data only above lbound quantile and beyond ubound quantile
+    data_cut = data_cut[(data_cut < data_cut.quantile(lbound)) | (data_cut > data_cut.quantile(ubound))]
+    
+    return data_cut
+
+
+# OLS regressions of every asset of Y_assets on each indicator of X_macro, keeping only the tails of the indicator
+# (see cut_quantile), for a whole grid of quantile_cuts = [(lbound, ubound), ...]. Ex: [(0.0, 0.75), (0.25, 0.75), (0.1, 0.9)]
+# each indicator is sorted once, and the cross-products of the sorted observations are accumulated (prefix sums):
+# the cross-products of the tails of any cut are then the sum of a prefix (lower tail) and of a suffix (upper tail),
+# so the whole grid costs about the same as a single regression.
+# only the dates where all the assets and indicators are available are used.
+# returns a DataFrame indexed by (Indicator, Lower quantile, Upper quantile, Asset, Variable), with the same columns as
+# function regression_analysis
+def quantile_regression_analysis(Y_assets, X_macro, quantile_cuts, constant=False):
+    import scipy.stats as scs
+    
+    dates, Y, X, names_indicators = regression_data(Y_assets, X_macro, False)
+    nb_obs, nb_indics = X.shape
+    
+    # sort each indicator once
+    order = np.argsort(X, axis=0, kind='mergesort')
+    X_sorted = np.take_along_axis(X, order, axis=0)
+    Y_sorted = Y[order]
+    
+    # prefix sums of the cross-products of the sorted observations (with a first row of zeros)
+    def prefix(values):
+        return np.concatenate([np.zeros((1,) + values.shape[1:]), np.cumsum(values, axis=0)])
+    
+    S1 = prefix(np.ones_like(X_sorted))
+    SX = prefix(X_sorted)
+    SXX = prefix(X_sorted ** 2)
+    SY = prefix(Y_sorted)
+    SXY = prefix(X_sorted[:, :, None] * Y_sorted)
+    SYY = prefix(Y_sorted ** 2)
+    
+    # number of observations in the lower tail (strictly below the lbound quantile),
+    # and position of the upper tail (strictly above the ubound quantile), for each indicator and each cut
+    lbounds = np.array([cut[0] for cut in quantile_cuts], dtype=np.float64)
+    ubounds = np.array([cut[1] for cut in quantile_cuts], dtype=np.float64)
+    columns = np.arange(nb_indics)[:, None]
+    
+    lower = np.array([np.searchsorted(X_sorted[:, i], np.quantile(X_sorted[:, i], lbounds), 'left') for i in range(nb_indics)])
+    upper = np.array([np.searchsorted(X_sorted[:, i], np.quantile(X_sorted[:, i], ubounds), 'right') for i in range(nb_indics)])
+    
+    # cross-products of the tails: (indicators x cuts x ...)
+    def tails(sums):
+        return sums[lower, columns] + sums[-1][columns] - sums[upper, columns]
+    
+    n, sx, sxx, sy, sxy, syy = [tails(sums) for sums in [S1, SX, SXX, SY, SXY, SYY]]
+    
+    # normal equations (constant first, if any)
+    if constant:
+        ZZ = np.stack([np.stack([n, sx], axis=-1), np.stack([sx, sxx], axis=-1)], axis=-2)
+        ZY = np.stack([sy, sxy], axis=-2)
+    else:
+        ZZ = sxx[..., None, None]
+        ZY = sxy[..., None, :]
+    
+    size = ZZ.shape[-1]
+    coefficients, std_errors, t_stats, R2, dof = ols_statistics(ZZ, ZY, syy, sy, n, np.arange(size)[None, :],
+                                                                np.ones((1, size), dtype=bool), constant)
+    p_values = 2.0 * scs.t.sf(np.abs(t_stats), dof[..., None])
+    
+    # one row per (indicator, cut, asset, variable)
+    def rows(values):
+        return values[:, :, 0].transpose(0, 1, 3, 2).ravel()
+    
+    names_index = pd.MultiIndex.from_tuples([(indicator, cut[0], cut[1], asset, variable)
+                                             for indicator in names_indicators for cut in quantile_cuts
+                                             for asset in Y_assets.columns for variable in (["const"] if constant else []) + [indicator]],
+                                            names=["Indicator", "Lower quantile", "Upper quantile", "Asset", "Variable"])
+    
+    results = pd.DataFrame(index=names_index)
+    results["Coefficient"] = rows(coefficients)
+    results["Std Error"] = rows(std_errors)
+    results["t-stat"] = rows(t_stats)
+    results["P-value"] = rows(p_values)
+    results["R2"] = rows(np.broadcast_to(R2[:, :, :, None, :], coefficients.shape))
+    results["Observations"] = rows(np.broadcast_to(n[:, :, None, None, None], coefficients.shape))
+    
+    return results
+
+
+
+
 #%%
 
 #==============================================================================
@@ -284,25 +850,41 @@ def data_returns(data, start_date, end_date, freq, lag):
 #==============================================================================
 
 
-# returns a slice of the matrix of returns (preferably from function data_returns), using returns over "periods" before "date"
-def data_slice(data, date, periods):
-    # creating a copy not to modify the initial dataset (Params are indeed passed by reference)
-    data_slice = data.copy()
+# values (read-only np.array), index and columns of the matrix of returns, for the slices of data_slice
+# computed once before a loop on the dates (e.g. in the optimization): the slices are then windows on the same array
+def slice_panel(data):
+    values = np.asarray(data.values, dtype=np.float64).view()
+    values.flags.writeable = False
     
-    # get data until date
+    return {"values": values, "index": data.index, "columns": data.columns}
+
+
+# returns a slice of the matrix of returns (preferably from function data_returns), using returns over "periods" before "date"
+# data is a DataFrame or a slice panel (see slice_panel, to compute the array once for several slices)
+# the slice is a read-only window on the values of data (no copy, it is called several times per date in the optimization):
+# modifying it raises a ValueError, unless it is a copy (copy=True)
+@instrumented(view=True)
+def data_slice(data, date, periods, copy=False):
+    panel = data if isinstance(data, dict) else slice_panel(data)
+    
+    # get data until date (position after the last date <= date, as data.loc[:date])
     # BE CAREFUL: date is the ACTUAL date, not the period date.
     # Ex: if data is monthly (every end of month = 31/01/2017) and you take first day of the month (01/01/2017),
     #       it won't take this month (last date = 31/12/2016)
-    data_slice = data_slice.loc[:date]
+    end = panel["index"].get_slice_bound(date, "right")
     
     # take only the previous "periods" number of time series
     # this returns a dataframe with exactly "periods" number of times series
-    data_slice = data_slice.iloc[-np.int(periods):]
+    start = max(end - int(periods), 0)
+    
+    if copy == True:
+        return pd.DataFrame(panel["values"][start:end].copy(), index=panel["index"][start:end], columns=panel["columns"])
     
-    return data_slice
+    return pd.DataFrame(panel["values"][start:end], index=panel["index"][start:end], columns=panel["columns"], copy=False)
 
 
 # returns the var_cov matrix from the matrix of returns (preferably from function data_returns), using returns over "periods" before "date"
+@instrumented()
 def data_var_cov(data, date, freq, periods):
     # take the slice
     data_var_cov = data_slice(data, date, periods)
@@ -311,21 +893,111 @@ def data_var_cov(data, date, freq, periods):
     return data_var_cov.cov() * annualization_factor(freq)
 
 
+# annualized returns and var_cov matrix (np.arrays) of the returns (preferably from function data_returns) over "periods" before "date"
+# data is a DataFrame or a slice panel (see slice_panel). Can be computed once and given to portfolio_optimize for several optimizations on the same date
+def portfolio_moments(data, date, freq, periods):
+    data_sliced = data_slice(data, date, periods)
+    
+    return data_sliced.mean().values * annualization_factor(freq), data_sliced.cov().values * annualization_factor(freq)
+
+
 # factor to annualize returns / variance
+# freq is a pandas frequency ('D', 'B', 'W', 'W-FRI', 'M', 'BM', 'Q', 'A'...): daily data is assumed to have 252 trading days
 def annualization_factor(freq):
-    # annualize (based on the freq of the data)
-    if freq == "D":
+    # annualize (based on the freq of the data, without its anchor: 'W-FRI' is weekly)
+    base = freq.split("-")[0].upper()
+    
+    if base in ["D", "B", "C"]:
         factor = 252.0
-    elif freq == "M":
+    elif base == "W":
+        factor = 52.0
+    elif base in ["SM", "SMS"]:
+        factor = 24.0
+    elif base in ["M", "MS", "BM", "BMS"]:
         factor = 12.0
-    elif freq == "Q":
+    elif base in ["Q", "QS", "BQ", "BQS"]:
         factor = 4.0
-    else:
+    elif base in ["A", "AS", "BA", "BAS", "Y", "YS", "BY", "BYS"]:
         factor = 1.0
+    else:
+        raise ValueError('No annualization factor for the frequency "%s"' % freq)
         
     return factor
 
 
+# incremental moments of the returns over "periods" before each date, for walk-forwards over many dates (e.g. daily rebalancing):
+# the sums and cross products of the window are updated with the returns entering and leaving it, instead of slicing and
+# computing the moments again at each date. data is the matrix of returns (preferably from function data_returns)
+# the returns are centered on the mean of the window at the last resync, as the variance of returns which are almost
+# constant (e.g. the RFR) would be lost in the rounding errors of the sums of squares otherwise
+# windows with missing returns are computed with portfolio_moments. Typically, for increasing dates:
+#       state = moments_state(Y_assets, freq, periods)
+#       moments = moments_update(state, date_shifted)
+def moments_state(data, freq, periods):
+    values = data.values.astype(np.float64)
+    
+    return {
+        "data": data,
+        "values": np.nan_to_num(values),
+        "missing": np.concatenate([[0], np.cumsum(np.isnan(values).any(axis=1))]),
+        "freq": freq,
+        "periods": int(periods),
+        "start": 0,
+        "end": 0,
+        "nb_updates": 0,
+        "center": np.zeros(values.shape[1]),
+        "sums": np.zeros(values.shape[1]),
+        "cross_products": np.zeros((values.shape[1], values.shape[1]))
+        }
+
+
+# moves the window of the state to the "periods" returns before date (as data_slice), returns the annualized returns and
+# var_cov matrix (as portfolio_moments). The sums are computed again from the window when it does not overlap the previous one,
+# or every "periods" updates not to accumulate rounding errors
+def moments_update(state, date):
+    values = state["values"]
+    end = state["data"].index.searchsorted(pd.Timestamp(date), side='right')
+    start = max(end - state["periods"], 0)
+    
+    if (start < state["start"]) or (start >= state["end"]) or (state["nb_updates"] % state["periods"] == 0):
+        centered_resync(state, values[start:end])
+    else:
+        centered_add(state, values[state["end"]:end], values[state["start"]:start])
+    
+    state["start"], state["end"] = start, end
+    state["nb_updates"] += 1
+    
+    if state["missing"][end] > state["missing"][start]:
+        return portfolio_moments(state["data"], date, state["freq"], state["periods"])
+    
+    return centered_moments(state, end - start, state["freq"])
+
+
+# sums and cross products of a window of returns, centered on the mean of the window (state with "center", "sums" and
+# "cross_products", see moments_state): computed again from the window, not to accumulate rounding errors
+def centered_resync(state, window):
+    if len(window) > 0:
+        state["center"] = window.mean(axis=0)
+    window = window - state["center"]
+    state["sums"] = window.sum(axis=0)
+    state["cross_products"] = window.T.dot(window)
+
+
+# updates the centered sums and cross products with the returns entering and leaving the window
+def centered_add(state, entering, leaving):
+    entering, leaving = entering - state["center"], leaving - state["center"]
+    state["sums"] += entering.sum(axis=0) - leaving.sum(axis=0)
+    state["cross_products"] += entering.T.dot(entering) - leaving.T.dot(leaving)
+
+
+# annualized returns and var_cov matrix of the nb_obs returns of the window, from the centered sums and cross products
+def centered_moments(state, nb_obs, freq):
+    factor = annualization_factor(freq)
+    mean = state["sums"] / nb_obs
+    
+    return (state["center"] + mean) * factor, (state["cross_products"] - nb_obs * np.outer(mean, mean)) / (nb_obs - 1) * factor
+
+
 # function that computes return and vol of the portfolio on the time series data_sliced (preferably from function data_slice)
 # returned stats are annualized using the given "freq"
 # data_sliced is the investment universe, and weights must have the same size than data_sliced
@@ -344,61 +1016,121 @@ def portfolio_stats(weights, data_sliced, freq):
 
 
 # returns the optimized portfolio for a given target_vol, based on the characteristics of the dataset (data, date, freq, periods)
-def portfolio_optimize(init_weights, target_vol, bnds, data, date, freq, periods):
+# the annualized mean and var_cov of the returns are computed once: the objectives, the constraints and their
+# analytic gradients are then numpy products (no finite differences)
+# solver is 'SLSQP' (default), or 'L-BFGS-B' for large universes (50-200 assets) when maximizing the sharpe ratio or the utility:
+# the RFR (last asset, unbounded) then takes the rest of the portfolio (1 - sum of the other weights), so the weights constraint
+# disappears and the problem only has bounds. Much faster, but as the sharpe ratio is flat along some directions,
+# the weights found can differ from SLSQP for the same sharpe ratio
+# moments are the annualized returns and var_cov matrix from portfolio_moments (computed here if None, data and date are then unused)
+@instrumented()
+def portfolio_optimize(init_weights, target_vol, bnds, data, date, freq, periods, solver='SLSQP', moments=None):
+    import scipy.optimize as sco
+    
     # make sure init_weights are in the appropriate format
-    init_weights = np.array(init_weights)
+    init_weights = np.array(init_weights, dtype=np.float64)
     
-    # get the returns time series
-    data_sliced = data_slice(data, date, periods)
+    # annualized returns and var_cov matrix of the assets (as in portfolio_stats)
+    if moments is None:
+        moments = portfolio_moments(data, date, freq, periods)
     
-    # initialize the weights constraint (weights should sum to max 100%)
-    cons = [{'type':'eq', 'fun':lambda x: 1.0 - x.sum()}]
+    mean, var_cov = moments
     
     
-    # maximize the sharpe ratio
-    if target_vol == 'sharpe_ratio':
-        
-        risk_free_rate = data_sliced['RFR'].mean() * annualization_factor(freq)
-    
-        def objective(x):
-
-            sharpe_ratio = (portfolio_stats(x, data_sliced, freq)[0] - risk_free_rate) / portfolio_stats(x, data_sliced, freq)[1]
-            
-            return -sharpe_ratio
+    assert solver in ['SLSQP', 'L-BFGS-B'], 'Invalid solver (%s)' % solver
     
-        # optimization    
-        opt_S = sco.minimize(objective, init_weights, method='SLSQP', bounds=bnds, constraints=cons, options={'disp': False})
+    # maximize the sharpe ratio, or the utility function with a risk-aversion coefficient, without weights constraint (see above)
+    if (solver == 'L-BFGS-B') and ((target_vol == 'sharpe_ratio') or (type(target_vol) == tuple)) and np.isinf(bnds[-1]).all():
         
-    
-    # maximizes utility function with a risk-aversion coefficient
-    elif type(target_vol) == tuple:
+        # portfolio = RFR + sum(weights * (asset - RFR)): returns and var_cov of the positions in excess of the RFR
+        excess_mean = mean[:-1] - mean[-1]
+        excess_cov_rfr = var_cov[:-1, -1] - var_cov[-1, -1]
+        excess_var_cov = var_cov[:-1, :-1] - var_cov[:-1, [-1]] - var_cov[[-1], :-1] + var_cov[-1, -1]
         
-        def objective(x):
-
-            utility = portfolio_stats(x, data_sliced, freq)[0] - 0.5 * target_vol[1] * portfolio_stats(x, data_sliced, freq)[1] ** 2
+        # excess returns, variance of the portfolio, and half the gradient of the variance
+        def excess_stats(x):
+            var_cov_x = excess_var_cov.dot(x) + excess_cov_rfr
             
-            return -utility
+            return x.dot(excess_mean), x.dot(var_cov_x) + x.dot(excess_cov_rfr) + var_cov[-1, -1], var_cov_x
         
-        # optimization    
-        opt_S = sco.minimize(objective, init_weights, method='SLSQP', bounds=bnds, constraints=cons, options={'disp': False})
+        # returns the objective and its gradient
+        if target_vol == 'sharpe_ratio':
+            def objective(x):
+                excess_returns, ptf_var, var_cov_x = excess_stats(x)
+                ptf_vol = np.sqrt(ptf_var)
+                
+                return -excess_returns / ptf_vol, -(excess_mean / ptf_vol - excess_returns * var_cov_x / ptf_vol ** 3)
+        else:
+            def objective(x):
+                excess_returns, ptf_var, var_cov_x = excess_stats(x)
+                
+                utility = excess_returns + mean[-1] - 0.5 * target_vol[1] * ptf_var
+                
+                return -utility, -(excess_mean - target_vol[1] * var_cov_x)
         
+        # optimization
+        opt_S = sco.minimize(objective, init_weights[:-1], jac=True, method='L-BFGS-B', bounds=bnds[:-1])
         
-    # Optimize with a volatility objective / constraint
-    else:
-        # initialize the volatility constraint
-        cons += [{'type':'ineq', 'fun':lambda x: target_vol - portfolio_stats(x, data_sliced, freq)[1]}]
+        optimal_weights = np.append(opt_S['x'], 1.0 - opt_S['x'].sum())
     
-        # setting objective function
-        def objective(x):
-            # maximize return over the period..
-            return -portfolio_stats(x, data_sliced, freq)[0]
     
+    # general case (with the weights constraint), also used with a volatility target
+    else:
+        # initialize the weights constraint (weights should sum to max 100%)
+        ones = np.ones(len(init_weights))
+        cons = [{'type':'eq', 'fun':lambda x: 1.0 - x.sum(), 'jac':lambda x: -ones}]
+        
+        # maximize the sharpe ratio
+        if target_vol == 'sharpe_ratio':
+            
+            # ALWAYS PUT THE RISK-FREE RATE AT THE END
+            risk_free_rate = mean[-1]
+            
+            def objective(x):
+                var_cov_x = var_cov.dot(x)
+                ptf_vol = np.sqrt(x.dot(var_cov_x))
+                excess_returns = x.dot(mean) - risk_free_rate
+                
+                return -excess_returns / ptf_vol, -(mean / ptf_vol - excess_returns * var_cov_x / ptf_vol ** 3)
+        
+        # maximizes utility function with a risk-aversion coefficient
+        elif type(target_vol) == tuple:
+            
+            def objective(x):
+                var_cov_x = var_cov.dot(x)
+                
+                utility = x.dot(mean) - 0.5 * target_vol[1] * x.dot(var_cov_x)
+                
+                return -utility, -(mean - target_vol[1] * var_cov_x)
+        
+        # Optimize with a volatility objective / constraint
+        else:
+            # initialize the volatility constraint
+            def volatility_constraint(x):
+                return target_vol - np.sqrt(x.dot(var_cov.dot(x)))
+            
+            def volatility_constraint_jac(x):
+                var_cov_x = var_cov.dot(x)
+                return -var_cov_x / np.sqrt(x.dot(var_cov_x))
+            
+            cons += [{'type':'ineq', 'fun':volatility_constraint, 'jac':volatility_constraint_jac}]
+            
+            # setting objective function
+            def objective(x):
+                # maximize return over the period..
+                return -x.dot(mean), -mean
+        
         # optimization    
-        opt_S = sco.minimize(objective, init_weights, method='SLSQP', bounds=bnds, constraints=cons, options={'disp': False})
+        opt_S = sco.minimize(objective, init_weights, jac=True, method='SLSQP', bounds=bnds, constraints=cons, options={'disp': False})
         
+        optimal_weights = opt_S['x']
+    
+    
+    # optimizer iterations and function evaluations (when the instrumentation is enabled)
+    add_counters(iterations=opt_S['nit'], evaluations=opt_S['nfev'])
     
     # returns the optimal weights of the portfolio as a result
-    return opt_S['x']
+    return optimal_weights
 
 
 #%%
@@ -412,6 +1144,7 @@ def portfolio_optimize(init_weights, target_vol, bnds, data, date, freq, periods
 #       col = "Monetary Policy"
 #       signal_intensity(X_macro[col], macro_data[col], "2017 11 30")
 # returns the intensity of the signal for the "2017 11 30" (meaning we are forecasting the "2017 10 31")
+@instrumented(copied_arg=1)
 def signal_intensity(data_lagged, data_daily, date, method='quantile', granularity=2, thresholds=[-2, 2]):
     # we will compare the signal value at the given date, to the median of whole historical data_daily (previous)
     # be careful, as data_lagged is shifted by a certain period, so we must not use the data_daily during that shift
@@ -491,47 +1224,185 @@ def signal_intensity_zscores(data_daily_hist, signal_value, thresholds, excl=Fal
     return signal_intensity
 
 
-# gives the signal directions for an array of asset classes
-#       col = "Monetary Policy"
-#       signals_intensities(["Equities", "Bonds"], col)
-# don't put RFR
-def signal_directions(asset_classes, signal_name):
-    # store the results
-    signal_directions = []
+# default direction matrix of the signals (indicators x assets, RFR excluded): 1 if the asset benefits from a positive signal,
+# -1 if it suffers from it (0 if the indicator gives no view on the asset)
+def default_directions():
+    return pd.DataFrame([[ 1, -1],
+                         [-1, -1],
+                         [ 1, -1],
+                         [-1, -1],
+                         [ 1, -1],
+                         [ 1,  1]],
+                        index=["Growth", "Inflation", "International Trade", "Monetary Policy", "Risk Sentiment", "test"],
+                        columns=["Equities", "Bonds"])
+
+
+# direction matrix (indicators x assets) from a DataFrame, a dict {indicator: {asset: direction}} (e.g. from a YAML / JSON config),
+# or a CSV file with the indicators as rows and the assets as columns. Ex:
+#       Indicator,Equities,Bonds,Credit
+#       Growth,1,-1,1
+#       Inflation,-1,-1,-1
+def load_directions(directions):
+    if isinstance(directions, pd.DataFrame):
+        directions = directions.copy()
+    elif isinstance(directions, dict):
+        directions = pd.DataFrame.from_dict(directions, orient='index')
+    else:
+        directions = pd.read_csv(directions, index_col=0)
+    
+    if directions.isnull().values.any():
+        raise ValueError('Missing signal directions for the indicators %s' % directions.index[directions.isnull().any(axis=1)].tolist())
     
-    # find the signal
-    signals_names = list(["Growth", "Inflation", "International Trade", "Monetary Policy", "Risk Sentiment",
-                          "test"])
-    signal_index = signals_names.index(signal_name)
+    if not np.isin(directions.values, [-1, 0, 1]).all():
+        raise ValueError('Signal directions must be -1, 0 or 1')
     
-    # define the relations for each asset class
-    Equities_signals = list([1, -1, 1, -1, 1,
-                             1])
-    Bonds_signals    = list([-1, -1, -1, -1, -1,
-                             1])
+    return directions.astype(int)
+
+
+# matrix of the signal directions (np.array indicators x assets) of the given indicators and asset classes (don't put RFR)
+# directions is a direction matrix (see load_directions), default_directions() if None
+def signal_direction_matrix(asset_classes, signals_names, directions=None):
+    if directions is None:
+        directions = default_directions()
+    
+    missing = [signal for signal in signals_names if signal not in directions.index]
+    missing += [asset for asset in asset_classes if asset not in directions.columns]
+    if len(missing) > 0:
+        raise ValueError('No signal directions for %s' % missing)
     
-    # regroup for easier indexing
-    assets_names = list(["Equities", "Bonds"])
-    assets_signals = list([Equities_signals, Bonds_signals])
+    return directions.loc[list(signals_names), list(asset_classes)].values
+
+
+# reference values of the history data_daily_hist of a signal, to which its values are compared (see signal_intensities):
+# the quantiles i/granularity of the positive and of the negative history for the method 'quantile' (NaN if there is no
+# history of this sign), the center and the scale of the zscore for the other methods.
+# can be computed once and reused for any number of signal values (e.g. in the signal service, see ccp_service)
+def signal_references(data_daily_hist, method='quantile', granularity=2):
+    data_daily_hist = np.asarray(data_daily_hist, dtype=np.float64)
     
-    # complete the directions for the given signal and the given assets
-    for asset in asset_classes:
-        # finds the index of the asset
-        asset_index = assets_names.index(asset)
+    if method == 'quantile':
+        quantiles = np.arange(1, granularity, dtype=np.float64) / granularity
+        positive = data_daily_hist[data_daily_hist >= 0.0]
+        negative = data_daily_hist[data_daily_hist < 0.0]
         
-        # finds the signal direction for the given aset and the given signal_type
-        signal_directions.append(assets_signals[asset_index][signal_index])
+        return (np.quantile(positive, quantiles) if len(positive) > 0 else np.full(len(quantiles), np.nan),
+                np.quantile(negative, quantiles) if len(negative) > 0 else np.full(len(quantiles), np.nan))
     
-    # returns the array of signal directions
-    return np.array(signal_directions)
+    elif method == 'zscore_robust':
+        return np.median(data_daily_hist), np.quantile(data_daily_hist, 0.75) - np.quantile(data_daily_hist, 0.25)
+    
+    elif method in ['zscore', 'zscore_excl']:
+        return data_daily_hist.mean(), data_daily_hist.std(ddof=1)
+    
+    else:
+        raise ValueError('Method "%s" for computing signal intensity does not exist' % method)
+
+
+# quantiles q of sorted values, with the linear interpolation of np.quantile
+def sorted_quantiles(sorted_values, q):
+    index = np.asarray(q, dtype=np.float64) * (len(sorted_values) - 1)
+    below = np.floor(index).astype(int)
+    above = np.minimum(below + 1, len(sorted_values) - 1)
+    t = index - below
+    
+    a, b = sorted_values[below], sorted_values[above]
+    
+    return np.where(t >= 0.5, b - (b - a) * (1 - t), a + (b - a) * t)
+
+
+# incremental references of the history of a signal, for walk-forwards over many dates (e.g. daily rebalancing):
+# the history is kept sorted (new observations are inserted), so the quantiles are read instead of computed on the whole
+# history at each date, and the mean / std of the zscore come from the sums of the observations
+def references_state(data_daily_hist=()):
+    state = {"sorted": np.zeros(0), "sum": 0.0, "sum_squares": 0.0}
+    references_add(state, data_daily_hist)
+    
+    return state
+
+
+def references_add(state, values):
+    values = np.sort(np.asarray(values, dtype=np.float64))
+    values = values[~np.isnan(values)]
+    
+    state["sorted"] = np.insert(state["sorted"], state["sorted"].searchsorted(values), values)
+    state["sum"] += values.sum()
+    state["sum_squares"] += values.dot(values)
+
+
+# same references as signal_references (up to rounding for the zscore), from the state
+def state_references(state, method='quantile', granularity=2):
+    sorted_values = state["sorted"]
+    
+    if method == 'quantile':
+        quantiles = np.arange(1, granularity, dtype=np.float64) / granularity
+        split = sorted_values.searchsorted(0.0, side='left')
+        negative, positive = sorted_values[:split], sorted_values[split:]
+        
+        return (sorted_quantiles(positive, quantiles) if len(positive) > 0 else np.full(len(quantiles), np.nan),
+                sorted_quantiles(negative, quantiles) if len(negative) > 0 else np.full(len(quantiles), np.nan))
+    
+    elif method == 'zscore_robust':
+        quartiles = sorted_quantiles(sorted_values, [0.25, 0.5, 0.75])
+        return quartiles[1], quartiles[2] - quartiles[0]
+    
+    elif method in ['zscore', 'zscore_excl']:
+        nb_obs = len(sorted_values)
+        return state["sum"] / nb_obs, np.sqrt((state["sum_squares"] - state["sum"] ** 2 / nb_obs) / (nb_obs - 1))
+    
+    else:
+        raise ValueError('Method "%s" for computing signal intensity does not exist' % method)
+
+
+# intensities of several values of a signal at once, from the references of its history (see signal_references)
+def signal_intensities_references(references, signal_values, method='quantile', granularity=2, thresholds=[-2, 2]):
+    signal_values = np.asarray(signal_values, dtype=np.float64)
+    
+    # sign of the signals
+    sign = signal_values >= 0.0
+    
+    if method == 'quantile':
+        positive_quantiles, negative_quantiles = references
+        
+        # as in signal_intensity_quantiles, the intensity is given by the last quantile i/granularity passed by the signal
+        levels = np.arange(1, granularity)
+        positive_intensities = 1 + ((signal_values[:, None] > positive_quantiles[None, :]) * levels).max(axis=1, initial=0)
+        negative_intensities = -1 - ((signal_values[:, None] < negative_quantiles[None, :]) * levels).max(axis=1, initial=0)
+        
+        return np.where(sign, positive_intensities, negative_intensities)
+    
+    else:
+        assert thresholds[0] < 0.0, ('Negative threshold for zscore (%0.2f) is positive' % thresholds[0])
+        assert thresholds[1] > 0.0, ('Positive threshold for zscore (%0.2f) is negative' % thresholds[1])
+        
+        center, scale = references
+        signal_zscores = (signal_values - center) / scale
+        
+        intensities = np.zeros(len(signal_values), dtype=int) if method == 'zscore_excl' else np.where(sign, 1, -1)
+        intensities = np.where(signal_zscores > thresholds[1], 2, intensities)
+        intensities = np.where(signal_zscores < thresholds[0], -2, intensities)
+        
+        return intensities
+
+
+# intensities of several values of a signal at once (e.g. the shocked values of stress scenarios), compared to the same
+# history data_daily_hist (see signal_intensity). Same results as signal_intensity_quantiles / signal_intensity_zscores for each value
+def signal_intensities(data_daily_hist, signal_values, method='quantile', granularity=2, thresholds=[-2, 2]):
+    return signal_intensities_references(signal_references(data_daily_hist, method, granularity), signal_values,
+                                         method, granularity, thresholds)
+
+
+# gives the signal directions for an array of asset classes
+#       col = "Monetary Policy"
+#       signal_directions(["Equities", "Bonds"], col)
+# don't put RFR
+def signal_directions(asset_classes, signal_name, directions=None):
+    return signal_direction_matrix(asset_classes, [signal_name], directions)[0]
 
 
 
 # returns boundaries based on the signal and the considered granularity (intensity <= granularity)
+@instrumented()
 def signal_boundaries(intensity, directions, granularity=2):
-    # number of assets
-    n = len(directions)
-    
     granularity = np.float64(granularity)
     
     # upper & lower bounds based on the granularity
@@ -539,10 +1410,11 @@ def signal_boundaries(intensity, directions, granularity=2):
     lb = ub - 1/granularity
     bounds = np.array([lb, ub])
     
-    # boundaries for the assets
+    # boundaries for the assets (n x 2), all at once
     # we need a tuple (lb, ub) for each asset. and we must have lb < ub.
-    # so we sort the list before converting it into a tuple
-    signal_boundaries = [tuple(sorted(directions[i] * bounds * np.sign(intensity))) for i in range(n)]
+    # so we sort each row before converting it into a tuple
+    signal_boundaries = np.sort(np.outer(np.asarray(directions, dtype=np.float64) * np.sign(intensity), bounds), axis=1)
+    signal_boundaries = list(zip(signal_boundaries[:, 0].tolist(), signal_boundaries[:, 1].tolist()))
     
     # additionnal boundary for the RFR
     signal_boundaries += [(-np.inf, np.inf)]
@@ -553,121 +1425,583 @@ def signal_boundaries(intensity, directions, granularity=2):
 
 
 
+#%%
+
+#==============================================================================
+# COMPACT REPRESENTATION
+#==============================================================================
+
+# compact copy of a daily panel (e.g. macro_data), to run more backtest workers per machine:
+# the values are stored in float32 (half the memory of float64), and the valid (non NaN) values in a bitmask
+# (one bit per value, packed along the dates), so that the history of a column is taken without scanning for NaN
+def compact_panel(data):
+    return {
+        "index": data.index,
+        "columns": data.columns,
+        "values": data.values.astype(np.float32),
+        "valid": np.packbits(data.notnull().values, axis=0)
+        }
+
+
+# dates and values (float32) of the valid observations of a column of a compact panel
+def panel_history(panel, column):
+    j = panel["columns"].get_loc(column)
+    valid = np.unpackbits(panel["valid"][:, j], count=len(panel["index"])).astype(bool)
+    
+    return panel["index"][valid], panel["values"][valid, j]
+
+
+# DataFrame (float32) of a compact panel
+def panel_frame(panel):
+    return pd.DataFrame(panel["values"], index=panel["index"], columns=panel["columns"])
+
+
+# intensities of the signals of each indicator at each date (np.array of int8, dates x indicators), computed all at once
+# as signal_intensity(X_macro[indicator], macro_data[indicator], date, ...) for each date and indicator.
+# the history of each indicator is read once, in the order of the dates (see references_state).
+# macro_data is a DataFrame or a compact panel (see compact_panel). With a compact panel, the signals of X_macro are
+# rounded to float32 as their history, so that they are compared with the same precision
+# as signal_intensity, raises an IndexError for a date without a previous date in X_macro (no history before the signal)
+@instrumented()
+def intensity_matrix(X_macro, macro_data, dates, method='quantile', granularity=2, thresholds=[-2, 2]):
+    assert granularity <= 127, 'Invalid granularity for int8 intensities (%i)' % granularity
+    
+    if isinstance(macro_data, pd.DataFrame):
+        panel = {"index": macro_data.index, "columns": macro_data.columns, "values": macro_data.values,
+                 "valid": np.packbits(macro_data.notnull().values, axis=0)}
+    else:
+        panel = macro_data
+    
+    # position of each date in X_macro, and date from where X_macro is shifted (see signal_intensity)
+    positions = X_macro.index.searchsorted(dates, side='right') - 1
+    if (positions < 1).any():
+        raise IndexError('No date of X_macro before %s to compute the history of the signals' % pd.DatetimeIndex(dates)[positions < 1][0])
+    dates_before = X_macro.index[positions - 1]
+    
+    intensities = np.zeros((len(dates), len(X_macro.columns)), dtype=np.int8)
+    
+    for i, indicator in enumerate(X_macro.columns):
+        history_dates, history_values = panel_history(panel, indicator)
+        signal_values = X_macro[indicator].values[positions].astype(panel["values"].dtype)
+        ends = history_dates.searchsorted(dates_before, side='right')
+        
+        state = references_state()
+        nb_added = 0
+        
+        for d in np.argsort(ends, kind='stable'):
+            references_add(state, history_values[nb_added:ends[d]])
+            nb_added = ends[d]
+            
+            intensities[d, i] = signal_intensities_references(state_references(state, method, granularity),
+                                                              signal_values[d:d + 1], method, granularity, thresholds)[0]
+    
+    return intensities
+
+
+#%%
+
+#==============================================================================
+# PORTFOLIO AGGREGATION
+#==============================================================================
+
+# percentile rank (between 0 and 1) of each value compared to the other values of the last axis.
+# same result as [scs.percentileofscore(values, a, 'rank')/100.0 for a in values], but with a single argsort
+# instead of one scan per value. Works on a 1-D array (one date) or on a 2-D array (dates x indicators).
+def percentile_ranks(values):
+    values = np.asarray(values, dtype=np.float64)
+    n = values.shape[-1]
+    positions = np.arange(n)
+
+    # sort the values once, and keep the order to put the ranks back at the end
+    order = np.argsort(values, axis=-1, kind='mergesort')
+    sorted_values = np.take_along_axis(values, order, axis=-1)
+
+    # tied values share the same ranks: flag the first and the last position of each group of equal values
+    group_start = np.ones(values.shape, dtype=bool)
+    group_start[..., 1:] = sorted_values[..., 1:] != sorted_values[..., :-1]
+    group_end = np.ones(values.shape, dtype=bool)
+    group_end[..., :-1] = group_start[..., 1:]
+
+    # number of values strictly below (= position of the first value of the group)
+    left = np.maximum.accumulate(np.where(group_start, positions, 0), axis=-1)
+
+    # number of values below or equal (= position of the last value of the group + 1)
+    right = np.minimum.accumulate(np.where(group_end, positions + 1, n)[..., ::-1], axis=-1)[..., ::-1]
+
+    # 'rank' percentile as in scipy (left < right always holds here, as each value counts itself)
+    sorted_ranks = (left + right + 1) * (0.5 / n)
+
+    ranks = np.empty_like(sorted_ranks)
+    np.put_along_axis(ranks, order, sorted_ranks, axis=-1)
+
+    return ranks
+
+
+# returns of the portfolio of each indicator, with one matrix product
+# indicator_weights is (indicators x assets), or (dates x indicators x assets) for all dates at once
+# asset_returns is (assets), or (dates x assets)
+def momentum_returns(indicator_weights, asset_returns):
+    indicator_weights = np.asarray(indicator_weights, dtype=np.float64)
+    asset_returns = np.asarray(asset_returns, dtype=np.float64)
+
+    return np.matmul(indicator_weights, asset_returns[..., None])[..., 0]
+
+
+# updates the momentum weights of the indicators with the percentile of the previous period returns of their portfolio
+# momentum_weighting is the weight given to the new percentiles (the rest is given to the previous momentum weights)
+def momentum_weights_update(momentum_weights, indicator_weights_previous, asset_returns, momentum_weighting):
+    momentum_scores = percentile_ranks(momentum_returns(indicator_weights_previous, asset_returns))
+
+    return momentum_weighting * momentum_scores + (1 - momentum_weighting) * np.asarray(momentum_weights)
+
+
+# aggregates the portfolios of the indicators, each indicator being weighted by its momentum weight
+# works for one date (indicators) x (indicators x assets) or for all dates (dates x indicators) x (dates x indicators x assets)
+def momentum_aggregate(momentum_weights, indicator_weights):
+    momentum_weights = np.asarray(momentum_weights, dtype=np.float64)
+
+    return np.matmul(momentum_weights[..., None, :], indicator_weights)[..., 0, :] / momentum_weights.sum(axis=-1)[..., None]
+
+
+# computes the momentum weights of the indicators for all dates at once, from the stored weight tensor of the optimization
+# indicator_weights is (dates x indicators x assets): optimal weights of each indicator at each date
+# asset_returns is (dates x assets): returns of the period before each date (i.e. Y_assets at date_shifted)
+# returns the (dates x indicators) momentum weights used at each date, starting from init_weights
+def momentum_weights_path(indicator_weights, asset_returns, momentum_weighting, init_weights=0.5):
+    import scipy.signal as scsig
+    
+    indicator_weights = np.asarray(indicator_weights, dtype=np.float64)
+    nb_indics = indicator_weights.shape[1]
+
+    # at each date, the returns are computed with the weights of the previous date (no weights before the first date)
+    indicator_weights_previous = np.zeros_like(indicator_weights)
+    indicator_weights_previous[1:] = indicator_weights[:-1]
+
+    # percentiles of the indicators returns, for all dates
+    momentum_scores = percentile_ranks(momentum_returns(indicator_weights_previous, asset_returns))
+
+    # exponential smoothing: w(t) = momentum_weighting * score(t) + (1 - momentum_weighting) * w(t-1)
+    # computed as a linear filter on the whole path, starting from init_weights
+    init_weights = np.broadcast_to(np.asarray(init_weights, dtype=np.float64), (nb_indics,))
+    decay = 1.0 - momentum_weighting
+
+    return scsig.lfilter([momentum_weighting], [1.0, -decay], momentum_scores, axis=0, zi=decay * init_weights[None, :])[0]
+
+
+
+
+
+#%%
+
+#==============================================================================
+# TRANSACTION COSTS
+#==============================================================================
+
+# cost of trading one unit of weight of each asset, as an array ordered like "assets"
+# costs can be a scalar (same cost for every asset except the cash asset) or a dict / pd.Series by asset name (missing assets cost 0)
+def asset_costs(costs, assets, cash="RFR"):
+    if np.isscalar(costs):
+        return np.array([0.0 if asset == cash else np.float64(costs) for asset in assets])
+
+    costs = pd.Series(costs, dtype=np.float64)
+
+    return costs.reindex(index=assets).fillna(0.0).values
+
+
+# computes the turnover, transaction costs and net returns of one or several strategies in a single vectorized pass.
+# strategy_results is a DataFrame from function 'optimization' (weights of each asset + "Return"), or a list of them
+#       (e.g. one per optimization period). The strategies can have different dates.
+# linear_costs and quadratic_costs are given per unit of weight traded (e.g. 0.001 = 10bp), see asset_costs
+# the weights traded at each date are the new weights minus the weights of the previous date drifted with the assets returns.
+# on the first date of each strategy, the previous weights are initial_weights (default: no position, so the full portfolio is bought)
+# returns a DataFrame (or a list of DataFrames) with columns: Turnover, Linear Cost, Quadratic Cost, Cost, Net Return
+def transaction_costs(strategy_results, Y_assets, linear_costs, quadratic_costs=0.0, initial_weights=None, cash="RFR"):
+    single = isinstance(strategy_results, pd.DataFrame)
+    if single:
+        strategy_results = [strategy_results]
+
+    assets = Y_assets.columns.tolist()
+
+    # all the strategies are stacked one after the other, so everything is computed at once
+    lengths = np.array([len(results) for results in strategy_results])
+    starts = np.concatenate([[0], np.cumsum(lengths)[:-1]])
+
+    weights = np.concatenate([results.values[:, :len(assets)] for results in strategy_results]).astype(np.float64)
+    gross_returns = np.concatenate([results.values[:, len(assets)] for results in strategy_results]).astype(np.float64)
+    returns = np.concatenate([Y_assets.reindex(index=results.index).values for results in strategy_results]).astype(np.float64)
+
+    # weights held just before rebalancing: previous weights drifted with the previous period returns
+    weights_drifted = np.zeros_like(weights)
+    weights_drifted[1:] = weights[:-1] * (1.0 + returns[:-1]) / (1.0 + np.sum(weights[:-1] * returns[:-1], axis=1))[:, None]
+
+    # no previous weights at the beginning of each strategy
+    weights_drifted[starts] = 0.0 if initial_weights is None else np.asarray(initial_weights, dtype=np.float64)
+
+    # the cash asset is not traded
+    traded = np.array([asset != cash for asset in assets])
+    trades = np.nan_to_num(weights - weights_drifted) * traded
+
+    turnover = np.abs(trades).sum(axis=1)
+    linear_cost = np.abs(trades).dot(asset_costs(linear_costs, assets, cash))
+    quadratic_cost = (trades ** 2).dot(asset_costs(quadratic_costs, assets, cash))
+
+    costs = np.column_stack([turnover, linear_cost, quadratic_cost, linear_cost + quadratic_cost,
+                             gross_returns - linear_cost - quadratic_cost])
+
+    # split back the results for each strategy
+    results = []
+    for i, strategy in enumerate(strategy_results):
+        results.append(pd.DataFrame(costs[starts[i]:starts[i] + lengths[i]], index=strategy.index,
+                                    columns=["Turnover", "Linear Cost", "Quadratic Cost", "Cost", "Net Return"]))
+
+    return results[0] if single else results
+
+
+
+
+
 #%%
 
 #==============================================================================
 # RETURNS ANALYSIS
 #==============================================================================
 
+def period_name(period):
+    """Returns a string in the form '1980 - 1989'."""
+    year_start = period[0][:4]
+    year_end = period[1][:4]
+    return year_start + " - " + year_end
+
+def period_names_list(periods):
+    """Returns a list using function period_name."""
+    return [period_name(period) for period in periods]
+
+
 # Sharpe Ratio (the argument dataframe must have a RFR). Typically:
 #       period_returns.columns = [["Equities", "Bonds", "RFR", "Strategy"]]
 def sharpe_ratio(period_returns, freq):
-    results = pd.Series(index=period_returns.columns, dtype=np.float64)
+    rfr_index = period_returns.columns.get_loc("RFR")
     
-    for asset in period_returns:
-        results[asset] = np.sqrt(annualization_factor(freq)) * (period_returns[asset] - period_returns["RFR"]).mean() / period_returns[asset].std()
-        
-    return results
+    return pd.Series(returns_statistics(period_returns.values, freq, rfr_index, rfr_index)[:, 3], index=period_returns.columns)
 
 def max_drawdown(returns):
     """Computes the max drawdown over an array of returns."""
     
+    returns = np.asarray(returns, dtype=np.float64)[:, None]
+    
+    return max_drawdowns(returns)[0]
+
+
+# computes the max drawdown over the period
+def max_drawdown_period(period_returns):
+    return pd.Series(max_drawdowns(period_returns.values), index=period_returns.columns)
+
+
+# names of the statistics computed by returns_statistics, in the same order
+names_statistics = ["Returns",
+                    "Volatility",
+                    "Correlation",
+                    "Sharpe Ratio",
+                    "Drawdown"]
+
+
+# max drawdown of each column of an array of returns (..., dates, assets), in one pass.
+# the end of the drawdown is the date with the largest loss from the previous peak, and the drawdown is
+# expressed in percentage of that peak. Missing returns (NaN) are skipped.
+def max_drawdowns(returns):
+    returns = np.asarray(returns, dtype=np.float64)
+    
     # computes prices from returns
-    prices = (1.0 + returns).cumprod()
+    prices = np.cumprod(1.0 + np.nan_to_num(returns), axis=-2)
+    peaks = np.maximum.accumulate(prices, axis=-2)
     
     # end of the period
-    dd_end = np.argmax(np.maximum.accumulate(prices) - prices)
-    
-    # start of period
-    dd_start = np.argmax(prices[:dd_end])
+    dd_end = np.argmax(peaks - prices, axis=-2)[..., None, :]
+    
+    # returns max_drawdown in percentage of the previous peak
+    peak_end = np.take_along_axis(peaks, dd_end, axis=-2)[..., 0, :]
+    price_end = np.take_along_axis(prices, dd_end, axis=-2)[..., 0, :]
+    drawdowns = (peak_end - price_end) / peak_end
+    
+    return np.where(np.isnan(returns).all(axis=-2), np.nan, drawdowns)
+
+
+# statistics of each column of an array of returns (..., dates, assets), computed in one NumPy pass.
+# returns an array (..., assets, statistics), the statistics being in the order of names_statistics.
+# the leading dimensions can be anything, e.g. (strategies x periods) for a whole parameter sweep.
+# rfr_index and strategy_index are the positions of the RFR and the strategy in the assets axis.
+# missing returns (NaN, e.g. periods of different lengths padded at the end) are skipped, as in pandas.
+def returns_statistics(returns, freq, rfr_index, strategy_index):
+    returns = np.asarray(returns, dtype=np.float64)
+    factor = annualization_factor(freq)
+    
+    valid = ~np.isnan(returns)
+    filled = np.where(valid, returns, 0.0)
+    
+    with np.errstate(invalid='ignore', divide='ignore'):
+        # return, vol
+        count = valid.sum(axis=-2)
+        mean = filled.sum(axis=-2) / count
+        deviations = np.where(valid, returns - mean[..., None, :], 0.0)
+        std = np.sqrt((deviations ** 2).sum(axis=-2) / (count - 1))
+        
+        # correlation with the strategy, on the dates where both are available
+        strategy = np.take(returns, [strategy_index], axis=-1)
+        pairs = valid & ~np.isnan(strategy)
+        pairs_count = pairs.sum(axis=-2)
+        x = np.where(pairs, returns, 0.0)
+        y = np.where(pairs, strategy, 0.0)
+        x = np.where(pairs, x - (x.sum(axis=-2) / pairs_count)[..., None, :], 0.0)
+        y = np.where(pairs, y - (y.sum(axis=-2) / pairs_count)[..., None, :], 0.0)
+        correlation = (x * y).sum(axis=-2) / np.sqrt((x ** 2).sum(axis=-2) * (y ** 2).sum(axis=-2))
+        
+        # sharpe ratio: mean excess return over the RFR, divided by the volatility
+        excess = returns - np.take(returns, [rfr_index], axis=-1)
+        excess_valid = ~np.isnan(excess)
+        excess_mean = np.where(excess_valid, excess, 0.0).sum(axis=-2) / excess_valid.sum(axis=-2)
+        sharpe = np.sqrt(factor) * excess_mean / std
     
-    # returns max_drawdown in percentage
-    return (prices[dd_start] - prices[dd_end]) / prices[dd_start]
+    return np.stack([mean * factor * 100,
+                     std * np.sqrt(factor) * 100,
+                     correlation,
+                     sharpe,
+                     max_drawdowns(returns)], axis=-1)
 
 
-# computes the max drawdown over the period
-def max_drawdown_period(period_returns):
-    results = pd.Series(index=period_returns.columns, dtype=np.float64)
+# stacks the returns of several strategies over several periods, and the assets returns on the same dates,
+# into one array (strategies x periods x dates x (assets + "Strategy")). Periods shorter than the longest one are padded with NaN.
+# the assets returns are taken on the dates of each strategy and period (the strategies can have different dates)
+# strategies_results is a list (one per strategy) of lists (one per period) of DataFrames from function 'optimization'
+def returns_panel(strategies_results, Y_assets):
+    nb_strategies = len(strategies_results)
+    nb_periods = len(strategies_results[0])
+    nb_dates = max(len(period_results) for results in strategies_results for period_results in results)
+    nb_assets = len(Y_assets.columns)
     
-    for asset in period_returns:
-        results[asset] = max_drawdown(period_returns[asset])
+    panel = np.full((nb_strategies, nb_periods, nb_dates, nb_assets + 1), np.nan)
     
-    return results
+    for i, results in enumerate(strategies_results):
+        for j, period_results in enumerate(results):
+            panel[i, j, :len(period_results), :nb_assets] = Y_assets.reindex(index=period_results.index).values
+            panel[i, j, :len(period_results), nb_assets] = np.asarray(period_results.values[:, -1], dtype=np.float64)
+    
+    return panel
+
+
+# annualized turnover and costs of the strategy, and statistics of the strategy net of costs
+# strategy_costs is a DataFrame from function 'transaction_costs', rfr_returns the RFR returns on the same dates
+def costs_statistics(strategy_costs, rfr_returns, freq):
+    net_returns = strategy_costs["Net Return"]
+    
+    return pd.Series([strategy_costs["Turnover"].mean() * annualization_factor(freq) * 100,
+                      strategy_costs["Cost"].mean() * annualization_factor(freq) * 100,
+                      net_returns.mean() * annualization_factor(freq) * 100,
+                      np.sqrt(annualization_factor(freq)) * (net_returns - rfr_returns).mean() / net_returns.std()],
+                     index=["Turnover", "Costs", "Net Returns", "Net Sharpe Ratio"])
+
 
 # returns a dataframe with basic statistics on the portfolio for the given period
-def returns_analysis(strategy_returns, Y_assets, freq):
+# if strategy_costs is given (DataFrame from function 'transaction_costs'), the turnover, costs and net statistics
+# of the strategy are added as extra columns (only for the "Strategy" row)
+@instrumented()
+def returns_analysis(strategy_returns, Y_assets, freq, strategy_costs=None):
     
     # returns for the period (optimization_dates)
     period_returns = Y_assets.copy()
     period_returns = period_returns.reindex(index=strategy_returns.index)
     period_returns["Strategy"] = strategy_returns.copy()
     
-    # statistics for the period
-    period_statistics = pd.DataFrame(index=period_returns.columns)
+    # statistics for the period: return, vol, correlation, sharpe ratio, drawdown
+    # CAN ADD OTHER STATISTICS IN returns_statistics, IN THIS CASE MUST MODIFY "names_statistics" ABOVE
+    period_statistics = pd.DataFrame(returns_statistics(period_returns.values, freq, period_returns.columns.get_loc("RFR"), -1),
+                                     index=period_returns.columns, columns=names_statistics)
     
-    # return, vol, correlation, sharpe ratio
-    period_statistics["Returns"] = (period_returns.mean() * annualization_factor(freq) * 100)
-    period_statistics["Volatility"] = (np.sqrt(period_returns.var() * annualization_factor(freq)) * 100)
-    period_statistics["Correlation"] = period_returns.corr()["Strategy"]
-    period_statistics["Sharpe Ratio"] = sharpe_ratio(period_returns, freq)
-    period_statistics["Drawdown"] = max_drawdown_period(period_returns)
-    # CAN ADD OTHER STATISTICS, IN THIS CASE MUST MODIFY "names_indicators" IN THE FUNCTION "strategy_analysis" BELOW
+    if strategy_costs is not None:
+        strategy_costs = strategy_costs.reindex(index=strategy_returns.index)
+        
+        for name, value in costs_statistics(strategy_costs, period_returns["RFR"], freq).items():
+            period_statistics.loc["Strategy", name] = value
     
     return period_statistics
 
 
-def strategy_analysis(periods, strategy_results, Y_assets, freq):
+@instrumented()
+def strategy_analysis(periods, strategy_results, Y_assets, freq, strategy_costs=None):
     """Returns a MultiIndex DataFrame with statistics of the strategy
     for different optimization periods.
     
     periods -- list of tuples
     strategy_results -- list of DataFrames from function 'optimization'
     Y_assets -- DataFrame from function 'data_returns'
+    strategy_costs -- optional list of DataFrames from function 'transaction_costs'
     """
     
-    names_indicators = ["Returns",
-                        "Volatility",
-                        "Correlation",
-                        "Sharpe Ratio",
-                        "Drawdown"]
+    my_df = strategies_analysis(periods, [strategy_results], Y_assets, freq).loc[0]
     
-    names_periods = period_names_list(periods)
-    
-    names_columns = pd.MultiIndex.from_product([names_periods, names_indicators], names=['Periods', 'Indicators'])
-    names_index = [Y_assets.columns.tolist() + ["Strategy"]]
-    my_df = pd.DataFrame(index=names_index, columns=names_columns)
-    
-    
-    for i, period_results in enumerate(strategy_results):
-        my_df[names_periods[i]] = returns_analysis(period_results["Return"], Y_assets, freq)
+    if strategy_costs is not None:
+        names_periods = period_names_list(periods)
+        
+        for i, period_costs in enumerate(strategy_costs):
+            period_costs = period_costs.reindex(index=strategy_results[i].index)
+            rfr_returns = Y_assets["RFR"].reindex(index=period_costs.index)
+            
+            for name, value in costs_statistics(period_costs, rfr_returns, freq).items():
+                my_df.loc["Strategy", (names_periods[i], name)] = value
         
     return my_df
     # HOW TO USE THIS DATAFRAME
     # my_df.sort_index(axis=1).loc(axis=1)[:, 'Volatility']
 
-#%%
-
-
-
-
-
-
-
-
-
 
+@instrumented()
+def strategies_analysis(periods, strategies_results, Y_assets, freq, strategies_names=None):
+    """Returns a MultiIndex DataFrame with statistics of several strategies
+    (e.g. a parameter sweep) for different optimization periods.
+    Every statistic of every strategy, period and asset is computed in one NumPy pass.
+    
+    periods -- list of tuples
+    strategies_results -- list (one per strategy) of lists of DataFrames from function 'optimization'
+    Y_assets -- DataFrame from function 'data_returns'
+    strategies_names -- optional names of the strategies (default: 0, 1, 2...)
+    """
+    
+    names_periods = period_names_list(periods)
+    names_assets = Y_assets.columns.tolist() + ["Strategy"]
+    
+    if strategies_names is None:
+        strategies_names = list(range(len(strategies_results)))
+    
+    # statistics: strategies x periods x assets x statistics
+    statistics = returns_statistics(returns_panel(strategies_results, Y_assets), freq, Y_assets.columns.get_loc("RFR"), -1)
+    
+    # rows are (strategy, asset), columns are (period, statistic)
+    statistics = statistics.transpose(0, 2, 1, 3).reshape(len(strategies_names) * len(names_assets), -1)
+    
+    names_index = pd.MultiIndex.from_product([strategies_names, names_assets], names=['Strategies', 'Assets'])
+    names_columns = pd.MultiIndex.from_product([names_periods, names_statistics], names=['Periods', 'Indicators'])
+    
+    return pd.DataFrame(statistics, index=names_index, columns=names_columns)
 
+#%%
 
+#==============================================================================
+# ROLLING ANALYSIS
+#==============================================================================
 
+# names of the statistics computed by rolling_statistics, in the same order
+names_rolling_statistics = ["Sharpe Ratio",
+                            "Volatility",
+                            "Correlation",
+                            "Drawdown"]
 
 
+# sums over the trailing window of each date, along the dates axis (-2) of an array (..., dates, assets).
+# uses the cumulative sum, so the cost is linear in the number of dates whatever the window. The first window-1 dates are NaN.
+def rolling_sums(values, window):
+    cumsum = np.cumsum(values, axis=-2)
+    
+    sums = np.full(cumsum.shape, np.nan)
+    sums[..., window - 1:, :] = cumsum[..., window - 1:, :]
+    sums[..., window:, :] -= cumsum[..., :-window, :]
+    
+    return sums
 
 
+# maximum over the trailing window of each date, along the dates axis (-2) of an array (..., dates, assets).
+# van Herk / Gil-Werman algorithm: the dates are cut in blocks of "window" dates, and the max of any window is the max of
+# a running max from the end of one block and a running max from the start of the next one. Linear in the number of dates.
+# The first window-1 dates are NaN.
+def rolling_max(values, window):
+    values = np.asarray(values, dtype=np.float64)
+    nb_dates = values.shape[-2]
+    
+    # pad at the beginning so that the dates can be cut in blocks
+    nb_blocks = -(-nb_dates // window)
+    pad = nb_blocks * window - nb_dates
+    padded = np.concatenate([np.full(values.shape[:-2] + (pad,) + values.shape[-1:], -np.inf), values], axis=-2)
+    blocks = padded.reshape(values.shape[:-2] + (nb_blocks, window) + values.shape[-1:])
+    
+    # running max from the start and from the end of each block
+    prefix = np.maximum.accumulate(blocks, axis=-2).reshape(padded.shape)
+    suffix = np.maximum.accumulate(blocks[..., ::-1, :], axis=-2)[..., ::-1, :].reshape(padded.shape)
+    
+    # the window [s, s + window - 1] has for max: max(suffix[s], prefix[s + window - 1])
+    windows_max = np.maximum(suffix[..., :padded.shape[-2] - window + 1, :], prefix[..., window - 1:, :])
+    
+    results = np.full(values.shape, np.nan)
+    results[..., window - 1:, :] = windows_max[..., pad:, :]
+    
+    return results
 
 
+# rolling statistics of each column of an array of returns (..., dates, assets), over the trailing "window" dates.
+# returns an array (..., dates, assets, statistics), the statistics being in the order of names_rolling_statistics:
+#       annualized sharpe ratio (excess over the RFR), annualized volatility, correlation to the benchmark,
+#       and drawdown from the highest price of the window.
+# every statistic is computed with cumulative sums / running max, so the cost is linear in the number of dates.
+# windows with missing returns (NaN) are NaN, as in pandas rolling.
+def rolling_statistics(returns, freq, window, rfr_index, benchmark_index):
+    returns = np.asarray(returns, dtype=np.float64)
+    factor = annualization_factor(freq)
+    
+    valid = ~np.isnan(returns)
+    complete = rolling_sums(valid.astype(np.float64), window) == window
+    
+    with np.errstate(invalid='ignore', divide='ignore'):
+        # returns are centered on their mean before the cumulative sums, to limit rounding errors
+        center = np.nanmean(returns, axis=-2, keepdims=True)
+        centered = np.where(valid, returns - center, 0.0)
+        
+        # rolling mean and volatility
+        mean = rolling_sums(centered, window) / window
+        std = np.sqrt(np.maximum((rolling_sums(centered ** 2, window) - window * mean ** 2) / (window - 1), 0.0))
+        
+        # rolling correlation to the benchmark
+        benchmark = np.take(centered, [benchmark_index], axis=-1)
+        benchmark_mean = np.take(mean, [benchmark_index], axis=-1)
+        benchmark_std = np.take(std, [benchmark_index], axis=-1)
+        covariance = (rolling_sums(centered * benchmark, window) - window * mean * benchmark_mean) / (window - 1)
+        correlation = covariance / (std * benchmark_std)
+        
+        # rolling sharpe ratio
+        excess_mean = (mean + center) - (np.take(mean, [rfr_index], axis=-1) + np.take(center, [rfr_index], axis=-1))
+        sharpe = np.sqrt(factor) * excess_mean / std
+        
+        # drawdown from the highest price of the window
+        prices = np.cumprod(1.0 + np.where(valid, returns, 0.0), axis=-2)
+        peaks = rolling_max(prices, window)
+        drawdown = (peaks - prices) / peaks
+    
+    sharpe = np.where(complete & np.take(complete, [rfr_index], axis=-1), sharpe, np.nan)
+    correlation = np.where(complete & np.take(complete, [benchmark_index], axis=-1), correlation, np.nan)
+    volatility = np.where(complete, std * np.sqrt(factor) * 100, np.nan)
+    drawdown = np.where(complete, drawdown, np.nan)
+    
+    return np.stack([sharpe, volatility, correlation, drawdown], axis=-1)
 
 
+# returns a dataframe of the rolling statistics (see rolling_statistics) of the assets and of the strategies.
+# strategies_returns is a pd.Series, or a DataFrame with one column per strategy. Typically, for the results
+# of function 'optimization' on consecutive periods:
+#       pd.concat([period_results.iloc[:, -1] for period_results in strategy_results]).rename("Strategy")
+# columns of the result are (statistic, asset), e.g. my_df["Sharpe Ratio"]
+def rolling_analysis(strategies_returns, Y_assets, freq, window=36, benchmark="Equities"):
+    strategies_returns = pd.DataFrame(strategies_returns)
+    
+    # returns for the period, assets first then the strategies
+    period_returns = Y_assets.reindex(index=strategies_returns.index)
+    period_returns = pd.concat([period_returns, strategies_returns], axis=1)
+    
+    statistics = rolling_statistics(period_returns.values, freq, window,
+                                    period_returns.columns.get_loc("RFR"), period_returns.columns.get_loc(benchmark))
+    
+    # rows are the dates, columns are (statistic, asset)
+    statistics = statistics.transpose(0, 2, 1).reshape(len(period_returns.index), -1)
+    names_columns = pd.MultiIndex.from_product([names_rolling_statistics, period_returns.columns], names=['Indicators', 'Assets'])
+    
+    return pd.DataFrame(statistics, index=period_returns.index, columns=names_columns)
 
+#%%
 
 
 
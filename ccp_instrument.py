@@ -0,0 +1,289 @@
+import functools
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+
+
+#%%
+
+#==============================================================================
+# INSTRUMENTATION OF THE PIPELINE
+#==============================================================================
+
+# opt-in instrumentation of the pipeline: wall time, calls, optimizer iterations / function evaluations and bytes
+# allocated, per stage and per optimization date. Typically:
+#       enable_instrumentation()
+#       strategy_results = optimization_periods_results(params, optimization_periods)
+#       instrumentation_summary()               # one row per stage
+#       instrumentation_table()                 # one row per (stage, date)
+# when the instrumentation is disabled (default), the instrumented functions only pay for one test.
+#
+# the memory allocated can also be measured with tracemalloc, for some stages only (tracemalloc slows down all the code):
+#       enable_instrumentation(memory=["data_slice", "optimizer"])      # groups of memory_groups, or names of stages
+#       instrumentation_summary()[["Peak", "Allocated"]]
+# Peak is the highest memory allocated during one call of the stage (above the memory allocated when it was called),
+# and Allocated the cumulative memory allocated by the stage over its calls: the memory allocated by the traced stages it
+# calls (each call counted, e.g. a copy of the data per date), plus the rise of the memory to its peak in each stretch of
+# its own code between them. tracemalloc only sees the memory in use: memory allocated and freed several times within one
+# stretch (e.g. a loop without traced stage) is counted once, to count each time, trace the loop body (see stage)
+
+
+# records[(stage, date)] = [seconds, calls, iterations, evaluations, bytes, peak, allocated] (None when disabled)
+records = None
+
+# current optimization date, whether to print each date (replaces the old print_date flag), the stages traced by
+# tracemalloc (None: no memory tracing, True: all the stages), and whether tracemalloc was started by the instrumentation
+state = {"date": None, "verbose": False, "memory": None, "tracemalloc": False}
+
+# stages currently running (the counters are added to the innermost one)
+stack = []
+
+# traced stages currently running: [memory allocated when the stage was called, peak memory allocated by the stages it called,
+# memory allocated at the start of the current stretch of its own code, memory allocated by the stage until now]
+memory_stack = []
+
+names_counters = ["Seconds", "Calls", "Iterations", "Evaluations", "Bytes", "Peak", "Allocated"]
+
+# position of Peak in the records: the maximum over the calls (the other counters are summed)
+peak_counter = names_counters.index("Peak")
+
+# stages of the pipeline, by group (for the memory tracing)
+memory_groups = {
+    "import": ["import_time_series", "import_time_series_chunked", "merge_time_series_list"],
+    "transforms": ["shift_time_series", "diff_time_series", "returns_time_series", "relative_time_series",
+                   "ratio_relative_time_series", "geometric_mean", "moving_average", "weighted_moving_average",
+                   "decaying_moving_average", "composite_indicator", "data_lagged", "data_returns"],
+    "signal_intensity": ["signal_intensity", "signal_boundaries", "intensity_matrix"],
+    "data_slice": ["data_slice", "data_var_cov"],
+    "optimizer": ["portfolio_optimize"],
+    "analytics": ["returns_analysis", "strategy_analysis", "strategies_analysis"]
+    }
+
+
+# memory: None (no memory tracing), True (all the stages), or a list of groups of memory_groups and names of stages
+def enable_instrumentation(verbose=False, memory=None):
+    global records
+    records = {}
+    state["date"] = None
+    state["verbose"] = verbose
+    del stack[:]
+    del memory_stack[:]
+
+    if memory is None or memory is True:
+        state["memory"] = memory
+    else:
+        state["memory"] = set()
+        for name in memory:
+            state["memory"].update(memory_groups.get(name, [name]))
+
+    if state["memory"] is not None and not tracemalloc.is_tracing():
+        tracemalloc.start()
+        state["tracemalloc"] = True
+    elif state["memory"] is None and state["tracemalloc"]:
+        tracemalloc.stop()
+        state["tracemalloc"] = False
+
+
+# disables the instrumentation (and the memory tracing), and returns the records
+def disable_instrumentation():
+    global records
+    results, records = records, None
+
+    state["memory"] = None
+    if state["tracemalloc"]:
+        tracemalloc.stop()
+        state["tracemalloc"] = False
+
+    return results
+
+
+# stages traced by tracemalloc (None, True or a set of names of stages), e.g. to enable the same tracing in worker processes
+def memory_tracing():
+    return state["memory"]
+
+
+def instrumentation_enabled():
+    return records is not None
+
+
+# returns the records and starts new (empty) ones, e.g. to send the records of a worker process to the parent process
+def take_records():
+    global records
+    if records is None:
+        return None
+
+    results, records = records, {}
+    return results
+
+
+# sets the current optimization date (the stages are then recorded for this date)
+def set_date(date):
+    state["date"] = date
+
+    if state["verbose"] and date is not None:
+        print(date)
+
+
+# size in bytes of the data of a DataFrame, Series or np.array (0 for anything else)
+def nbytes(obj):
+    if isinstance(obj, pd.DataFrame):
+        return int(obj.memory_usage(index=True, deep=False).sum())
+    if isinstance(obj, (pd.Series, pd.Index)):
+        return int(obj.memory_usage(index=True, deep=False))
+    if isinstance(obj, np.ndarray):
+        return int(obj.nbytes)
+    return 0
+
+
+def add_record(key, counters):
+    record = records.get(key)
+    if record is None:
+        records[key] = list(counters)
+    else:
+        for i, value in enumerate(counters):
+            record[i] = max(record[i], value) if i == peak_counter else record[i] + value
+
+
+# starts measuring the memory of a stage, if it is traced. Returns whether it is
+def memory_enter(name):
+    if state["memory"] is None or not (state["memory"] is True or name in state["memory"]):
+        return False
+
+    current, peak = tracemalloc.get_traced_memory()
+
+    # the peak of tracemalloc is reset for the stage: the peak until now is kept for the stage which called it,
+    # and ends the current stretch of its code
+    if memory_stack:
+        memory_stack[-1][1] = max(memory_stack[-1][1], peak)
+        memory_stack[-1][3] += max(peak - memory_stack[-1][2], 0)
+    tracemalloc.reset_peak()
+
+    memory_stack.append([current, current, current, 0])
+
+    return True
+
+
+# peak memory allocated during the stage (above the memory allocated when it was called), and memory allocated by the stage
+# (the rise of the memory in its last stretch of code is added). The stage which called it starts a new stretch
+def memory_exit():
+    current, peak = tracemalloc.get_traced_memory()
+    start, peak_called, stretch, allocated = memory_stack.pop()
+
+    allocated += max(peak - stretch, 0)
+    peak = max(peak, peak_called)
+    if memory_stack:
+        memory_stack[-1][1] = max(memory_stack[-1][1], peak)
+        memory_stack[-1][2] = current
+        memory_stack[-1][3] += allocated
+    tracemalloc.reset_peak()
+
+    return peak - start, allocated
+
+
+# adds counters (iterations, evaluations, bytes) to the innermost running stage
+def add_counters(iterations=0, evaluations=0, bytes=0):
+    if records is None or not stack:
+        return
+
+    add_record(stack[-1], [0.0, 0, iterations, evaluations, bytes, 0, 0])
+
+
+# records the wall time of a block of code as a stage. Ex:
+#       with stage("loc_write"):
+#           strategy_returns.loc[date] = ...
+@contextmanager
+def stage(name):
+    if records is None:
+        yield
+        return
+
+    key = (name, state["date"])
+    stack.append(key)
+    traced = memory_enter(name)
+    start = time.time()
+    try:
+        yield
+    finally:
+        seconds = time.time() - start
+        peak, allocated = memory_exit() if traced else (0, 0)
+        stack.pop()
+        add_record(key, [seconds, 1, 0, 0, 0, peak, allocated])
+
+
+# decorator recording each call of a function as a stage (the time of a stage includes the stages it calls)
+# the bytes recorded are the size of the returned object, plus the size of the argument at position copied_arg
+# if the function copies one of its arguments. Ex: @instrumented(copied_arg=0) for shift_time_series(data, lag_days)
+# view=True for a function returning a view of its arguments (nothing allocated), unless it is called with copy=True
+def instrumented(name=None, copied_arg=None, view=False):
+    def decorator(func):
+        stage_name = name or func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if records is None:
+                return func(*args, **kwargs)
+
+            key = (stage_name, state["date"])
+            stack.append(key)
+            traced = memory_enter(stage_name)
+            start = time.time()
+            try:
+                result = func(*args, **kwargs)
+            finally:
+                seconds = time.time() - start
+                peak, allocated = memory_exit() if traced else (0, 0)
+                stack.pop()
+
+            copied = nbytes(result) if (not view) or kwargs.get("copy", False) else 0
+            if copied_arg is not None and copied_arg < len(args):
+                copied += nbytes(args[copied_arg])
+            add_record(key, [seconds, 1, 0, 0, copied, peak, allocated])
+
+            return result
+
+        return wrapper
+
+    return decorator
+
+
+#%%
+
+#==============================================================================
+# EXPORT
+#==============================================================================
+
+# merges records (e.g. coming from worker processes) into the current records
+def merge_records(other_records):
+    if records is None or not other_records:
+        return
+
+    for key, counters in other_records.items():
+        add_record(key, counters)
+
+
+# returns a DataFrame with one row per (stage, date): Seconds, Calls, Iterations, Evaluations, Bytes, Peak, Allocated
+# (Peak and Allocated are 0 for the stages not traced by tracemalloc)
+# stages called outside of an optimization date have a NaT date
+def instrumentation_table(records_to_export=None):
+    if records_to_export is None:
+        records_to_export = records or {}
+
+    index = pd.MultiIndex.from_tuples(list(records_to_export.keys()), names=["Stage", "Date"]) if records_to_export \
+        else pd.MultiIndex.from_tuples([], names=["Stage", "Date"])
+
+    table = pd.DataFrame(list(records_to_export.values()), index=index, columns=names_counters)
+
+    return table.sort_index()
+
+
+# returns a DataFrame with one row per stage, sorted by total time
+def instrumentation_summary(records_to_export=None):
+    table = instrumentation_table(records_to_export)
+
+    summary = table.groupby(level="Stage").agg({name: "max" if name == "Peak" else "sum" for name in names_counters})
+    summary["Seconds per call"] = summary["Seconds"] / summary["Calls"]
+
+    return summary.sort_values("Seconds", ascending=False)
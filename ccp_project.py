@@ -1,24 +1,14 @@
-import datetime as dt
-import scipy.optimize as sco
-import scipy.stats as scs
-import statsmodels.regression.linear_model as sm
-
 import pandas as pd
-import pandas.tseries.offsets as pdtso
 
 import numpy as np
 
-import matplotlib.pyplot as plt
-import matplotlib.dates as mdates
-%matplotlib inline
-
 ################################
 # our modules
 
-# import sys
-# sys.path.insert(0, path)
+from ccp_functions import *
+from ccp_instrument import instrumented, stage, set_date, enable_instrumentation, instrumentation_summary
 
-# from ccp_functions import *
+# matplotlib is slow to import: it is imported in the plotting functions only
 
 
 
@@ -32,50 +22,103 @@ import matplotlib.dates as mdates
 # the signals used are X_macro and Y_assets (all the data available at the same frequency). Ex:
 #       Y_assets = data_returns(asset_classes, first_date, last_date, freq, 1)
 #       X_macro = data_lagged(macro_data, first_date, last_date, freq, 1)
+# macro_data is the daily data of the indicators (see ccp_data), used to compute the signal intensities
 # target vol is the volatility used for portfolio optimization
 # periods is the number of historical returns used for portfolio optimization (ie. estimating historical vol and returns)
+# directions is the matrix of the signal directions (indicators x assets, see load_directions), default_directions() if None
+# solver is the solver of portfolio_optimize ('SLSQP', or 'L-BFGS-B' for large universes)
+# compact: the intensities of all the dates are computed at once as int8 (see intensity_matrix), from macro_data which can then
+# be a compact panel (float32 values and validity bitmask, see compact_panel) to use less memory per worker
+# high_frequency: for daily ('B') or weekly ('W-FRI') rebalancing over thousands of dates. The intensities are computed at once
+# from the history read incrementally (as compact), the moments are updated incrementally (see moments_state), and the solver
+# starts from the previous optimal weights of an indicator when its intensity (so its boundaries) has not changed. The optimum
+# is not always unique: the sharpe ratio is flat along some directions, so the weights found can differ from the default mode
+# for the same sharpe ratio (compare the objective values, not the weights). Where the sharpe ratio is negative, the problem
+# has several local optima on the boundaries: if the solver started from the previous weights ends on a negative sharpe ratio,
+# the optimization is done again from the default initial weights (the sharpe ratio is then never below the default mode)
+# intensities are precomputed intensities of the signals (np.array optimization dates x indicators), e.g. calibrated on the
+# training data of a cross-validation split (see ccp_validation). They are computed at each date from macro_data if None
 # returns a dataframe over the period [start_date, end_date], with the weights of the portfolio and its returns
-def optimization(print_date, start_date, end_date, freq,
-        X_macro, Y_assets, target_vol, periods, granularity, method,
-        thresholds, reduce_indic, rescale_vol, momentum_weighting):
+# to display the dates and time each stage of the optimization, see ccp_instrument (enable_instrumentation(verbose=True))
+@instrumented()
+def optimization(start_date, end_date, freq,
+        X_macro, macro_data, Y_assets, target_vol, periods, granularity, method,
+        thresholds, reduce_indic, rescale_vol, momentum_weighting,
+        directions=None, solver='SLSQP', return_indicator_weights=False, compact=False, high_frequency=False,
+        intensities=None):
     
     # dates at which we optimize the portfolio    
     optimization_dates = pd.date_range(start=start_date, end=end_date, freq=freq)
     
+    # dates t-1, on which we do the optimization
+    optimization_dates_shifted = optimization_dates.shift(-1, freq=freq)
+    
     # output of the function = dataframe of the returns of the strategy
-    # columns are the weights of each asset, plus the return for the corresponding period
-    strategy_returns = pd.DataFrame(index=optimization_dates, columns=[Y_assets.columns.tolist() + ["Return"]], dtype=np.float64)
+    # columns are the weights of each asset, plus the return for the corresponding period (filled as a np.array)
+    strategy_values = np.full((len(optimization_dates), len(Y_assets.columns) + 1), np.nan)
+    Y_positions = Y_assets.index.get_indexer(optimization_dates)
+    Y_values = Y_assets.values
+    # read-only values of the returns, for the slices of each date (see data_slice)
+    Y_panel = slice_panel(Y_assets)
+    if (Y_positions < 0).any():
+        raise KeyError('No returns of the assets on %s' % optimization_dates[Y_positions < 0][0])
     
     
     nb_indics = len(X_macro.columns)
     momentum_weights = np.array([0.5] * nb_indics)
     optimal_weights_previous = np.zeros((nb_indics, len(Y_assets.columns)))
     
+    # signal directions of each indicator (rows) for each asset (columns, RFR excluded)
+    direction_matrix = signal_direction_matrix(Y_assets.columns[:-1], X_macro.columns,
+                                               None if directions is None else load_directions(directions))
+    
+    # compact / high frequency mode: intensities of the signals at all the dates (dates x indicators), and directions as int8
+    if (compact == True) or (high_frequency == True):
+        if intensities is None:
+            intensities = intensity_matrix(X_macro, macro_data, optimization_dates, method,
+                                           granularity if method == 'quantile' else 2, thresholds)
+        direction_matrix = direction_matrix.astype(np.int8)
+    
+    # high frequency mode: incremental moments, and optimal weights of each indicator before reduction (to restart the solver)
+    if high_frequency == True:
+        moments_window = moments_state(Y_assets, freq, periods)
+        solver_weights = np.zeros((nb_indics, len(Y_assets.columns)))
+    
+    # optimal weights of each indicator at each date (dates x indicators x assets)
+    # can be returned to compute the whole momentum weight path at once (see momentum_weights_path)
+    indicator_weights = np.zeros((len(optimization_dates), nb_indics, len(Y_assets.columns)))
+    
     # OUTSIDE LOOP ON THE OPTIMIZATION DATES
-    for date in optimization_dates:
-        # displays the date to show where we are in the optimization
-        if print_date == True:
-            print date
+    for d, date in enumerate(optimization_dates):
+        # the stages are recorded for this date (and the date displayed in verbose mode) when the instrumentation is enabled
+        set_date(date)
         
         # date t-1, on which we do the optimization
-        date_shifted = pd.DatetimeIndex(start=date, end=date, freq=freq).shift(n=-1, freq=freq)[0]
+        date_shifted = optimization_dates_shifted[d]
         
         # optimal weights for each macro indicator will be stored in this np.array
         optimal_weights = np.zeros((nb_indics, len(Y_assets.columns)))
         
+        # annualized returns and var_cov matrix over "periods" before date t-1, computed once for all the indicators
+        if high_frequency == True:
+            moments = moments_update(moments_window, date_shifted)
+        else:
+            moments = portfolio_moments(Y_panel, date_shifted, freq, periods)
+        
         # rolling target vol
-        if target_vol.keys()[0] == 'rolling':
-            vol_target = data_slice(Y_assets, date_shifted, target_vol.values()[0]).std().mean() * np.sqrt(annualization_factor(freq))
+        target_vol_method, target_vol_value = list(target_vol.items())[0]
+        if target_vol_method == 'rolling':
+            vol_target = data_slice(Y_panel, date_shifted, target_vol_value).std().mean() * np.sqrt(annualization_factor(freq))
             vol_method = vol_target
-        elif target_vol.keys()[0] == 'target':
-            vol_target = target_vol.values()[0]
+        elif target_vol_method == 'target':
+            vol_target = target_vol_value
             vol_method = vol_target
-        elif target_vol.keys()[0] == 'sharpe_ratio':
-            vol_target = data_slice(Y_assets, date_shifted, periods).std().mean() * np.sqrt(annualization_factor(freq))
+        elif target_vol_method == 'sharpe_ratio':
+            vol_target = np.sqrt(np.diag(moments[1])).mean()
             vol_method = 'sharpe_ratio'
-        elif target_vol.keys()[0] == 'risk_aversion':
-            vol_target = data_slice(Y_assets, date_shifted, periods).std().mean() * np.sqrt(annualization_factor(freq))
-            vol_method = ('risk_aversion', target_vol.values()[0])
+        elif target_vol_method == 'risk_aversion':
+            vol_target = np.sqrt(np.diag(moments[1])).mean()
+            vol_method = ('risk_aversion', target_vol_value)
         
         
         
@@ -92,15 +135,31 @@ def optimization(print_date, start_date, end_date, freq,
         for i, indicator in enumerate(X_macro.columns.tolist()):
         
             # signal & corresponding boundaries for the ptf optimization
-            si = signal_intensity(X_macro[indicator], macro_data[indicator], date, method, granularity, thresholds)
-            sd = signal_directions(asset_classes.columns[:-1], indicator) # exclude RFR when calling this function
+            if intensities is not None:
+                si = intensities[d, i]
+            else:
+                si = signal_intensity(X_macro[indicator], macro_data[indicator], date, method, granularity, thresholds)
+            sd = direction_matrix[i]
             bnds = signal_boundaries(si, sd, granularity)
             
             # the optimization is very sensitive to the initial weights
-            init_weights = list(0.5 * si * sd) + [0.0]
+            # (in high frequency mode, the previous optimal weights if the boundaries have not changed)
+            warm_start = (high_frequency == True) and (d > 0) and (si == intensities[d - 1, i])
+            if warm_start:
+                init_weights = solver_weights[i]
+            else:
+                init_weights = list(0.5 * si * sd) + [0.0]
             
             # optimization and storage of the optimal weights
-            optimal_weights[i] = portfolio_optimize(init_weights, vol_method, bnds, Y_assets, date_shifted, freq, periods)
+            optimal_weights[i] = portfolio_optimize(init_weights, vol_method, bnds, Y_assets, date_shifted, freq, periods, solver, moments)
+            
+            # high frequency mode: a negative sharpe ratio from the previous weights can be a local optimum (see above)
+            if warm_start and (vol_method == 'sharpe_ratio') and (optimal_weights[i].dot(moments[0]) - moments[0][-1] <= 0.0):
+                optimal_weights[i] = portfolio_optimize(list(0.5 * si * sd) + [0.0], vol_method, bnds, Y_assets, date_shifted,
+                                                    freq, periods, solver, moments)
+            
+            if high_frequency == True:
+                solver_weights[i] = optimal_weights[i]
             
             # reduces if it's a Business Cycle indicator (Business Cycle = 0.5 * Growth + 0.5 * Inflation)
             if (reduce_indic != False) & (momentum_weighting == False):
@@ -123,59 +182,50 @@ def optimization(print_date, start_date, end_date, freq,
         
         # give more weights to indicators that recently performed better
         else:
-            momentum_returns = [0.0] * nb_indics
-            
-            # compute returns from previous period
-            for i in range(nb_indics):
-                momentum_returns[i] = np.dot(np.array(optimal_weights_previous[i]).T, Y_assets.loc[date_shifted].values)
-            
-            # computes percentiles
-            momentum_scores = [scs.percentileofscore(momentum_returns, a, 'rank')/100.0 for a in momentum_returns]
-            
-            # center on 0
-            #momentum_scores = [a - np.average(momentum_scores) for a in momentum_scores]
-            
-            momentum_weights = momentum_weighting * np.array(momentum_scores) + (1 - momentum_weighting) * momentum_weights
-            
-            scaled_weights = np.dot(momentum_weights.T, optimal_weights) / momentum_weights.sum()
+            # returns from previous period of each indicator portfolio (one matrix product), ranked in percentiles
+            with stage("momentum_weighting"):
+                momentum_weights = momentum_weights_update(momentum_weights, optimal_weights_previous,
+                                                           Y_assets.loc[date_shifted].values, momentum_weighting)
+                
+                scaled_weights = momentum_aggregate(momentum_weights, optimal_weights)
 
             
         
         if rescale_vol == True:
             # in-sample volatility of the strategy    
-            strategy_volatility = portfolio_stats(scaled_weights, data_slice(Y_assets, date_shifted, periods), freq)[1]
+            strategy_volatility = np.sqrt(scaled_weights.dot(moments[1]).dot(scaled_weights))
             
             # we scale the portfolio such that the in-sample volatility is equal to target
             scaled_weights = scaled_weights[:-1] * vol_target / strategy_volatility
             scaled_weights = np.array(scaled_weights.tolist() + [1.0 - scaled_weights.sum()])
         
-        # weights of the strategy
-        strategy_returns.loc[date] = scaled_weights.tolist() + [(scaled_weights * Y_assets.loc[date]).sum()]
+        # weights of the strategy (missing returns count as 0)
+        with stage("write"):
+            strategy_values[d, :-1] = scaled_weights
+            strategy_values[d, -1] = np.nansum(scaled_weights * Y_values[Y_positions[d]])
         
         
         
         # for weighting momentum
         optimal_weights_previous = optimal_weights
+        indicator_weights[d] = optimal_weights
         
         
         
         
+    # the next stages are not recorded for an optimization date
+    set_date(None)
+    
+    strategy_returns = pd.DataFrame(strategy_values, index=optimization_dates, columns=Y_assets.columns.tolist() + ["Return"])
+    
     # returns the dataframe of the weights + returns of the strategy
+    if return_indicator_weights == True:
+        return strategy_returns, indicator_weights
+    
     return strategy_returns
 
 
 
-def period_name(period):
-    """Returns a string in the form '1980 - 1989'."""
-    year_start = period[0][:4]
-    year_end = period[1][:4]
-    return year_start + " - " + year_end
-
-def period_names_list(periods):
-    """Returns a list using function period_name."""
-    return [period_name(period) for period in periods]
-
-
 #%%
 
 #==============================================================================
@@ -191,33 +241,34 @@ optimization_periods = [
         ("2010 01 01", "2017 12 31")
     ]
 
-# data treated for portfolio optimization
-Y_assets = data_returns(asset_classes, first_date, last_date, freq, 1)
-X_macro = data_lagged(macro_data, first_date, last_date, freq, 1)
-
-# here we will store the results for each decade
-strategy_results = []
-
 # optimization parameters
 target_vol = [0.1, 0.09, 0.08, 0.07] # scale the portfolio to get a volatility of 10% in sample
 
 
-params = {
-    'print_date': True,
-    'start_date': first_date,
-    'end_date': last_date,
-    'freq': freq,
-    'X_macro': X_macro,
-    'Y_assets': Y_assets,
-    'target_vol': {'sharpe_ratio': None}, # {'target': target_vol[i]}, {'rolling': 120}, {'sharpe_ratio': None}, {'risk_aversion': 2}
-    'periods': 120, # 10Y => need for a large sample to compute robust volatility from monthly returns
-    'granularity': 2,
-    'method': "quantile", #zscore_robust
-    'thresholds': [-1.2, 1.2],
-    'reduce_indic': {"Growth": 0.5, "Inflation": 0.5}, # can be a dict or "False"
-    'rescale_vol': True, # Boolean / if used with different target_vol method, uses rolling as vol rescaler
-    'momentum_weighting': False
-    }
+# parameters of the function 'optimization'. The data is treated for portfolio optimization with:
+#       Y_assets = data_returns(asset_classes, first_date, last_date, freq, 1)
+#       X_macro = data_lagged(macro_data, first_date, last_date, freq, 1)
+def default_params(X_macro, macro_data, Y_assets, first_date, last_date, freq=freq):
+    return {
+        'start_date': first_date,
+        'end_date': last_date,
+        'freq': freq,
+        'X_macro': X_macro,
+        'macro_data': macro_data,
+        'Y_assets': Y_assets,
+        'target_vol': {'sharpe_ratio': None}, # {'target': target_vol[i]}, {'rolling': 120}, {'sharpe_ratio': None}, {'risk_aversion': 2}
+        'periods': 120, # 10Y => need for a large sample to compute robust volatility from monthly returns
+        'granularity': 2,
+        'method': "quantile", #zscore_robust
+        'thresholds': [-1.2, 1.2],
+        'reduce_indic': {"Growth": 0.5, "Inflation": 0.5}, # can be a dict or "False"
+        'rescale_vol': True, # Boolean / if used with different target_vol method, uses rolling as vol rescaler
+        'momentum_weighting': False,
+        'directions': None, # direction matrix (or dict / CSV file, see load_directions), default_directions() if None
+        'solver': 'SLSQP', # 'L-BFGS-B' is much faster with 50-200 assets (see portfolio_optimize)
+        'compact': False, # precomputed int8 intensities, macro_data can be a compact_panel(macro_data) (float32)
+        'high_frequency': False # for daily / weekly freq: incremental signals and moments, solver restarted from the previous weights
+        }
 
 
 #%%
@@ -226,95 +277,209 @@ params = {
 # OPTIMIZATION
 #==============================================================================
 
-#params['X_macro'] = X_macro[['Monetary Policy', 'Risk Sentiment', 'Inflation']]
-#params['reduce_indic'] = False
-
-for i, period in enumerate(optimization_periods):
-    params['start_date'], params['end_date'] = period
+# runs the optimization on each period, and returns the results for each period (list of DataFrames)
+# to try the optimization on a subset of indicators:
+#       params['X_macro'] = X_macro[['Monetary Policy', 'Risk Sentiment', 'Inflation']]
+#       params['reduce_indic'] = False
+def optimization_periods_results(params, optimization_periods):
+    # the parameters of the caller are not modified
+    params = dict(params)
     
-    # to change parameters for different optimization periods:
-    # params['target_vol'] = target_vol[i]
+    # here we will store the results for each decade
+    strategy_results = []
     
-    strategy_results.append(optimization(**params))
+    for i, period in enumerate(optimization_periods):
+        params['start_date'], params['end_date'] = period
+        
+        # to change parameters for different optimization periods:
+        # params['target_vol'] = target_vol[i]
+        
+        strategy_results.append(optimization(**params))
+    
+    return strategy_results
 
    
 #%%
 
-def histogram_analysis(optimization_periods, strategy_results, Y_assets, indicator='Sharpe Ratio'):
+def histogram_analysis(optimization_periods, strategy_results, Y_assets, freq=freq, indicator='Sharpe Ratio'):
+    import matplotlib.pyplot as plt
 
     # histograms for analysis
     my_df = strategy_analysis(optimization_periods, strategy_results, Y_assets, freq)
     
-    my_df.sort_index(axis=1).loc(axis=1)[:, 'Sharpe Ratio'].plot.bar(figsize=(12,6))
+    my_df.sort_index(axis=1).loc(axis=1)[:, indicator].plot.bar(figsize=(12,6))
     plt.show()
-
-histogram_analysis(optimization_periods, strategy_results, Y_assets, indicator='Sharpe Ratio')
+    
+    return my_df
 
 #%%
 
 # testing each indicator performance separately
-
-mydict = {}
-params['print_date'] = False
-params['reduce_indic'] = False
-params['nb_indic'] = 1
-
-params['granularity'] = 4
-
-for i, indicator in enumerate(X_macro.columns.tolist()):
-    print(indicator)
-    strategy_results = []
+def indicators_analysis(params, optimization_periods):
+    mydict = {}
     
-    params['X_macro'] = pd.DataFrame(X_macro[indicator])
+    params = dict(params)
+    params['reduce_indic'] = False
+    params['granularity'] = 4
     
-    for j, period in enumerate(optimization_periods):
-        params['start_date'], params['end_date'] = period
+    X_macro = params['X_macro']
+    
+    for i, indicator in enumerate(X_macro.columns.tolist()):
+        print(indicator)
         
-        strategy_results.append(optimization(**params))
+        params['X_macro'] = pd.DataFrame(X_macro[indicator])
+        
+        strategy_results = optimization_periods_results(params, optimization_periods)
+        
+        mydict[indicator] = strategy_results
     
-
-    mydict[indicator] = strategy_results
-
-    histogram_analysis(optimization_periods, strategy_results, Y_assets, indicator='Sharpe Ratio')
+        histogram_analysis(optimization_periods, strategy_results, params['Y_assets'], params['freq'], indicator='Sharpe Ratio')
+    
+    return mydict
 
 
 #%%
     
 
 # prints the portfolio composition over time
-for i in range(4):
-    period = period_name(optimization_periods[i])
-    strategy_results[i].drop(["Return"], axis=1).plot.bar(stacked=True, figsize=(12,6))
-    plt.title("Portfolio composition for the period " + period)
-    plt.legend()
-    plt.show()  
+def portfolio_composition(optimization_periods, strategy_results):
+    import matplotlib.pyplot as plt
+    
+    for i, period_results in enumerate(strategy_results):
+        period = period_name(optimization_periods[i])
+        period_results.drop(["Return"], axis=1).plot.bar(stacked=True, figsize=(12,6))
+        plt.title("Portfolio composition for the period " + period)
+        plt.legend()
+        plt.show()  
     
 
 
 
 #%%
 
-# compare to a static rebalancing
-naive_strategy = strategy_results
-
-for i, period in enumerate(optimization_periods):
-    start_date, end_date = period
+# compare to a static rebalancing: weight_eq in Equities, the rest in Bonds
+def naive_strategy(strategy_results, Y_assets, weight_eq=0.4):
+    naive_results = []
     
-    item = naive_strategy[i]
-    
-    weight_eq = 0.4
-    weight_fi = 1 - weight_eq
+    for item in strategy_results:
+        item = item.copy()
+        
+        weight_fi = 1 - weight_eq
+        
+        item["Equities"] = weight_eq
+        item["Bonds"] = weight_fi
+        item["RFR"] = 0.0
+        item["Return"] = (Y_assets["Equities"] * weight_eq + Y_assets["Bonds"] * weight_fi).reindex(index=item.index)
+        
+        naive_results.append(item)
     
-    item.Equities = weight_eq
-    item.Bonds = weight_fi
-    item.RFR = 0.0
-    item.Return = Y_assets.Equities * weight_eq + Y_assets.Bonds * weight_fi
+    return naive_results
 
 
-naive_strategy_df = strategy_analysis(optimization_periods, naive_strategy, Y_assets, freq)
+#%%
+
+#==============================================================================
+# STRESS SCENARIOS
+#==============================================================================
+
+# weights of the portfolio at "date" (default: last date of X_macro) for a batch of stress scenarios on the signals
+# scenarios is a DataFrame (scenarios x indicators) or a dict {scenario: {indicator: shock}} of shocks ADDED to the value
+# of the indicators at that date (missing = no shock). The shocks are in the units of the indicators. Ex:
+#       2Y yield YoY +150bp:    {"Monetary Policy": 1.5}
+#       DXY -10%:               {"International Trade": (x + 1) / 9}, as International Trade = DXY(t-365) / DXY(t) - 1 = x
+#                               becomes (x + 1) / 0.9 - 1 = x + (x + 1) / 9
+#       scenarios = {"Hawkish": {"Monetary Policy": 1.5}, "Weak dollar": {"International Trade": 0.12}}
+#       stress_scenarios(params, scenarios)
+# the moments of the returns are computed once, and each indicator is optimized once per distinct intensity (a few
+# optimizations for hundreds of scenarios). With momentum_weighting, the momentum weights of the indicators at that date
+# must be given (e.g. from momentum_weights_path on the indicator weights returned by optimization), otherwise
+# the indicators are aggregated as without momentum weighting.
+# returns a DataFrame (scenarios, with the "Base" scenario without shock first) with the intensities of the indicators
+# and the weights of the assets (columns ("Intensity", indicator) and ("Weight", asset))
+def stress_scenarios(params, scenarios, date=None, momentum_weights=None):
+    X_macro, macro_data, Y_assets = params['X_macro'], params['macro_data'], params['Y_assets']
+    freq, periods, granularity, method = params['freq'], params['periods'], params['granularity'], params['method']
+    target_vol, reduce_indic = params['target_vol'], params['reduce_indic']
+    
+    if method != 'quantile':
+        granularity = 2
+    
+    # shocks of each scenario (scenarios x indicators), with the base scenario first
+    scenarios = pd.DataFrame.from_dict(scenarios, orient='index') if isinstance(scenarios, dict) else pd.DataFrame(scenarios)
+    scenarios = scenarios.reindex(columns=X_macro.columns).fillna(0.0)
+    if "Base" not in scenarios.index:
+        scenarios = pd.concat([pd.DataFrame(0.0, index=["Base"], columns=X_macro.columns), scenarios])
+    
+    # date of the signals, and date t-1 on which we do the optimization (as in the function optimization)
+    date = X_macro.index[-1] if date is None else pd.Timestamp(date)
+    date_shifted = pd.date_range(start=date, end=date, freq=freq).shift(-1, freq=freq)[0]
+    date_before = X_macro.loc[:date].index[-2]
+    
+    # moments of the returns, computed once for all the optimizations
+    moments = portfolio_moments(Y_assets, date_shifted, freq, periods)
+    
+    # target vol (as in the function optimization)
+    target_vol_method, target_vol_value = list(target_vol.items())[0]
+    if target_vol_method == 'target':
+        vol_target = target_vol_value
+    else:
+        vol_periods = target_vol_value if target_vol_method == 'rolling' else periods
+        vol_target = data_slice(Y_assets, date_shifted, vol_periods).std().mean() * np.sqrt(annualization_factor(freq))
+    vol_method = {'rolling': vol_target, 'target': vol_target, 'sharpe_ratio': 'sharpe_ratio',
+                  'risk_aversion': ('risk_aversion', target_vol_value)}[target_vol_method]
+    
+    direction_matrix = signal_direction_matrix(Y_assets.columns[:-1], X_macro.columns,
+                                               None if params.get('directions') is None else load_directions(params['directions']))
+    
+    # intensities of each indicator in each scenario, and optimal weights of each indicator in each scenario
+    intensities = np.zeros(scenarios.shape, dtype=int)
+    indicator_weights = np.zeros((len(scenarios), len(X_macro.columns), len(Y_assets.columns)))
+    
+    for i, indicator in enumerate(X_macro.columns.tolist()):
+        data_daily_hist = macro_data[indicator].loc[:date_before].dropna()
+        signal_values = X_macro[indicator].loc[date] + scenarios[indicator].values
+        
+        intensities[:, i] = signal_intensities(data_daily_hist, signal_values, method, granularity, params['thresholds'])
+        
+        # one optimization per distinct intensity
+        for si in np.unique(intensities[:, i]):
+            sd = direction_matrix[i]
+            bnds = signal_boundaries(si, sd, granularity)
+            init_weights = list(0.5 * si * sd) + [0.0]
+            
+            optimal_weights = portfolio_optimize(init_weights, vol_method, bnds, Y_assets, date_shifted, freq, periods,
+                                                 params.get('solver', 'SLSQP'), moments)
+            
+            if (reduce_indic != False) and (momentum_weights is None) and (indicator in reduce_indic):
+                optimal_weights = optimal_weights * reduce_indic[indicator]
+            
+            indicator_weights[intensities[:, i] == si, i] = optimal_weights
+    
+    # aggregate the strategies of the indicators
+    if momentum_weights is None:
+        sum_indic = len(X_macro.columns)
+        
+        if reduce_indic != False:
+            sum_indic += - len(reduce_indic) + sum(reduce_indic.values())
+        
+        weights = indicator_weights.sum(axis=1) / sum_indic
+    else:
+        weights = momentum_aggregate(momentum_weights, indicator_weights)
+    
+    # we scale the portfolios such that their in-sample volatility is equal to target
+    if params['rescale_vol'] == True:
+        strategy_volatility = np.sqrt(np.einsum('si,ij,sj->s', weights, moments[1], weights))
+        
+        weights[:, :-1] *= (vol_target / strategy_volatility)[:, None]
+        weights[:, -1] = 1.0 - weights[:, :-1].sum(axis=1)
+    
+    results = pd.concat([pd.DataFrame(intensities, index=scenarios.index, columns=X_macro.columns),
+                         pd.DataFrame(weights, index=scenarios.index, columns=Y_assets.columns)],
+                        axis=1, keys=["Intensity", "Weight"])
+    results.index.name = "Scenario"
+    
+    return results
 
-print(naive_strategy_df.sort_index(axis=1).loc(axis=1)[:, 'Sharpe Ratio'].loc["Strategy"])
-print(my_df.sort_index(axis=1).loc(axis=1)[:, 'Sharpe Ratio'].loc["Strategy"])
 
 #%%
 
@@ -347,12 +512,34 @@ to do
 """
 
 
+#%%
 
-
-
-
-
-
-
-
-
+if __name__ == "__main__":
+    import ccp_data
+    
+    # data (see ccp_data)
+    dtindex = ccp_data.daily_index()
+    asset_classes = ccp_data.load_asset_classes(ccp_data.path, dtindex)
+    macro_data = ccp_data.load_macro_data(ccp_data.path, dtindex)
+    
+    # data treated for portfolio optimization
+    Y_assets = data_returns(asset_classes, ccp_data.first_date, ccp_data.last_date, freq, 1)
+    X_macro = data_lagged(macro_data, ccp_data.first_date, ccp_data.last_date, freq, 1)
+    
+    params = default_params(X_macro, macro_data, Y_assets, ccp_data.first_date, ccp_data.last_date, freq)
+    
+    # displays the dates during the optimization, and the time spent in each stage at the end
+    enable_instrumentation(verbose=True)
+    
+    strategy_results = optimization_periods_results(params, optimization_periods)
+    
+    my_df = histogram_analysis(optimization_periods, strategy_results, Y_assets, freq, indicator='Sharpe Ratio')
+    
+    portfolio_composition(optimization_periods, strategy_results)
+    
+    naive_strategy_df = strategy_analysis(optimization_periods, naive_strategy(strategy_results, Y_assets), Y_assets, freq)
+    
+    print(naive_strategy_df.sort_index(axis=1).loc(axis=1)[:, 'Sharpe Ratio'].loc["Strategy"])
+    print(my_df.sort_index(axis=1).loc(axis=1)[:, 'Sharpe Ratio'].loc["Strategy"])
+    
+    print(instrumentation_summary())
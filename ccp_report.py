@@ -0,0 +1,152 @@
+"""Headless report of strategy results: the charts of ccp_project saved as PNG files, with an HTML page.
+
+Usage (after a batch run, see ccp_batch --report):
+
+    render_report(optimization_periods, strategy_results, Y_assets, freq, "results/report/", workers=4)
+
+The charts are the ones of histogram_analysis (Sharpe Ratio of each asset and of the strategy per period),
+portfolio_composition (stacked weights per period) and the comparison with naive_strategy (40% Equities,
+60% Bonds). They are drawn with the Agg canvas of matplotlib (no window, no plt.show(), the backend of
+the session is not changed), in parallel on "workers" processes.
+
+Each PNG file is named after the hash of the data of its chart: a chart whose data has not changed since
+a previous report in the same folder is not rendered again.
+"""
+
+import hashlib
+import html
+import os
+
+import pandas as pd
+
+from ccp_functions import *
+import ccp_project
+
+
+#%%
+
+#==============================================================================
+# CHARTS
+#==============================================================================
+
+# a chart is a dict {"name", "title", "kind": "bar" or "stacked", "data": DataFrame plotted, "filename"}
+
+# size of the charts in inches, as in ccp_project
+figure_size = (12, 6)
+
+
+# hash of the data of a chart (and of its title and kind): the same data gives the same filename
+def chart_hash(title, kind, data):
+    digest = hashlib.sha256()
+    digest.update(("%s\n%s\n" % (title, kind)).encode())
+    digest.update(repr(data.columns.tolist()).encode())
+    digest.update(pd.util.hash_pandas_object(data, index=True).values.tobytes())
+
+    return digest.hexdigest()[:16]
+
+
+def chart(name, title, kind, data):
+    return {"name": name, "title": title, "kind": kind, "data": data,
+            "filename": "%s_%s.png" % (name, chart_hash(title, kind, data))}
+
+
+# charts of the report: the indicator of the assets and the strategy per period, the weights of each period,
+# and the indicator of the strategy against the naive strategy (weight_eq in Equities, the rest in Bonds)
+def report_charts(periods, strategy_results, Y_assets, freq, indicator='Sharpe Ratio', weight_eq=0.4):
+    names_periods = period_names_list(periods)
+
+    analysis = strategy_analysis(periods, strategy_results, Y_assets, freq)
+    naive_analysis = strategy_analysis(periods, ccp_project.naive_strategy(strategy_results, Y_assets, weight_eq), Y_assets, freq)
+
+    charts = [chart("analysis", indicator + " per period", "bar", analysis.sort_index(axis=1).loc(axis=1)[:, indicator])]
+
+    for period, period_results in zip(names_periods, strategy_results):
+        charts.append(chart("composition_" + period.replace(" ", ""), "Portfolio composition for the period " + period, "stacked",
+                            period_results.drop(["Return"], axis=1)))
+
+    naive_name = "Naive %i/%i" % (round(weight_eq * 100), round((1 - weight_eq) * 100))
+    comparison = pd.DataFrame({"Strategy": analysis.xs(indicator, axis=1, level=1).loc["Strategy"],
+                               naive_name: naive_analysis.xs(indicator, axis=1, level=1).loc["Strategy"]}).reindex(names_periods)
+    charts.append(chart("naive", indicator + " of the strategy and of the naive strategy (%s)" % naive_name, "bar", comparison))
+
+    return charts, analysis, comparison
+
+
+# draws a chart on an Agg canvas and saves it in the folder (in a worker process)
+def render_chart(task):
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+
+    folder, item = task
+
+    figure = Figure(figsize=figure_size)
+    FigureCanvasAgg(figure)
+    ax = figure.add_subplot()
+
+    if item["kind"] == "stacked":
+        item["data"].plot.bar(stacked=True, ax=ax)
+        # one label every 12 bars: the composition charts have one bar per date
+        ax.set_xticks(ax.get_xticks()[::12])
+        ax.set_xticklabels([date.strftime("%Y-%m") for date in item["data"].index[::12]])
+    else:
+        item["data"].plot.bar(ax=ax)
+
+    ax.set_title(item["title"])
+    ax.legend()
+    figure.tight_layout()
+
+    temporary = os.path.join(folder, item["filename"] + ".tmp")
+    figure.savefig(temporary, format="png")
+    os.replace(temporary, os.path.join(folder, item["filename"]))
+
+    return item["filename"]
+
+
+#%%
+
+#==============================================================================
+# REPORT
+#==============================================================================
+
+def report_html(charts, analysis, comparison, indicator):
+    lines = ["<!DOCTYPE html>", "<html>", "<head><meta charset=\"utf-8\"><title>Strategy report</title></head>", "<body>",
+             "<h1>Strategy report</h1>"]
+
+    for item in charts:
+        lines.append("<h2>%s</h2>" % html.escape(item["title"]))
+        lines.append("<img src=\"%s\" alt=\"%s\">" % (item["filename"], html.escape(item["title"])))
+
+        if item["name"] == "analysis":
+            lines.append(analysis.sort_index(axis=1).loc(axis=1)[:, indicator].to_html(float_format="%.2f"))
+        elif item["name"] == "naive":
+            lines.append(comparison.to_html(float_format="%.2f"))
+
+    lines += ["</body>", "</html>"]
+
+    return "\n".join(lines)
+
+
+# renders the charts of the report in the folder, in parallel on "workers" processes (in this process if workers <= 1)
+# the charts already in the folder (same data) are not rendered again. Writes index.html and returns its path
+def render_report(periods, strategy_results, Y_assets, freq, folder, workers=1, indicator='Sharpe Ratio', weight_eq=0.4):
+    if not os.path.isdir(folder):
+        os.makedirs(folder)
+
+    charts, analysis, comparison = report_charts(periods, strategy_results, Y_assets, freq, indicator, weight_eq)
+
+    tasks = [(folder, item) for item in charts if not os.path.isfile(os.path.join(folder, item["filename"]))]
+
+    if workers <= 1 or len(tasks) <= 1:
+        for task in tasks:
+            render_chart(task)
+    else:
+        from concurrent.futures import ProcessPoolExecutor
+
+        with ProcessPoolExecutor(max_workers=min(workers, len(tasks))) as executor:
+            list(executor.map(render_chart, tasks))
+
+    filename = os.path.join(folder, "index.html")
+    with open(filename, "w", encoding="utf-8") as f:
+        f.write(report_html(charts, analysis, comparison, indicator))
+
+    return filename
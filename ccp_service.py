@@ -0,0 +1,487 @@
+"""Long-lived signal service: keeps the state of the signals and of the returns in memory, accepts new observations
+incrementally, and serves the current intensities and weights of the portfolio over local HTTP or a Unix socket.
+
+Usage:
+    python ccp_service.py serve config.yaml --port 8765            # or --socket /tmp/ccp.sock
+    python ccp_service.py request GET /allocation --port 8765 --repeat 100
+    python ccp_service.py request POST /observations --port 8765 --data observations.json
+
+The config is the one of ccp_batch (data and params sections). Endpoints:
+
+    GET  /allocation      {"date": ..., "intensities": {indicator: intensity}, "weights": {asset: weight}}
+    GET  /health          {"status": "ok", "macro_date": ..., "returns_date": ...}
+    POST /observations    {"macro": {date: {indicator: value}}, "returns": {date: {asset: return}}}
+                          -> the new allocation (observations not after the last ones are ignored)
+                          -> 400 if any observation is invalid (none of them is added then)
+
+The allocation is computed when observations arrive, and served from memory.
+"""
+
+import argparse
+import json
+import socket
+import socketserver
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import http.client
+
+from ccp_functions import *
+
+
+#%%
+
+#==============================================================================
+# STATE OF THE SIGNALS
+#==============================================================================
+
+# in-memory state of the service, from the params of the function 'optimization' (see ccp_project.default_params)
+# - the history of each indicator (macro_data, daily) kept sorted, and its references (quantiles, or center / scale of
+#   the zscore), see references_state
+# - the last returns of the assets (Y_assets) in a ring buffer, and their sums / cross products over "periods", centered
+#   on the mean of the window (rolling moments, see moments_state)
+# - the optimal weights of each indicator for each intensity, until the moments change
+# the current signal of each indicator is its last observation. With momentum_weighting, the momentum weights of the
+# indicators can be given (e.g. from momentum_weights_path), they start at 0.5 otherwise
+def service_state(params, momentum_weights=None):
+    X_macro, macro_data, Y_assets = params['X_macro'], params['macro_data'], params['Y_assets']
+
+    indicators = X_macro.columns.tolist()
+    assets = Y_assets.columns.tolist()
+
+    method = params['method']
+    granularity = params['granularity'] if method == 'quantile' else 2
+
+    # window of returns kept in memory (longer for a rolling target vol)
+    target_vol_method, target_vol_value = list(params['target_vol'].items())[0]
+    window = max(params['periods'], target_vol_value if target_vol_method == 'rolling' else 0)
+
+    state = {
+        "lock": threading.Lock(),
+        "params": dict(params, granularity=granularity),
+        "indicators": indicators,
+        "assets": assets,
+        "direction_matrix": signal_direction_matrix(assets[:-1], indicators,
+                                                    None if params.get('directions') is None else load_directions(params['directions'])),
+        "window": window,
+        "history": {},
+        "references": {},
+        "signal_values": np.zeros(len(indicators)),
+        "macro_date": None,
+        "returns": np.zeros((window, len(assets))),
+        "returns_date": None,
+        "center": np.zeros(len(assets)),
+        "sums": np.zeros(len(assets)),
+        "cross_products": np.zeros((len(assets), len(assets))),
+        "nb_returns": 0,
+        "optimal_weights": {},
+        "momentum_weights": np.full(len(indicators), 0.5) if momentum_weights is None else np.array(momentum_weights, dtype=np.float64),
+        "indicator_weights": None,
+        "allocation": None
+        }
+
+    # history of the indicators
+    for i, indicator in enumerate(indicators):
+        history = macro_data[indicator].dropna()
+        state["history"][indicator] = references_state(history.values)
+        state["signal_values"][i] = history.values[-1]
+
+    state["macro_date"] = macro_data.dropna(how='all').index[-1]
+    update_references(state, indicators)
+
+    # returns of the assets: the sums and cross products are over the last "periods" returns
+    returns = Y_assets.dropna()
+    add_returns(state, returns.values[-window:])
+    state["returns_date"] = returns.index[-1]
+
+    return state
+
+
+# references of the history of the indicators (see state_references), read from their sorted history
+def update_references(state, indicators):
+    params = state["params"]
+
+    for indicator in indicators:
+        state["references"][indicator] = state_references(state["history"][indicator], params['method'], params['granularity'])
+
+
+# last nb_obs returns of the ring buffer (dates x assets), the oldest first
+def last_returns(state, nb_obs):
+    nb_obs = min(nb_obs, state["nb_returns"], state["window"])
+
+    return state["returns"][(state["nb_returns"] - nb_obs + np.arange(nb_obs)) % state["window"]]
+
+
+# adds returns (dates x assets) to the ring buffer of returns, and updates the centered sums and cross products over the
+# last "periods" returns (the oldest one leaves the window). They are computed again from the window while it fills up
+# and every "periods" returns, not to accumulate rounding errors (see moments_update)
+def add_returns(state, returns):
+    periods = state["params"]['periods']
+
+    for row in np.asarray(returns, dtype=np.float64):
+        # the return leaving the window is read before its slot of the ring buffer can be written
+        leaving = last_returns(state, periods)[:1] if state["nb_returns"] >= periods else np.zeros((0, len(row)))
+
+        state["returns"][state["nb_returns"] % state["window"]] = row
+        state["nb_returns"] += 1
+
+        if (state["nb_returns"] <= periods) or (state["nb_returns"] % periods == 0):
+            centered_resync(state, last_returns(state, periods))
+        else:
+            centered_add(state, row[None, :], leaving)
+
+    # the optimal weights of the indicators depend on the moments
+    state["optimal_weights"] = {}
+
+
+# annualized returns and var_cov matrix of the last "periods" returns (as in portfolio_moments), from the centered sums
+# the variances are floored at 0 (the variance of a constant RFR can come out slightly negative after rounding)
+def state_moments(state):
+    mean, var_cov = centered_moments(state, min(state["nb_returns"], state["params"]['periods']), state["params"]['freq'])
+    np.fill_diagonal(var_cov, np.maximum(np.diag(var_cov), 0.0))
+
+    return mean, var_cov
+
+
+#%%
+
+#==============================================================================
+# INCREMENTAL UPDATES
+#==============================================================================
+
+# observations {date: {name: value}} as a sorted list of (date, values), checked before the state is modified:
+# the dates must be valid, the names known (all of them needed if required) and the values finite numbers
+def parse_observations(observations, names, required=False):
+    if not isinstance(observations, dict):
+        raise TypeError("observations must be a dict {date: {name: value}}")
+
+    parsed = []
+    for date, values in observations.items():
+        if not isinstance(values, dict):
+            raise TypeError("the observations of %s must be a dict {name: value}" % date)
+
+        unknown = [name for name in values if name not in names]
+        missing = [name for name in names if values.get(name) is None] if required else []
+        if unknown or missing:
+            raise KeyError("unknown %s, missing %s on %s" % (unknown, missing, date))
+
+        values = {name: float(value) for name, value in values.items() if value is not None}
+        if not np.isfinite(list(values.values())).all():
+            raise ValueError("values which are not finite on %s" % date)
+
+        parsed.append((pd.Timestamp(date), values))
+
+    return sorted(parsed, key=lambda observation: observation[0])
+
+
+# adds new observations to the state:
+# macro is a dict {date: {indicator: value}} of daily observations of the indicators (the last one is the current signal)
+# returns is a dict {date: {asset: return}} of returns of the assets at the frequency of the data (all the assets needed)
+# observations which are not after the last ones of the state are ignored. Returns the number of observations added
+# all the observations are checked first (see parse_observations): if one is invalid, none is added
+# the returns are added before the macro observations: the returns are the ones of the portfolios held during the period,
+# chosen with the signals before the new macro observations (as in the function 'optimization', no lookahead)
+def add_observations(state, macro=None, returns=None):
+    macro = parse_observations(macro or {}, state["indicators"])
+    returns = parse_observations(returns or {}, state["assets"], required=True)
+
+    nb_added = 0
+
+    with state["lock"]:
+        for date, values in returns:
+            if date <= state["returns_date"]:
+                continue
+
+            row = np.array([values[asset] for asset in state["assets"]])
+
+            # momentum weights: performance of the portfolios of the indicators held during this period
+            # (the ones of the allocation before this return, computed if not served yet)
+            if state["params"]['momentum_weighting'] != False:
+                if state["allocation"] is None:
+                    state["allocation"] = compute_allocation(state)
+
+                state["momentum_weights"] = momentum_weights_update(state["momentum_weights"], state["indicator_weights"],
+                                                                    row, state["params"]['momentum_weighting'])
+                state["allocation"] = None
+
+            add_returns(state, row[None, :])
+            state["returns_date"] = date
+            nb_added += 1
+
+        updated = set()
+        for date, values in macro:
+            if date <= state["macro_date"]:
+                continue
+
+            for i, indicator in enumerate(state["indicators"]):
+                if indicator in values:
+                    references_add(state["history"][indicator], [values[indicator]])
+                    state["signal_values"][i] = values[indicator]
+                    updated.add(indicator)
+
+            state["macro_date"] = date
+            nb_added += 1
+
+        update_references(state, [indicator for indicator in state["indicators"] if indicator in updated])
+
+        if nb_added > 0:
+            state["allocation"] = None
+
+    return nb_added
+
+
+# computes the intensities and the weights of the portfolio from the state (as at one date of the function 'optimization')
+def compute_allocation(state):
+    params = state["params"]
+    freq, periods, granularity = params['freq'], params['periods'], params['granularity']
+    reduce_indic, momentum_weighting = params['reduce_indic'], params['momentum_weighting']
+    indicators, assets = state["indicators"], state["assets"]
+
+    moments = state_moments(state)
+
+    # target vol (as in the function 'optimization')
+    target_vol_method, target_vol_value = list(params['target_vol'].items())[0]
+    if target_vol_method == 'target':
+        vol_target = target_vol_value
+    elif target_vol_method == 'rolling':
+        vol_target = last_returns(state, int(target_vol_value)).std(axis=0, ddof=1).mean() * np.sqrt(annualization_factor(freq))
+    else:
+        vol_target = np.sqrt(np.diag(moments[1])).mean()
+    vol_method = {'rolling': vol_target, 'target': vol_target, 'sharpe_ratio': 'sharpe_ratio',
+                  'risk_aversion': ('risk_aversion', target_vol_value)}[target_vol_method]
+
+    intensities = np.zeros(len(indicators), dtype=int)
+    optimal_weights = np.zeros((len(indicators), len(assets)))
+
+    for i, indicator in enumerate(indicators):
+        intensities[i] = signal_intensities_references(state["references"][indicator], [state["signal_values"][i]],
+                                                       params['method'], granularity, params['thresholds'])[0]
+
+        # the optimal weights only depend on the intensity until the moments change
+        key = (indicator, intensities[i])
+        if key not in state["optimal_weights"]:
+            sd = state["direction_matrix"][i]
+            bnds = signal_boundaries(intensities[i], sd, granularity)
+            init_weights = list(0.5 * intensities[i] * sd) + [0.0]
+
+            state["optimal_weights"][key] = portfolio_optimize(init_weights, vol_method, bnds, None, None, freq, periods,
+                                                               params.get('solver', 'SLSQP'), moments)
+
+        optimal_weights[i] = state["optimal_weights"][key]
+
+        if (reduce_indic != False) and (momentum_weighting == False) and (indicator in reduce_indic):
+            optimal_weights[i] *= reduce_indic[indicator]
+
+    # aggregation of the strategies of the indicators
+    if momentum_weighting == False:
+        sum_indic = len(indicators)
+
+        if reduce_indic != False:
+            sum_indic += - len(reduce_indic) + sum(reduce_indic.values())
+
+        weights = optimal_weights.sum(axis=0) / sum_indic
+    else:
+        weights = momentum_aggregate(state["momentum_weights"], optimal_weights)
+
+    # we scale the portfolio such that the in-sample volatility is equal to target
+    if params['rescale_vol'] == True:
+        weights[:-1] *= vol_target / np.sqrt(weights.dot(moments[1]).dot(weights))
+        weights[-1] = 1.0 - weights[:-1].sum()
+
+    state["indicator_weights"] = optimal_weights
+
+    return {
+        "date": str(state["macro_date"].date()),
+        "returns_date": str(state["returns_date"].date()),
+        "intensities": dict(zip(indicators, intensities.tolist())),
+        "weights": dict(zip(assets, weights.tolist()))
+        }
+
+
+# current allocation, computed only once after each update
+def current_allocation(state):
+    with state["lock"]:
+        if state["allocation"] is None:
+            state["allocation"] = compute_allocation(state)
+
+        return state["allocation"]
+
+
+#%%
+
+#==============================================================================
+# HTTP / UNIX SOCKET ENDPOINTS
+#==============================================================================
+
+class ServiceHandler(BaseHTTPRequestHandler):
+
+    def send_json(self, code, content):
+        # NaN is not valid JSON
+        try:
+            body = json.dumps(content, allow_nan=False).encode("utf-8")
+        except ValueError as e:
+            code, body = 500, json.dumps({"error": "invalid answer (%s)" % e}).encode("utf-8")
+
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        state = self.server.state
+
+        if self.path == "/allocation":
+            self.send_json(200, current_allocation(state))
+        elif self.path == "/health":
+            self.send_json(200, {"status": "ok", "macro_date": str(state["macro_date"].date()),
+                                 "returns_date": str(state["returns_date"].date())})
+        else:
+            self.send_json(404, {"error": "unknown path %s" % self.path})
+
+    def do_POST(self):
+        state = self.server.state
+
+        if self.path != "/observations":
+            self.send_json(404, {"error": "unknown path %s" % self.path})
+            return
+
+        try:
+            observations = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            if not isinstance(observations, dict):
+                raise TypeError("the body must be an object {\"macro\": ..., \"returns\": ...}")
+            nb_added = add_observations(state, observations.get("macro"), observations.get("returns"))
+        except (ValueError, KeyError, TypeError) as e:
+            self.send_json(400, {"error": "invalid observations (%s)" % e})
+            return
+
+        self.send_json(200, dict(current_allocation(state), added=nb_added))
+
+    # the client address is empty on a Unix socket
+    def address_string(self):
+        return str(self.client_address[0]) if self.client_address else "unix"
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            BaseHTTPRequestHandler.log_message(self, format, *args)
+
+
+class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+# HTTP server on localhost:port, or on the Unix socket socket_path, serving the state (call serve_forever() to run it)
+def service_server(state, port=8765, socket_path=None, verbose=False):
+    if socket_path is not None:
+        server = UnixHTTPServer(socket_path, ServiceHandler)
+    else:
+        server = ThreadingHTTPServer(("127.0.0.1", port), ServiceHandler)
+
+    server.state = state
+    server.verbose = verbose
+
+    return server
+
+
+#%%
+
+#==============================================================================
+# CLIENT
+#==============================================================================
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+
+    def __init__(self, socket_path, timeout=10):
+        http.client.HTTPConnection.__init__(self, "localhost", timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+
+# connection to the service on localhost:port, or on the Unix socket socket_path
+def service_connection(port=8765, socket_path=None, timeout=10):
+    if socket_path is not None:
+        return UnixHTTPConnection(socket_path, timeout)
+
+    return http.client.HTTPConnection("127.0.0.1", port, timeout=timeout)
+
+
+# sends a request to the service (content is sent as JSON), returns the status and the decoded JSON answer
+def service_request(connection, method, path, content=None):
+    body = None if content is None else json.dumps(content)
+    headers = {} if content is None else {"Content-Type": "application/json"}
+
+    connection.request(method, path, body=body, headers=headers)
+    response = connection.getresponse()
+
+    return response.status, json.loads(response.read())
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Signal service: serves the current weights of the portfolio.")
+    subparsers = parser.add_subparsers(dest="command")
+
+    serve_parser = subparsers.add_parser("serve", help="loads the data of a config file (see ccp_batch) and serves the allocation")
+    serve_parser.add_argument("config", help="YAML or JSON config file")
+
+    request_parser = subparsers.add_parser("request", help="test client: sends a request to the service and prints the answer")
+    request_parser.add_argument("method", choices=["GET", "POST"])
+    request_parser.add_argument("path", help="/allocation, /health or /observations")
+    request_parser.add_argument("--data", default=None, help="JSON file of the observations to POST")
+    request_parser.add_argument("--repeat", type=int, default=1, help="number of requests, to measure the latency (default: 1)")
+
+    for subparser in [serve_parser, request_parser]:
+        subparser.add_argument("--port", type=int, default=8765, help="port on localhost (default: 8765)")
+        subparser.add_argument("--socket", default=None, help="Unix socket instead of the port")
+
+    serve_parser.add_argument("--verbose", action="store_true", help="logs the requests")
+    args = parser.parse_args(argv)
+
+    if args.command == "serve":
+        import ccp_batch
+
+        state = service_state(ccp_batch.config_params(ccp_batch.load_config(args.config)))
+        current_allocation(state)
+
+        server = service_server(state, args.port, args.socket, args.verbose)
+        print("serving on %s" % (args.socket or "http://127.0.0.1:%i" % args.port))
+
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+
+    elif args.command == "request":
+        content = None
+        if args.data is not None:
+            with open(args.data) as f:
+                content = json.load(f)
+
+        connection = service_connection(args.port, args.socket)
+        latencies = []
+
+        for i in range(args.repeat):
+            start = time.perf_counter()
+            status, answer = service_request(connection, args.method, args.path, content)
+            latencies.append(time.perf_counter() - start)
+
+        connection.close()
+
+        print(json.dumps(answer, indent=4))
+        print("status %i, latency: median %.2f ms, max %.2f ms (%i requests)"
+              % (status, np.median(latencies) * 1000, max(latencies) * 1000, args.repeat))
+
+    else:
+        parser.print_help()
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
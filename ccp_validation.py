@@ -0,0 +1,151 @@
+import itertools
+import os
+import shutil
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+from ccp_functions import *
+import ccp_project
+
+
+#%%
+
+#==============================================================================
+# PURGED SPLITS
+#==============================================================================
+
+# grouped purged cross-validation of the calibration of the signals: the optimization dates are cut in nb_groups contiguous
+# groups, and each combination of nb_test_groups groups is a test set. The intensities of the signals on a test set are
+# computed against the history of the indicators outside of it (the training set, before and after the test set), and
+# the walk-forward optimization is run on the test set. Typically:
+#       splits = purged_splits("1980 01 01", "2017 12 31", nb_groups=6, nb_test_groups=2)
+#       results = purged_cross_validation(params, splits, workers=4)
+#       results.xs("Strategy", level="Assets").describe()
+# the indicators are one-year changes: an indicator observed less than a year before a test group (purge) or after it
+# (embargo) shares data with the signals of the test group, so these days are removed from the training set as well
+# the signals of the test group are the indicators "lag" periods before its dates (X_macro from data_lagged(..., lag)):
+# the purge starts "lag" periods before the first date of the group, so that it covers the lookback of its first signal
+
+
+# list of the splits: {"name": "1+4", "test": [(start, end) of each test group], "excluded": [(start, end) of each test group
+# with its purge (in days, before the first signal, "lag" periods before the group) and embargo (in days)]}
+# The test groups are numbered from 1
+def purged_splits(start_date, end_date, nb_groups=6, nb_test_groups=2, purge=365, embargo=365, freq="M", lag=1):
+    dates = pd.date_range(start=start_date, end=end_date, freq=freq)
+    groups = [(group[0], group[-1]) for group in np.array_split(dates, nb_groups) if len(group) > 0]
+
+    splits = []
+    for test_groups in itertools.combinations(range(len(groups)), nb_test_groups):
+        test = [groups[g] for g in test_groups]
+
+        splits.append({
+            "name": "+".join(str(g + 1) for g in test_groups),
+            "test": [(str(start.date()), str(end.date())) for start, end in test],
+            "excluded": [(pd.DatetimeIndex([start]).shift(-int(lag), freq=freq)[0] - pd.Timedelta(days=purge),
+                          end + pd.Timedelta(days=embargo)) for start, end in test]
+            })
+
+    return splits
+
+
+# mask of the days of the daily index which are in the training set of the split (outside of its excluded periods)
+def training_mask(index, split):
+    training = np.ones(len(index), dtype=bool)
+
+    for start, end in split["excluded"]:
+        training &= ~((index >= start) & (index <= end))
+
+    return training
+
+
+# intensities of the signals (np.array of int8, dates x indicators) at the optimization dates of each test group of the split,
+# the references of each indicator (see signal_references) being computed once on its whole training history
+# macro_data is a DataFrame or a compact panel (see compact_panel)
+def split_intensities(params, split):
+    X_macro, macro_data, freq = params['X_macro'], params['macro_data'], params['freq']
+    method, thresholds = params['method'], params['thresholds']
+    granularity = params['granularity'] if method == 'quantile' else 2
+
+    test_dates = [pd.date_range(start=start, end=end, freq=freq) for start, end in split["test"]]
+
+    intensities = [np.zeros((len(dates), len(X_macro.columns)), dtype=np.int8) for dates in test_dates]
+
+    for i, indicator in enumerate(X_macro.columns):
+        if isinstance(macro_data, pd.DataFrame):
+            history = macro_data[indicator].dropna()
+            history_dates, history = history.index, history.values
+        else:
+            history_dates, history = panel_history(macro_data, indicator)
+
+        references = signal_references(history[training_mask(history_dates, split)], method, granularity)
+
+        for dates, group_intensities in zip(test_dates, intensities):
+            group_intensities[:, i] = signal_intensities_references(references, X_macro[indicator].reindex(dates).values,
+                                                                    method, granularity, thresholds)
+
+    return intensities
+
+
+#%%
+
+#==============================================================================
+# CROSS-VALIDATION
+#==============================================================================
+
+# params of the optimization in each worker process, with the DataFrames mapped read-only from the files of the parent process
+worker_params = {}
+
+# DataFrames of the params shared with the worker processes (as read-only memory-mapped files)
+shared_frames = ['X_macro', 'macro_data', 'Y_assets']
+
+
+def init_worker(params, shared=None):
+    worker_params.clear()
+    worker_params.update(params)
+
+    # the values of the DataFrames are mapped from the files (not copied in each worker)
+    for name, (filename, index, columns) in (shared or {}).items():
+        worker_params[name] = pd.DataFrame(np.load(filename, mmap_mode='r'), index=index, columns=columns, copy=False)
+
+
+# walk-forward optimization on the test groups of a split in a worker process
+# returns the statistics of the returns on all the test groups (see returns_analysis)
+def run_split(split):
+    params = dict(worker_params)
+
+    strategy_results = []
+    for (start_date, end_date), intensities in zip(split["test"], split_intensities(params, split)):
+        params['start_date'], params['end_date'] = start_date, end_date
+        strategy_results.append(ccp_project.optimization(**dict(params, intensities=intensities)))
+
+    return returns_analysis(pd.concat(strategy_results)["Return"], params['Y_assets'], params['freq'])
+
+
+# runs the splits (see purged_splits) in parallel on "workers" processes (in this process if workers <= 1)
+# the data (X_macro, macro_data, Y_assets) is written once in memory-mapped files, which the workers map read-only
+# returns a DataFrame: rows are (split, asset), columns are the statistics of returns_analysis
+def purged_cross_validation(params, splits, workers=1):
+    if workers <= 1:
+        init_worker(params)
+        outputs = [run_split(split) for split in splits]
+    else:
+        from concurrent.futures import ProcessPoolExecutor
+
+        folder = tempfile.mkdtemp()
+        try:
+            shared = {}
+            for name in [name for name in shared_frames if isinstance(params[name], pd.DataFrame)]:
+                filename = os.path.join(folder, name + ".npy")
+                np.save(filename, np.ascontiguousarray(params[name].values, dtype=np.float64))
+                shared[name] = (filename, params[name].index, params[name].columns)
+
+            other_params = {key: value for key, value in params.items() if key not in shared}
+
+            with ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(other_params, shared)) as executor:
+                outputs = list(executor.map(run_split, splits))
+        finally:
+            shutil.rmtree(folder, ignore_errors=True)
+
+    return pd.concat(outputs, keys=[split["name"] for split in splits], names=["Split", "Assets"])
@@ -0,0 +1,233 @@
+"""Drop-folder watcher: refreshes macro_data when workbooks of the data folder are updated.
+
+Usage:
+    python ccp_watcher.py /data/cross-cutting/ --interval 5 --output panels/
+
+The folder is polled every "interval" seconds (asyncio). A file is ingested once it has stopped changing
+for one interval (not while it is being written): only its sheets are imported again (the other sheets
+come from the cache), and only the indicators which read them are recomputed (see ccp_data.macro_indicators).
+Each refresh publishes a new version of macro_data:
+
+    version, macro_data = current_panel(state)      # in the same process (e.g. a backtest thread)
+    panels/macro_data.pkl                            # with --output (replaced atomically, see publish_panel)
+
+Readers keep the version they got for as long as they use it: a refresh never modifies a published panel.
+"""
+
+import argparse
+import asyncio
+import os
+import pickle
+import sys
+import tempfile
+import threading
+import time
+import traceback
+
+from ccp_functions import *
+import ccp_data
+
+
+#%%
+
+#==============================================================================
+# CACHE OF THE SHEETS
+#==============================================================================
+
+# files watched in the folder
+watched_extensions = [".xlsx", ".xlsm", ".xls", ".csv"]
+
+
+# state of the watcher: the sheets read (cache), the sheets read by each indicator, and the published panel (version, macro_data)
+# the panel is computed from all the files of the folder "path", on dtindex
+def watcher_state(path, dtindex=None, output=None):
+    state = {
+        "path": path,
+        "dtindex": ccp_data.daily_index() if dtindex is None else dtindex,
+        "output": output,
+        "sheets": {},
+        "sources": {},
+        "signatures": folder_signatures(path),
+        "lock": threading.Lock(),
+        "panel": (0, None)
+        }
+
+    refresh_indicators(state, [name for name, indicator in ccp_data.macro_indicators])
+
+    return state
+
+
+# (modification time, size) of each watched file of the folder
+def folder_signatures(path):
+    signatures = {}
+
+    for filename in os.listdir(path):
+        if os.path.splitext(filename)[1].lower() in watched_extensions:
+            file_stat = os.stat(os.path.join(path, filename))
+            signatures[filename] = (file_stat.st_mtime_ns, file_stat.st_size)
+
+    return signatures
+
+
+# read(filename, sheet) for the indicator "name" (see ccp_data.macro_indicators): the sheets come from the cache "sheets", or are
+# imported (import_time_series) and cached in it. The sheets read are recorded in sources[name]
+def cached_reader(state, name, sheets, sources):
+    sources[name] = set()
+
+    def read(filename, sheet):
+        sources[name].add((filename, sheet))
+
+        if (filename, sheet) not in sheets:
+            sheets[(filename, sheet)] = import_time_series(state["path"], filename, sheet, state["dtindex"])
+
+        return sheets[(filename, sheet)]
+
+    return read
+
+
+#%%
+
+#==============================================================================
+# REFRESH AND PUBLICATION
+#==============================================================================
+
+# current version of the panel and macro_data (must not be modified: a new DataFrame is published at each refresh)
+def current_panel(state):
+    return state["panel"]
+
+
+# publishes a new version of macro_data: the reference to the panel is replaced at once (readers get the old or the new one)
+# with an output folder, macro_data.pkl is written in a temporary file, then renamed over the old one (atomic on the same disk)
+def publish_panel(state, macro_data):
+    version = state["panel"][0] + 1
+
+    if state["output"] is not None:
+        if not os.path.isdir(state["output"]):
+            os.makedirs(state["output"])
+
+        handle, temporary = tempfile.mkstemp(dir=state["output"], suffix=".tmp")
+        with os.fdopen(handle, "wb") as f:
+            pickle.dump({"version": version, "macro_data": macro_data}, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+        os.replace(temporary, os.path.join(state["output"], "macro_data.pkl"))
+
+    state["panel"] = (version, macro_data)
+
+    return version
+
+
+# recomputes the given indicators (the others are taken from the current panel) and publishes the new panel
+# the sheets of the files "changed" (lower case) are imported again, the other ones come from the cache
+# the cache and the sources are only replaced once the new panel is published: if a file cannot be read (e.g. while it is
+# being written), the exception is raised and the state is unchanged (the previous version stays published)
+def refresh_indicators(state, names, changed=()):
+    with state["lock"]:
+        version, macro_data = state["panel"]
+        sheets = {key: values for key, values in state["sheets"].items() if key[0].lower() not in changed}
+        sources = dict(state["sources"])
+
+        macro_data = pd.DataFrame(index=state["dtindex"]) if macro_data is None else macro_data.copy()
+
+        for name, indicator in ccp_data.macro_indicators:
+            if name in names:
+                macro_data[name] = indicator(cached_reader(state, name, sheets, sources), state["dtindex"])
+
+        version = publish_panel(state, macro_data)
+        state["sheets"], state["sources"] = sheets, sources
+
+        return version
+
+
+# ingests the files which changed: the indicators reading them are recomputed from their sheets imported again
+# returns the new version (the current one if no indicator depends on the files), and the indicators recomputed
+# the filenames are compared without case (the indicators of ccp_data can name a file with another case than the folder)
+def ingest_files(state, filenames):
+    filenames = [filename.lower() for filename in filenames]
+
+    with state["lock"]:
+        names = [name for name, sources in state["sources"].items() if any(filename.lower() in filenames for filename, sheet in sources)]
+
+    if len(names) == 0:
+        return state["panel"][0], names
+
+    return refresh_indicators(state, names, filenames), names
+
+
+#%%
+
+#==============================================================================
+# WATCHER
+#==============================================================================
+
+# default on_error of watch_folder: prints the error on stderr
+def print_error(filenames, error):
+    print("%s cannot ingest %s: %s" % (time.strftime("%Y-%m-%d %H:%M:%S"), ", ".join(filenames),
+                                       "".join(traceback.format_exception_only(type(error), error)).strip()), file=sys.stderr)
+
+
+# polls the folder every "interval" seconds, and ingests the files which changed once they have stopped changing for one interval
+# the imports and computations run in a thread of the executor, so the event loop (and any other task) is never blocked
+# on_publish(version, names) is called after each new version. Stops after max_polls polls (never if None)
+# if the files cannot be ingested (e.g. a corrupt workbook), on_error(filenames, error) is called, the previous version stays
+# published, and the files are ingested again at the next poll (until they can be read, or change again)
+async def watch_folder(state, interval=5.0, on_publish=None, max_polls=None, on_error=print_error):
+    loop = asyncio.get_running_loop()
+    candidates = {}
+    nb_polls = 0
+
+    while (max_polls is None) or (nb_polls < max_polls):
+        await asyncio.sleep(interval)
+        nb_polls += 1
+
+        signatures = await loop.run_in_executor(None, folder_signatures, state["path"])
+
+        # files which have not changed since the previous poll (and differ from the ones ingested)
+        stable = [filename for filename, signature in signatures.items()
+                  if (signature != state["signatures"].get(filename)) and (candidates.get(filename) == signature)]
+
+        candidates = {filename: signature for filename, signature in signatures.items() if signature != state["signatures"].get(filename)}
+
+        if len(stable) == 0:
+            continue
+
+        try:
+            version, names = await loop.run_in_executor(None, ingest_files, state, stable)
+        except Exception as error:
+            if on_error is not None:
+                on_error(stable, error)
+            continue
+
+        for filename in stable:
+            state["signatures"][filename] = signatures[filename]
+            del candidates[filename]
+
+        if (on_publish is not None) and (len(names) > 0):
+            on_publish(version, names)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Watches the data folder, and refreshes macro_data when its files are updated.")
+    parser.add_argument("path", nargs="?", default=ccp_data.path, help="data folder (default: ccp_data.path)")
+    parser.add_argument("--interval", type=float, default=5.0, help="seconds between two polls of the folder (default: 5)")
+    parser.add_argument("--output", default=None, help="folder where macro_data.pkl is published (default: in memory only)")
+    args = parser.parse_args(argv)
+
+    path = os.path.join(args.path, "")
+
+    start = time.time()
+    state = watcher_state(path, output=args.output)
+    print("version 1 loaded in %.1fs" % (time.time() - start))
+
+    def on_publish(version, names):
+        print("%s version %i: %s" % (time.strftime("%Y-%m-%d %H:%M:%S"), version, ", ".join(names)))
+
+    try:
+        asyncio.run(watch_folder(state, args.interval, on_publish))
+    except KeyboardInterrupt:
+        pass
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,58 @@
+import json
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import ccp_batch
+import ccp_data
+
+
+repository = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# small config on the workbooks of the repository: two indicators, two periods
+config = {
+    "data": {"path": repository, "first_date": "1990 01 01", "last_date": "2010 12 31", "indicators": ["Growth", "Inflation"]},
+    "freq": "M",
+    "optimization_periods": [["2000 01 01", "2004 12 31"], ["2005 01 01", "2010 12 31"]],
+    "params": {"target_vol": {"target": 0.08}, "periods": 60, "reduce_indic": {"Growth": 0.5, "Inflation": 0.5}}
+    }
+
+
+@pytest.fixture(scope="module")
+def params(tmp_path_factory):
+    filename = str(tmp_path_factory.mktemp("config") / "config.json")
+    with open(filename, "w") as f:
+        json.dump(config, f)
+
+    loaded = ccp_batch.load_config(filename)
+    assert loaded == config
+
+    return ccp_batch.config_params(loaded)
+
+
+def test_config_params(params):
+    assert params['freq'] == "M"
+    assert params['periods'] == 60
+    assert params['target_vol'] == {"target": 0.08}
+    assert params['X_macro'].columns.tolist() == ["Growth", "Inflation"]
+    assert params['Y_assets'].columns.tolist() == [name for name, filename, sheet, column in ccp_data.assets_files]
+    assert params['X_macro'].index[-1] == pd.Timestamp("2010-12-31")
+
+    assert ccp_batch.config_periods(config) == [("2000 01 01", "2004 12 31"), ("2005 01 01", "2010 12 31")]
+    assert ccp_batch.config_periods({}) == ccp_batch.ccp_project.optimization_periods
+
+
+# the results of the periods do not depend on the number of worker processes
+def test_run_periods_workers(params):
+    periods = ccp_batch.config_periods(config)
+
+    results, timings = ccp_batch.run_periods(params, periods, workers=1)
+    results_parallel, timings_parallel = ccp_batch.run_periods(params, periods, workers=2)
+
+    assert len(results) == len(timings) == 2
+    assert [len(period_results) for period_results in results] == [60, 72]
+    assert np.isfinite(results[0].values).all()
+    for period_results, period_results_parallel in zip(results, results_parallel):
+        pd.testing.assert_frame_equal(period_results_parallel, period_results)
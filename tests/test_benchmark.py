@@ -0,0 +1,18 @@
+import ccp_benchmark
+
+
+# without an Excel engine, both imports are recorded as skipped (and shown in the table)
+def test_benchmark_suite_without_excel_engine(monkeypatch):
+    def synthetic_workbook(filename, data):
+        raise ImportError("No module named 'openpyxl'")
+
+    monkeypatch.setattr(ccp_benchmark, "synthetic_workbook", synthetic_workbook)
+
+    results = ccp_benchmark.benchmark_suite(years=12, nb_indicators=2, repeat=1, optimization_years=1, periods=36)
+
+    for stage in ["import_time_series", "import_time_series_chunked"]:
+        assert results[stage] == {"skipped": "no Excel engine (No module named 'openpyxl')"}
+    assert all("min" in result for stage, result in results.items() if not stage.startswith("import_time_series"))
+
+    table = ccp_benchmark.benchmark_table({"results": results})
+    assert "import_time_series_chunked" in table
@@ -0,0 +1,68 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from ccp_functions import *
+import ccp_benchmark
+import ccp_bootstrap
+
+
+def test_block_bootstrap_indices():
+    indices = ccp_bootstrap.bootstrap_indices(50, 200, block_size=6, method='block', rng=1)
+
+    assert indices.shape == (200, 50)
+    assert (indices >= 0).all() and (indices < 50).all()
+
+    # blocks of exactly 6 consecutive observations, the last one truncated, none wrapping around the end
+    blocks = indices.reshape(200, -1)[:, :48].reshape(200, 8, 6)
+    assert (np.diff(blocks, axis=2) == 1).all()
+    assert (np.diff(indices[:, 48:], axis=1) == 1).all()
+
+
+def test_stationary_bootstrap_indices():
+    nb_obs, block_size = 60, 6
+    indices = ccp_bootstrap.bootstrap_indices(nb_obs, 20000, block_size=block_size, method='stationary', rng=2)
+
+    assert indices.shape == (20000, nb_obs)
+    assert (indices >= 0).all() and (indices < nb_obs).all()
+
+    # blocks of geometric lengths of mean block_size: a new block starts at each observation with probability 1 / block_size
+    # (a block ends where the next index does not follow, wrapping around the end, unless the new block starts there)
+    breaks = indices[:, 1:] != (indices[:, :-1] + 1) % nb_obs
+    assert breaks.mean() == pytest.approx(1.0 / block_size * (1.0 - 1.0 / nb_obs), rel=0.02)
+    assert breaks.mean(axis=0) == pytest.approx(np.full(nb_obs - 1, breaks.mean()), abs=0.015)
+
+    # stationarity: at every position of the resamples, the observations are drawn uniformly
+    frequencies = np.stack([np.bincount(column, minlength=nb_obs) for column in indices.T]) / len(indices)
+    assert np.abs(frequencies - 1.0 / nb_obs).max() < 0.01
+
+
+def test_bootstrap_indices_invalid_method():
+    with pytest.raises(ValueError):
+        ccp_bootstrap.bootstrap_indices(10, 2, method='circular')
+
+
+def test_bootstrap_shards():
+    shards = ccp_bootstrap.bootstrap_shards(1000, 300, 7)
+
+    assert [size for size, seed in shards] == [300, 300, 300, 100]
+    assert [seed.generate_state(1)[0] for size, seed in ccp_bootstrap.bootstrap_shards(1000, 300, 7)] \
+        == [seed.generate_state(1)[0] for size, seed in shards]
+
+
+# the bands only depend on the seed: not on the number of workers
+def test_bootstrap_analysis_reproducible():
+    asset_classes, macro_data = ccp_benchmark.synthetic_data(20, 3, 2)
+    Y_assets = data_returns(asset_classes, "1970 01 01", "1988 12 31", "M", 1)
+    periods = [("1975 01 01", "1979 12 31"), ("1980 01 01", "1988 12 31")]
+    strategy_results = ccp_benchmark.synthetic_strategy_results(Y_assets, periods)
+
+    def bands(workers, seed):
+        return ccp_bootstrap.bootstrap_analysis(periods, strategy_results, Y_assets, "M", nb_resamples=300, workers=workers,
+                                                seed=seed, shard_size=100)
+
+    expected = bands(1, 3)
+    assert np.isfinite(expected.values).all()
+    pd.testing.assert_frame_equal(bands(2, 3), expected)
+    pd.testing.assert_frame_equal(bands(1, 3), expected)
+    assert not np.allclose(bands(1, 4).values, expected.values)
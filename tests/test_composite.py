@@ -0,0 +1,30 @@
+import numpy as np
+import pandas as pd
+
+from ccp_functions import *
+
+
+def daily_data(low, high, seed=0):
+    rng = np.random.RandomState(seed)
+    index = pd.date_range(start="2000 01 01", periods=1000, freq='D')
+
+    return pd.DataFrame(rng.uniform(low, high, (len(index), 3)), index=index, columns=["A", "B", "C"])
+
+
+def test_geometric_mean_of_positive_values():
+    data = daily_data(0.21, 2.0)
+
+    composite = composite_indicator(data, [("geometric_mean",)])
+
+    assert np.allclose(composite["GMean"].values, geometric_mean(data).values, rtol=1e-12, atol=0.0)
+
+
+def test_shift_starts_at_the_first_value_not_positive():
+    data = daily_data(0.5, 2.0)
+    data.iloc[600, 1] = -0.3
+
+    values = signed_geometric_mean(data.values)
+
+    # no shift before the first negative value, 1 - the lowest value from it
+    assert np.allclose(values[:600], geometric_mean(data.iloc[:600]).values, rtol=1e-12, atol=0.0)
+    assert np.allclose(values[600:], np.exp(np.log(data.values[600:] + 1.3).mean(axis=1)) - 1.3, rtol=1e-12, atol=0.0)
@@ -0,0 +1,78 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from ccp_functions import *
+import ccp_benchmark
+import ccp_project
+
+
+@pytest.fixture(scope="module")
+def synthetic():
+    return ccp_benchmark.synthetic_data(20, 3, 2)
+
+
+# the returns of the assets and the signals at the frequency freq (daily "B" or weekly "W-FRI")
+def frequency_data(synthetic, freq):
+    asset_classes, macro_data = synthetic
+    first_date, last_date = str(macro_data.index[0].date()), str(macro_data.index[-1].date())
+
+    Y_assets = data_returns(asset_classes, first_date, last_date, freq, 1)
+    X_macro = data_lagged(macro_data, first_date, last_date, freq, 1)
+
+    return X_macro, macro_data, Y_assets
+
+
+# optimal weights of each indicator (dates x indicators x assets) in the default and high frequency modes, and the moments
+# of the returns at each date (as in the default mode)
+def indicator_weights(data, freq, end_date, target_vol):
+    X_macro, macro_data, Y_assets = data
+    params = ccp_project.default_params(X_macro, macro_data, Y_assets, "1980 01 01", end_date, freq)
+    params.update(directions=ccp_benchmark.synthetic_directions(X_macro.columns, Y_assets.columns[:-1]), reduce_indic=False,
+                  periods=156, target_vol=target_vol, return_indicator_weights=True)
+
+    results, weights = ccp_project.optimization(**params)
+    results_hf, weights_hf = ccp_project.optimization(**dict(params, high_frequency=True))
+
+    dates_shifted = results.index.shift(-1, freq=freq)
+    moments = [portfolio_moments(Y_assets, date, freq, 156) for date in dates_shifted]
+
+    return weights, weights_hf, moments
+
+
+@pytest.mark.parametrize("freq", ["B", "W-FRI"])
+def test_moments_update_equals_portfolio_moments(synthetic, freq):
+    X_macro, macro_data, Y_assets = frequency_data(synthetic, freq)
+    state = moments_state(Y_assets, freq, 156)
+
+    for date in pd.date_range("1980 01 01", "1984 12 31", freq=freq):
+        mean, var_cov = moments_update(state, date)
+        expected = portfolio_moments(Y_assets, date, freq, 156)
+
+        assert np.allclose(mean, expected[0], rtol=0.0, atol=1e-12)
+        assert np.allclose(var_cov, expected[1], rtol=0.0, atol=1e-12)
+
+
+# the weights can differ for the same sharpe ratio: the sharpe ratios are compared. They are the same where they are positive
+# (one optimum), and never below the default mode where they are negative (several local optima, see optimization)
+def test_high_frequency_sharpe_ratio(synthetic):
+    weights, weights_hf, moments = indicator_weights(frequency_data(synthetic, "B"), "B", "1980 06 30", {'sharpe_ratio': None})
+
+    for d, (mean, var_cov) in enumerate(moments):
+        sharpe = (weights[d].dot(mean) - mean[-1]) / np.sqrt(np.einsum('ij,jk,ik->i', weights[d], var_cov, weights[d]))
+        sharpe_hf = (weights_hf[d].dot(mean) - mean[-1]) / np.sqrt(np.einsum('ij,jk,ik->i', weights_hf[d], var_cov, weights_hf[d]))
+
+        assert (sharpe_hf >= sharpe - 1e-5).all()
+        positive = (sharpe > 1e-3) & (sharpe_hf > 1e-3)
+        assert np.allclose(sharpe_hf[positive], sharpe[positive], rtol=0.0, atol=1e-4)
+
+
+# the utility is concave: one optimum, the same in both modes
+def test_high_frequency_risk_aversion(synthetic):
+    weights, weights_hf, moments = indicator_weights(frequency_data(synthetic, "W-FRI"), "W-FRI", "1982 12 31", {'risk_aversion': 3.0})
+
+    for d, (mean, var_cov) in enumerate(moments):
+        utility = weights[d].dot(mean) - 1.5 * np.einsum('ij,jk,ik->i', weights[d], var_cov, weights[d])
+        utility_hf = weights_hf[d].dot(mean) - 1.5 * np.einsum('ij,jk,ik->i', weights_hf[d], var_cov, weights_hf[d])
+
+        assert np.allclose(utility_hf, utility, rtol=0.0, atol=1e-5)
@@ -0,0 +1,39 @@
+import numpy as np
+import pytest
+
+import ccp_instrument
+
+
+# a traced stage allocating a buffer of 8 MB (freed when it returns), called 3 times by a traced parent stage which keeps
+# a buffer of 2 MB: the peaks are the ones of one call, the allocations are cumulative
+def test_memory_of_nested_stages():
+    size = 8 * 10 ** 6
+
+    ccp_instrument.enable_instrumentation(memory=["parent", "child"])
+    try:
+        with ccp_instrument.stage("parent"):
+            kept = np.ones(size // 4 // 8)
+
+            for i in range(3):
+                with ccp_instrument.stage("child"):
+                    buffer = np.ones(size // 8)
+                    del buffer
+
+                with ccp_instrument.stage("untraced"):
+                    buffer = np.ones(size // 8)
+                    del buffer
+
+            del kept
+
+        summary = ccp_instrument.instrumentation_summary()
+    finally:
+        ccp_instrument.disable_instrumentation()
+
+    assert summary.loc["child", "Calls"] == 3
+    assert summary.loc["child", "Peak"] == pytest.approx(size, rel=0.01)
+    assert summary.loc["child", "Allocated"] == pytest.approx(3 * size, rel=0.01)
+
+    # the untraced stage is part of the stretches of the parent between the calls of the child
+    assert summary.loc["untraced", ["Peak", "Allocated"]].tolist() == [0, 0]
+    assert summary.loc["parent", "Peak"] == pytest.approx(size + size // 4, rel=0.01)
+    assert summary.loc["parent", "Allocated"] == pytest.approx(3 * size + 3 * size + size // 4, rel=0.01)
@@ -0,0 +1,48 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from ccp_functions import *
+
+sm = pytest.importorskip("statsmodels.api")
+
+
+# indicator at a level of about 1000 (small variations around a large mean), and a centered indicator
+@pytest.fixture(scope="module")
+def data():
+    rng = np.random.RandomState(0)
+    index = pd.date_range(start="2000 01 01", periods=6000, freq='D')
+
+    X_macro = pd.DataFrame({"Level": 1000.0 + rng.normal(0.0, 0.05, len(index)).cumsum(), "Other": rng.normal(0.0, 1.0, len(index))},
+                           index=index)
+    Y_assets = pd.DataFrame({"A": 0.01 * X_macro["Level"] + rng.normal(0.0, 1.0, len(index)), "B": rng.normal(0.0, 1.0, len(index))},
+                            index=index)
+
+    return Y_assets, X_macro
+
+
+@pytest.mark.parametrize("window", [60, None])
+@pytest.mark.parametrize("constant", [True, False])
+def test_recursive_regression_equals_ols(data, window, constant):
+    Y_assets, X_macro = data
+    subsets = [["Level"], ["Other"], ["Level", "Other"]]
+
+    results = recursive_regression(Y_assets, X_macro, window, subsets, constant)
+
+    for position in [100, 2500, 5999]:
+        rows = slice(position - window + 1 if window is not None else 0, position + 1)
+
+        for subset in subsets:
+            Z = X_macro[subset].iloc[rows]
+            if constant:
+                Z = sm.add_constant(Z)
+
+            for asset in Y_assets.columns:
+                ols = sm.OLS(Y_assets[asset].iloc[rows], Z).fit()
+                indicators = " + ".join(subset)
+
+                for variable in Z.columns:
+                    assert np.isclose(results[("Coefficient", asset, indicators, variable)].iloc[position], ols.params[variable], rtol=1e-8, atol=0.0)
+                    assert np.isclose(results[("t-stat", asset, indicators, variable)].iloc[position], ols.tvalues[variable], rtol=1e-8, atol=0.0)
+
+                assert np.isclose(results[("R2", asset, indicators, Z.columns[-1])].iloc[position], ols.rsquared, rtol=1e-8, atol=0.0)
@@ -0,0 +1,50 @@
+import os
+
+import numpy as np
+import pytest
+
+from ccp_functions import *
+import ccp_benchmark
+import ccp_report
+
+pytest.importorskip("matplotlib")
+
+
+@pytest.fixture(scope="module")
+def data():
+    asset_classes, macro_data = ccp_benchmark.synthetic_data(20, 3, 2)
+    asset_classes.columns = ["Equities", "Bonds", "RFR"]
+    Y_assets = data_returns(asset_classes, "1970 01 01", "1988 12 31", "M", 1)
+    periods = [("1975 01 01", "1979 12 31"), ("1980 01 01", "1988 12 31")]
+
+    return periods, ccp_benchmark.synthetic_strategy_results(Y_assets, periods), Y_assets
+
+
+# the charts whose data has not changed since the previous report in the folder are not rendered again
+def test_render_report_cache(data, tmp_path, monkeypatch):
+    periods, strategy_results, Y_assets = data
+    folder = str(tmp_path)
+
+    filename = ccp_report.render_report(periods, strategy_results, Y_assets, "M", folder, workers=2)
+    charts = [name for name in os.listdir(folder) if name.endswith(".png")]
+
+    assert os.path.isfile(filename)
+    assert len(charts) == 4
+    with open(filename, encoding="utf-8") as f:
+        page = f.read()
+    assert all(name in page for name in charts)
+
+    rendered = []
+    render_chart = ccp_report.render_chart
+    monkeypatch.setattr(ccp_report, "render_chart", lambda task: rendered.append(task[1]["name"]) or render_chart(task))
+
+    ccp_report.render_report(periods, strategy_results, Y_assets, "M", folder)
+    assert rendered == []
+
+    # new weights on the second period: its composition and the analysis charts are rendered again
+    changed = [results.copy() for results in strategy_results]
+    changed[1][["Equities", "Bonds", "RFR"]] = [0.5, 0.3, 0.2]
+    changed[1]["Return"] = Y_assets.loc[changed[1].index].values.dot([0.5, 0.3, 0.2])
+
+    ccp_report.render_report(periods, changed, Y_assets, "M", folder)
+    assert sorted(rendered) == ["analysis", "composition_1980-1988", "naive"]
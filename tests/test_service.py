@@ -0,0 +1,141 @@
+import threading
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from ccp_functions import *
+import ccp_benchmark
+import ccp_project
+import ccp_service
+
+
+# synthetic data with a constant RFR (its variance is 0) and 3 assets
+@pytest.fixture(scope="module")
+def data():
+    asset_classes, macro_data = ccp_benchmark.synthetic_data(48, 5, 3)
+    first_date, last_date = str(macro_data.index[0].date()), str(macro_data.index[-1].date())
+
+    Y_assets = data_returns(asset_classes, first_date, last_date, "M", 1)
+    X_macro = data_lagged(macro_data, first_date, last_date, "M", 1)
+
+    return X_macro, macro_data, Y_assets
+
+
+# default params, with the signal directions of the synthetic assets
+def default_params(data, start_date, end_date):
+    X_macro, macro_data, Y_assets = data
+    params = ccp_project.default_params(X_macro, macro_data, Y_assets, start_date, end_date, "M")
+    params['directions'] = ccp_benchmark.synthetic_directions(X_macro.columns, Y_assets.columns[:-1])
+
+    return params
+
+
+# state of the service at the optimization date "date": the returns until the date t-1, the history of the indicators
+# until the previous date of X_macro, and the signals of X_macro at the date (as in the function 'optimization')
+def service_state_at(params, date):
+    X_macro, macro_data, Y_assets = params['X_macro'], params['macro_data'], params['Y_assets']
+    date_shifted = pd.date_range(start=date, end=date, freq=params['freq']).shift(-1, freq=params['freq'])[0]
+    date_before = X_macro.loc[:date].index[-2]
+
+    state = ccp_service.service_state(dict(params, macro_data=macro_data.loc[:date_before], Y_assets=Y_assets.loc[:date_shifted]))
+    state["signal_values"] = X_macro.loc[date].values.astype(np.float64)
+
+    return state
+
+
+@pytest.mark.parametrize("target_vol", [{'sharpe_ratio': None}, {'target': 0.08}, {'rolling': 60}])
+def test_allocation_equals_optimization(data, target_vol):
+    X_macro, macro_data, Y_assets = data
+    params = default_params(data, "2015 01 01", "2015 06 30")
+    params['target_vol'] = target_vol
+
+    results = ccp_project.optimization(**params)
+    allocation = ccp_service.compute_allocation(service_state_at(params, results.index[-1]))
+
+    weights = np.array([allocation["weights"][asset] for asset in Y_assets.columns])
+    assert np.isfinite(weights).all()
+    assert np.allclose(weights, results[Y_assets.columns].values[-1], atol=1e-6)
+
+
+def test_incremental_moments(data):
+    X_macro, macro_data, Y_assets = data
+    params = default_params(data, "2000 01 01", "2000 12 31")
+
+    state = ccp_service.service_state(dict(params, macro_data=macro_data.loc[:"1990"], Y_assets=Y_assets.loc[:"1990"]))
+    ccp_service.add_observations(state, returns={str(date.date()): row.to_dict() for date, row in Y_assets.loc["1991":"2010"].iterrows()})
+
+    mean, var_cov = ccp_service.state_moments(state)
+    expected = portfolio_moments(Y_assets, Y_assets.loc[:"2010"].index[-1], "M", params['periods'])
+
+    assert np.allclose(mean, expected[0], atol=1e-12)
+    assert np.allclose(var_cov, expected[1], atol=1e-12)
+    assert (np.diag(var_cov) >= 0.0).all()
+
+
+def test_invalid_observations_are_not_added(data):
+    X_macro, macro_data, Y_assets = data
+    params = default_params(data, "2000 01 01", "2000 12 31")
+    state = ccp_service.service_state(dict(params, macro_data=macro_data.loc[:"1999"], Y_assets=Y_assets.loc[:"1999"]))
+
+    returns_date, nb_returns = state["returns_date"], state["nb_returns"]
+    returns = {"2000-01-31": Y_assets.loc["2000-01-31"].to_dict(), "2000-02-29": {"Equities": 0.01, "Unknown": 0.02}}
+
+    with pytest.raises(KeyError):
+        ccp_service.add_observations(state, macro={"2000-01-05": {X_macro.columns[0]: 0.1}}, returns=returns)
+
+    assert state["returns_date"] == returns_date
+    assert state["nb_returns"] == nb_returns
+    assert state["macro_date"] < pd.Timestamp("2000-01-05")
+
+
+# a JSON body which is not an object is answered with a 400 (the server keeps running)
+def test_post_invalid_body(data):
+    X_macro, macro_data, Y_assets = data
+    params = default_params(data, "2000 01 01", "2000 12 31")
+    state = ccp_service.service_state(dict(params, macro_data=macro_data.loc[:"1999"], Y_assets=Y_assets.loc[:"1999"]))
+
+    server = ccp_service.service_server(state, port=0)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    try:
+        connection = ccp_service.service_connection(server.server_address[1])
+
+        for body in [[], 1, "x"]:
+            status, answer = ccp_service.service_request(connection, "POST", "/observations", body)
+            assert status == 400
+            assert "error" in answer
+
+        status, answer = ccp_service.service_request(connection, "GET", "/health")
+        assert status == 200
+
+        connection.close()
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+# with momentum weighting, a POST with returns and macro observations gives the same state as the returns, then the macro
+# observations: the returns are credited to the portfolios chosen with the signals before the new macro observations
+def test_returns_before_macro(data):
+    X_macro, macro_data, Y_assets = data
+    params = default_params(data, "2000 01 01", "2000 12 31")
+    params['momentum_weighting'] = 0.3
+    params['reduce_indic'] = False
+
+    def state():
+        return ccp_service.service_state(dict(params, macro_data=macro_data.loc[:"1999"], Y_assets=Y_assets.loc[:"1999"]))
+
+    macro = {str(date.date()): row.dropna().to_dict() for date, row in macro_data.loc["2000-01":"2000-03"].iterrows()}
+    returns = {str(date.date()): row.to_dict() for date, row in Y_assets.loc["2000-01":"2000-03"].iterrows()}
+
+    combined = state()
+    ccp_service.add_observations(combined, macro=macro, returns=returns)
+
+    separate = state()
+    ccp_service.add_observations(separate, returns=returns)
+    ccp_service.add_observations(separate, macro=macro)
+
+    assert np.allclose(combined["momentum_weights"], separate["momentum_weights"], atol=1e-14)
+    assert ccp_service.current_allocation(combined) == ccp_service.current_allocation(separate)
@@ -0,0 +1,37 @@
+import pytest
+
+from ccp_functions import *
+import ccp_benchmark
+
+
+@pytest.fixture(scope="module")
+def data():
+    asset_classes, macro_data = ccp_benchmark.synthetic_data(20, 3, 2)
+    X_macro = data_lagged(macro_data, str(macro_data.index[0].date()), str(macro_data.index[-1].date()), "M", 1)
+
+    return X_macro, macro_data
+
+
+def test_intensity_matrix_equals_signal_intensity(data):
+    X_macro, macro_data = data
+    dates = X_macro.index[24:60]
+
+    intensities = intensity_matrix(X_macro, macro_data, dates, "quantile", 4)
+
+    for i, indicator in enumerate(X_macro.columns):
+        expected = [signal_intensity(X_macro[indicator], macro_data[indicator], date, "quantile", 4) for date in dates]
+        assert (intensities[:, i] == expected).all()
+
+
+# at the first date of X_macro, there is no history before the signal: the history must not wrap to the last date
+def test_intensity_matrix_without_history(data):
+    X_macro, macro_data = data
+
+    with pytest.raises(IndexError):
+        signal_intensity(X_macro.iloc[:, 0], macro_data.iloc[:, 0], X_macro.index[0])
+
+    with pytest.raises(IndexError):
+        intensity_matrix(X_macro, macro_data, X_macro.index[:3])
+
+    with pytest.raises(IndexError):
+        intensity_matrix(X_macro, compact_panel(macro_data), X_macro.index[:1])
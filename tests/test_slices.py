@@ -0,0 +1,42 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from ccp_functions import *
+import ccp_benchmark
+
+
+@pytest.fixture(scope="module")
+def Y_assets():
+    asset_classes, macro_data = ccp_benchmark.synthetic_data(20, 3, 2)
+
+    return data_returns(asset_classes, str(asset_classes.index[0].date()), str(asset_classes.index[-1].date()), "M", 1)
+
+
+# the slices are the returns over "periods" before date, as data.loc[:date].iloc[-periods:], with a DataFrame or a slice panel
+def test_data_slice_equals_loc(Y_assets):
+    panel = slice_panel(Y_assets)
+
+    for date in [Y_assets.index[0] - pd.Timedelta(days=1), Y_assets.index[5], Y_assets.index[100] + pd.Timedelta(days=3),
+                 Y_assets.index[-1]]:
+        expected = Y_assets.loc[:date].iloc[-36:]
+
+        pd.testing.assert_frame_equal(data_slice(Y_assets, date, 36), expected, check_freq=False)
+        pd.testing.assert_frame_equal(data_slice(panel, date, 36), expected, check_freq=False)
+
+
+# the slices are read-only windows on the values of the panel, the copies can be modified
+def test_data_slice_read_only(Y_assets):
+    panel = slice_panel(Y_assets)
+    window = data_slice(panel, Y_assets.index[100], 36)
+
+    assert np.shares_memory(window.values, panel["values"])
+    with pytest.raises(ValueError):
+        window.iloc[0, 0] = 1.0
+    with pytest.raises(ValueError):
+        window.values[0, 0] = 1.0
+
+    copied = data_slice(panel, Y_assets.index[100], 36, copy=True)
+    copied.iloc[0, 0] = 1.0
+    assert not np.shares_memory(copied.values, panel["values"])
+    assert panel["values"][65, 0] == Y_assets.iloc[65, 0] != 1.0
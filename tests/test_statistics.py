@@ -0,0 +1,26 @@
+import numpy as np
+import pandas as pd
+
+from ccp_functions import *
+
+
+# two strategies on different dates: the assets returns of each strategy are the ones of its own dates
+def test_returns_panel_dates_of_each_strategy():
+    dates = pd.date_range("2000-01-31", periods=24, freq="M")
+    Y_assets = pd.DataFrame(np.arange(72.0).reshape(24, 3), index=dates, columns=["Equities", "Bonds", "RFR"])
+
+    def results(period_dates):
+        return pd.DataFrame({"Equities": 0.5, "Bonds": 0.5, "RFR": 0.0, "Return": np.arange(len(period_dates)) / 100.0},
+                            index=period_dates)
+
+    strategies_results = [[results(dates[:12]), results(dates[12:])],
+                          [results(dates[3:12]), results(dates[15:20])]]
+
+    panel = returns_panel(strategies_results, Y_assets)
+
+    for i, strategy_results in enumerate(strategies_results):
+        for j, period_results in enumerate(strategy_results):
+            nb_dates = len(period_results)
+            assert (panel[i, j, :nb_dates, :3] == Y_assets.loc[period_results.index].values).all()
+            assert (panel[i, j, :nb_dates, 3] == period_results["Return"].values).all()
+            assert np.isnan(panel[i, j, nb_dates:]).all()
@@ -0,0 +1,83 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from ccp_functions import *
+import ccp_benchmark
+import ccp_project
+import ccp_validation
+
+
+@pytest.fixture(scope="module")
+def data():
+    asset_classes, macro_data = ccp_benchmark.synthetic_data(20, 3, 2)
+    first_date, last_date = str(macro_data.index[0].date()), str(macro_data.index[-1].date())
+
+    Y_assets = data_returns(asset_classes, first_date, last_date, "M", 1)
+    X_macro = data_lagged(macro_data, first_date, last_date, "M", 1)
+
+    return X_macro, macro_data, Y_assets
+
+
+# signals of the test dates of a split (the indicators one period before, see data_lagged) and days of the training set
+def split_days(split, index, lag=1):
+    test_dates = pd.DatetimeIndex(np.concatenate([pd.date_range(start, end, freq="M") for start, end in split["test"]]))
+
+    return test_dates.shift(-lag, freq="M"), index[ccp_validation.training_mask(index, split)]
+
+
+def test_purged_splits_dates():
+    splits = ccp_validation.purged_splits("1980 01 01", "1991 12 31", nb_groups=4, nb_test_groups=2)
+
+    assert [split["name"] for split in splits] == ["1+2", "1+3", "1+4", "2+3", "2+4", "3+4"]
+    assert splits[3]["test"] == [("1983-01-31", "1985-12-31"), ("1986-01-31", "1988-12-31")]
+
+    # the purge starts a year before the first signal of the group (one period before it), the embargo ends a year after it
+    assert splits[3]["excluded"] == [(pd.Timestamp("1981-12-31"), pd.Timestamp("1986-12-31")),
+                                     (pd.Timestamp("1984-12-31"), pd.Timestamp("1989-12-31"))]
+
+    index = pd.date_range("1979 01 01", "1992 12 31", freq="D")
+    training = index[ccp_validation.training_mask(index, splits[3])]
+    assert training[training < "1985"].max() == pd.Timestamp("1981-12-30")
+    assert training[training > "1985"].min() == pd.Timestamp("1990-01-01")
+
+
+# the one-year changes of the training set share no data with the signals of the test groups: every training day is
+# at least a year before or after each signal
+def test_purged_splits_no_overlap():
+    index = pd.date_range("1979 01 01", "1992 12 31", freq="D")
+
+    for split in ccp_validation.purged_splits("1980 01 01", "1991 12 31", nb_groups=6, nb_test_groups=2):
+        signal_dates, training = split_days(split, index)
+        distances = np.abs(training.values[:, None] - signal_dates.values[None, :])
+
+        assert (distances > pd.Timedelta(days=365).to_timedelta64()).all()
+
+    # without the lag, the training days just before the purge overlap the lookback of the first signal
+    split = ccp_validation.purged_splits("1980 01 01", "1991 12 31", nb_groups=6, nb_test_groups=2, lag=0)[5]
+    signal_dates, training = split_days(split, index)
+    assert (np.abs(training.values[:, None] - signal_dates.values[None, :]) <= pd.Timedelta(days=365).to_timedelta64()).any()
+
+
+def test_purged_cross_validation(data):
+    X_macro, macro_data, Y_assets = data
+    params = ccp_project.default_params(X_macro, macro_data, Y_assets, "1975 01 01", "1986 12 31", "M")
+    params['directions'] = ccp_benchmark.synthetic_directions(X_macro.columns, Y_assets.columns[:-1])
+    params['reduce_indic'] = False
+
+    splits = ccp_validation.purged_splits("1975 01 01", "1986 12 31", nb_groups=3, nb_test_groups=1)
+    results = ccp_validation.purged_cross_validation(params, splits)
+
+    assert results.index.get_level_values("Split").unique().tolist() == ["1", "2", "3"]
+    assert np.isfinite(results.xs("Strategy", level="Assets").values).all()
+
+    # the intensities of a split only use the history of its training set: changing the test and excluded days of the
+    # history does not change them
+    split = splits[1]
+    history = macro_data.copy()
+    for start, end in split["excluded"]:
+        history.loc[start:end] *= -3.0
+
+    expected = ccp_validation.split_intensities(params, split)
+    intensities = ccp_validation.split_intensities(dict(params, macro_data=history), split)
+    assert all((a == b).all() for a, b in zip(expected, intensities))
@@ -0,0 +1,76 @@
+import asyncio
+import os
+import shutil
+
+import openpyxl
+import pandas as pd
+import pytest
+
+import ccp_data
+import ccp_watcher
+
+
+repository = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+workbooks = ["Asset classes.xlsx", "Currencies.xlsx", "Cycle.xlsx", "Policy.xlsx"]
+
+
+# copy of the data folder of the repository
+@pytest.fixture
+def folder(tmp_path):
+    for filename in workbooks:
+        shutil.copy(os.path.join(repository, filename), tmp_path / filename)
+
+    return str(tmp_path) + os.sep
+
+
+# multiplies the last value of a sheet by factor
+def update_sheet(folder, filename, sheet, factor):
+    workbook = openpyxl.load_workbook(os.path.join(folder, filename))
+    worksheet = workbook[sheet]
+    cell = worksheet.cell(row=worksheet.max_row, column=2)
+    cell.value = cell.value * factor
+    workbook.save(os.path.join(folder, filename))
+
+
+def test_refresh_of_the_indicators_of_a_file(folder):
+    state = ccp_watcher.watcher_state(folder)
+    version, macro_data = ccp_watcher.current_panel(state)
+
+    assert version == 1
+    pd.testing.assert_frame_equal(macro_data, ccp_data.load_macro_data(folder, state["dtindex"]))
+
+    update_sheet(folder, "Cycle.xlsx", "GDPG", 2.0)
+    new_version, names = ccp_watcher.ingest_files(state, ["Cycle.xlsx"])
+
+    assert (new_version, sorted(names)) == (2, ["Growth", "Inflation"])
+    pd.testing.assert_frame_equal(ccp_watcher.current_panel(state)[1], ccp_data.load_macro_data(folder, state["dtindex"]))
+    assert not ccp_watcher.current_panel(state)[1]["Growth"].equals(macro_data["Growth"])
+
+    # the filenames are matched without case
+    assert sorted(ccp_watcher.ingest_files(state, ["policy.XLSX"])[1]) == ["Monetary Policy"]
+
+
+def test_corrupt_file_is_retried(folder):
+    state = ccp_watcher.watcher_state(folder)
+    version, macro_data = ccp_watcher.current_panel(state)
+    signature = state["signatures"]["Cycle.xlsx"]
+
+    with open(os.path.join(folder, "Cycle.xlsx"), "wb") as f:
+        f.write(b"not a workbook")
+
+    errors, published = [], []
+    asyncio.run(ccp_watcher.watch_folder(state, 0.01, lambda version, names: published.append(version), max_polls=5,
+                                         on_error=lambda filenames, error: errors.append(filenames)))
+
+    # the watcher is still running, the previous version is served, and the file will be ingested again
+    assert len(errors) >= 2 and errors[0] == ["Cycle.xlsx"]
+    assert published == []
+    assert ccp_watcher.current_panel(state) == (version, macro_data)
+    assert state["signatures"]["Cycle.xlsx"] == signature
+    assert ("Cycle.xlsx", "GDPG") in state["sheets"]
+
+    shutil.copy(os.path.join(repository, "Cycle.xlsx"), os.path.join(folder, "Cycle.xlsx"))
+    asyncio.run(ccp_watcher.watch_folder(state, 0.01, lambda version, names: published.append(version), max_polls=5))
+
+    assert published == [2]
+    pd.testing.assert_frame_equal(ccp_watcher.current_panel(state)[1], macro_data)